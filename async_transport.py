@@ -0,0 +1,18 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Транспорт для асинхронного режима: синхронный вызов вставки в пуле потоков.
+# Любой объект с корутинами insert(batch) и close() может заменить его
+# (например, обертка над асинхронным клиентом ClickHouse)
+class ExecutorTransport:
+    def __init__(self, insert_func, max_in_flight):
+        self.insert_func = insert_func
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='Insert')
+
+    async def insert(self, batch):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.insert_func, batch)
+
+    async def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,72 @@
+import logging
+import statistics
+import time
+
+from tabulate import tabulate
+
+from fake_clickhouse import FakeServer
+from insert_simulator import CONFIG, LogSimulator, AsyncLogSimulator
+from load_controller import percentile
+
+WORKER_COUNTS = [3, 16, 64]
+DURATION_SEC = 10
+
+BENCH_CONFIG = {
+    **CONFIG,
+    'duration_minutes': DURATION_SEC / 60,
+    'min_batch_size': 500,
+    'max_batch_size': 500,
+    # Генератор работает без пауз: предел задает только конвейер вставки
+    'min_delay_sec': 0.0,
+    'max_delay_sec': 0.0,
+}
+
+# Параметры имитации сервера
+SERVER_CONFIG = {
+    'base_latency': 0.02,
+    'per_row_latency': 0.00002,
+    'max_concurrent_queries': 100,
+}
+
+
+def run(mode, workers):
+    server = FakeServer(**SERVER_CONFIG)
+    config = {
+        **BENCH_CONFIG,
+        'workers_count': workers,
+        'max_in_flight': workers,
+        'max_queue_size': workers * 2,
+    }
+    if mode == 'async':
+        simulator = AsyncLogSimulator(config, client_factory=server.client)
+    else:
+        simulator = LogSimulator(config, client_factory=server.client)
+    start = time.perf_counter()
+    simulator.simulate_load()
+    duration = time.perf_counter() - start
+
+    latencies = simulator.insert_latencies
+    return [
+        mode, workers, simulator.inserted_rows,
+        f"{simulator.inserted_rows / duration:.0f}",
+        f"{statistics.median(latencies) * 1000:.1f}",
+        f"{percentile(latencies, 99) * 1000:.1f}",
+    ]
+
+
+def main():
+    # Логирование каждого пакета искажает замеры
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for workers in WORKER_COUNTS:
+        for mode in ('thread', 'async'):
+            print(f"Running {mode} mode with {workers} workers for {DURATION_SEC} sec...")
+            results.append(run(mode, workers))
+
+    print(tabulate(results, headers=['Mode', 'Workers', 'Rows', 'Rows/sec', 'p50 (ms)', 'p99 (ms)'],
+                   tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
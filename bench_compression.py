@@ -0,0 +1,146 @@
+import csv
+import sys
+import time
+import uuid
+
+from clickhouse_driver import errors as ch_errors
+from tabulate import tabulate
+
+import insert_queries
+from transport_settings import COMPRESSION_METHODS, LOW_CARDINALITY_COLUMNS, TransportSettings
+from log_reader import read_log_blocks
+from query_log_collector import QueryLogCollector, log_comment_variant
+
+LOG_FILE = 'data/logs_data_3_000.csv'
+BLOCK_SIZE = 1000
+BASELINE_FILE = 'results/test_insert.csv'
+RESULTS_FILE = 'results/test_insert_compression.csv'
+METHODS = {
+    'single': insert_queries.insert_single,
+    'bulk': insert_queries.insert_bulk,
+    'buffer': insert_queries.insert_buffer,
+    'native': insert_queries.insert_native,
+}
+# Варианты: description как String или LowCardinality (словарь строит драйвер) x сжатие
+VARIANTS = [(low_cardinality_columns, compression)
+            for low_cardinality_columns in [(), LOW_CARDINALITY_COLUMNS]
+            for compression in COMPRESSION_METHODS]
+# Таблицы skripts/test_insert.sql с такими же типами колонок, как у варианта
+TABLES = {(): 'logs_insert_test', LOW_CARDINALITY_COLUMNS: 'logs_insert_dict'}
+
+
+def variant_name(low_cardinality_columns, compression):
+    return '+'.join(['lowcard'] * bool(low_cardinality_columns) + [compression or 'none'])
+
+
+# Без сервера: байты блока INSERT и процессорное время на строку по сериализации драйвера
+def measure_wire(file_path):
+    results = []
+    raw_bytes = None
+    for low_cardinality_columns, compression in VARIANTS:
+        transport = TransportSettings(low_cardinality_columns, compression)
+        total_bytes = rows = cpu = 0
+        try:
+            for block in read_log_blocks(file_path, BLOCK_SIZE):
+                size, elapsed = transport.measure(block)
+                total_bytes += size
+                cpu += elapsed
+                rows += len(block)
+        except (ch_errors.UnknownCompressionMethod, RuntimeError) as e:
+            results.append([variant_name(low_cardinality_columns, compression), '-', '-', '-', str(e)])
+            continue
+        raw_bytes = raw_bytes or total_bytes
+        results.append([
+            variant_name(low_cardinality_columns, compression),
+            f"{total_bytes / rows:.1f}",
+            f"{raw_bytes / total_bytes:.2f}",
+            f"{cpu / rows * 1e6:.2f}",
+            '',
+        ])
+    print(tabulate(results, headers=['Variant', 'Wire bytes/row', 'Ratio vs none', 'CPU us/row', 'Note'],
+                   tablefmt='grid'))
+
+
+def load_baseline(filename):
+    with open(filename, 'r', newline='') as f:
+        return {row['Method']: float(row['Rows/sec']) for row in csv.DictReader(f)}
+
+
+def server_stats(client, log_comment):
+    # Байты, принятые сервером, и его процессорное время по запросам INSERT прогона
+    client.execute("SYSTEM FLUSH LOGS")
+    rows = client.execute("""
+        SELECT
+            sum(ProfileEvents['NetworkReceiveBytes']),
+            sum(ProfileEvents['UserTimeMicroseconds'])
+        FROM system.query_log
+        WHERE type = 'QueryFinish'
+          AND query_kind = 'Insert'
+          AND event_date >= yesterday()
+          AND log_comment = %(log_comment)s
+    """, {'log_comment': log_comment})
+    return rows[0] if rows else (0, 0)
+
+
+# С сервером: методы insert_queries для каждого варианта, сдвиг относительно results/test_insert.csv
+def measure_server(file_path, methods):
+    baseline = load_baseline(BASELINE_FILE)
+    run_id = uuid.uuid4().hex[:8]
+    results = []
+    collector = QueryLogCollector('insert_compression', run_id=run_id, log_comment_prefix=run_id,
+                                  variant=log_comment_variant, config=insert_queries.CH_CONFIG).start()
+    for method in methods:
+        for low_cardinality_columns, compression in VARIANTS:
+            name = variant_name(low_cardinality_columns, compression)
+            table = TABLES[low_cardinality_columns]
+            if method == 'buffer' and table != insert_queries.TARGET_TABLE:
+                # Буферная таблица сбрасывает строки только в logs_insert_test
+                continue
+            log_comment = f"{run_id}-{method}-{name}"
+            transport = TransportSettings(low_cardinality_columns, compression)
+            try:
+                client = insert_queries.connect(**transport.client_settings(),
+                                                settings={'log_comment': log_comment})
+                cpu_start = time.process_time()
+                # Буферная вставка всегда идет в logs_buffer
+                options = {} if method == 'buffer' else {'table': table}
+                # Файл читается потоково; чтение и разбор CSV не входят ни во время вставки,
+                # ни в процессорное время клиента
+                blocks = insert_queries.read_csv_file(file_path, BLOCK_SIZE)
+                duration, rows = METHODS[method](blocks, **options)
+                cpu = time.process_time() - cpu_start - blocks.read_cpu_sec
+                received, server_cpu = server_stats(client, log_comment)
+                client.execute(f"TRUNCATE TABLE {table}")
+            except (ch_errors.UnknownCompressionMethod, RuntimeError) as e:
+                print(f"Skipping {method} {name}: {e}")
+                continue
+            rows_per_sec = rows / duration
+            results.append([
+                method, name, f"{duration:.2f}", f"{rows_per_sec:.0f}",
+                f"{rows_per_sec / baseline[method]:.2f}" if method in baseline else '-',
+                f"{(received or 0) / rows:.1f}",
+                f"{cpu / rows * 1e6:.2f}",
+                f"{(server_cpu or 0) / rows:.2f}",
+            ])
+
+    collector.stop()
+    headers = ['Method', 'Variant', 'Time (sec)', 'Rows/sec', 'vs baseline', 'Received bytes/row',
+               'Client CPU us/row', 'Server CPU us/row']
+    print(tabulate(results, headers=headers, tablefmt='grid'))
+    with open(RESULTS_FILE, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(results)
+    print(f"\nResults saved to {RESULTS_FILE}")
+
+
+def main():
+    # --server: прогон методов insert_queries на реальном ClickHouse, --single: включая одиночные вставки
+    measure_wire(LOG_FILE)
+    if '--server' in sys.argv:
+        methods = [method for method in METHODS if method != 'single' or '--single' in sys.argv]
+        measure_server(LOG_FILE, methods)
+
+
+if __name__ == "__main__":
+    main()
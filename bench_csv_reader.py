@@ -0,0 +1,106 @@
+import csv
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from tabulate import tabulate
+
+from log_reader import read_log_blocks
+
+SOURCE_FILE = 'data/logs_data_3_000.csv'
+BENCH_FILE = 'data/logs_bench.csv'
+NUM_ROWS = 10_000_000
+BLOCK_SIZE = 10000
+
+
+# Большой CSV получаем повторением строк исходного файла
+def generate_bench_file(num_rows, source=SOURCE_FILE, target=BENCH_FILE):
+    with open(source, 'r', newline='') as f:
+        header, *rows = list(csv.reader(f))
+
+    with open(target, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        written = 0
+        while written < num_rows:
+            chunk = rows[:num_rows - written]
+            writer.writerows(chunk)
+            written += len(chunk)
+    return target
+
+
+# Старый insert_queries.read_csv_file: весь файл в памяти в виде словарей
+def read_dicts(file_path):
+    data = []
+    with open(file_path, 'r') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            data.append({
+                'timestamp': datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S'),
+                'login': row['login'],
+                'event': row['event'],
+                'subsystem': row['subsystem'],
+                'comment': row['comment'],
+                'description': row['description']
+            })
+    return len(data)
+
+
+# Старый LogSimulator.read_logs: DictReader + strptime без накопления
+def read_dicts_streaming(file_path):
+    rows = 0
+    with open(file_path, 'r') as f:
+        for row in csv.DictReader(f):
+            datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
+            rows += 1
+    return rows
+
+
+def read_blocks(file_path):
+    return sum(len(block) for block in read_log_blocks(file_path, BLOCK_SIZE))
+
+
+READERS = {
+    'read_csv_file (DictReader, list)': read_dicts,
+    'read_logs (DictReader, stream)': read_dicts_streaming,
+    'read_log_blocks': read_blocks,
+}
+
+
+# Каждый способ запускается в отдельном процессе, чтобы пиковый RSS не смешивался
+def run_reader(args):
+    name, file_path = args
+    start = time.perf_counter()
+    rows = READERS[name](file_path)
+    duration = time.perf_counter() - start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return name, rows, duration, peak_rss_mb
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROWS
+    print(f"Generating {num_rows} rows into {BENCH_FILE}...")
+    file_path = generate_bench_file(num_rows)
+    size_mb = os.path.getsize(file_path) / 1024 / 1024
+
+    results = []
+    try:
+        for name in READERS:
+            with Pool(1, maxtasksperchild=1) as pool:
+                name, rows, duration, peak_rss_mb = pool.apply(run_reader, ((name, file_path),))
+            results.append([name, rows, f"{duration:.2f}", f"{size_mb / duration:.1f}",
+                            f"{rows / duration:.0f}", f"{peak_rss_mb:.0f}"])
+            print(f"{name}: {duration:.2f} sec")
+    finally:
+        os.remove(file_path)
+
+    print(f"\nFile size: {size_mb:.1f} MB")
+    print(tabulate(results, headers=['Reader', 'Rows', 'Time (sec)', 'MB/s', 'Rows/sec', 'Peak RSS (MB)'],
+                   tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import csv
+import time
+from datetime import datetime
+from itertools import cycle, islice
+
+from tabulate import tabulate
+
+from columnar_batch import ColumnarBatch, LOG_COLUMNS
+
+LOG_FILE = 'data/logs_data_3_000.csv'
+BATCH_SIZES = [100, 500, 1000, 5000, 10000]
+TOTAL_ROWS = 200000
+
+
+# Заглушка clickhouse_driver.Client: повторяет только разбор данных драйвером
+class StubClient:
+    def __init__(self):
+        self.rows = 0
+
+    def execute(self, query, params=None, columnar=False, **kwargs):
+        # Драйвер транспонирует строки в колонки перед сериализацией блока
+        columns = params if columnar else list(zip(*params))
+        self.rows += len(columns[0])
+        return None
+
+
+def load_rows(file_path):
+    with open(file_path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = []
+        for row in reader:
+            row[0] = datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S')
+            rows.append(row)
+    return rows
+
+
+# Старый путь: словари -> списки колонок -> кортежи строк
+def insert_rows_legacy(client, logs, batch_size):
+    source = cycle(dict(zip(LOG_COLUMNS, row)) for row in logs)
+    for _ in range(TOTAL_ROWS // batch_size):
+        batch = list(islice(source, batch_size))
+        columns = [
+            ('timestamp', [log['timestamp'] for log in batch]),
+            ('login', [log['login'] for log in batch]),
+            ('event', [log['event'] for log in batch]),
+            ('subsystem', [log['subsystem'] for log in batch]),
+            ('comment', [log['comment'] for log in batch]),
+            ('description', [log['description'] for log in batch])
+        ]
+        data = [tuple(col[1][i] for col in columns) for i in range(len(batch))]
+        client.execute("INSERT INTO logs_insert_test VALUES", data)
+
+
+# Новый путь: строки раскладываются прямо в буферы ColumnarBatch
+def insert_rows_columnar(client, logs, batch_size):
+    source = cycle(logs)
+    batch = ColumnarBatch(batch_size)
+    for _ in range(TOTAL_ROWS // batch_size):
+        batch.reset()
+        batch.fill(source)
+        client.execute(batch.insert_query('logs_insert_test'), batch.data(), columnar=True)
+
+
+def measure(insert_func, logs, batch_size):
+    client = StubClient()
+    start = time.perf_counter()
+    insert_func(client, logs, batch_size)
+    duration = time.perf_counter() - start
+    return client.rows / duration
+
+
+def main():
+    logs = load_rows(LOG_FILE)
+    print(f"Loaded {len(logs)} rows from file, {TOTAL_ROWS} rows per measurement")
+
+    results = []
+    for batch_size in BATCH_SIZES:
+        legacy = measure(insert_rows_legacy, logs, batch_size)
+        columnar = measure(insert_rows_columnar, logs, batch_size)
+        results.append([batch_size, f"{legacy:.0f}", f"{columnar:.0f}", f"{columnar / legacy:.2f}x"])
+
+    print(tabulate(results, headers=['Batch size', 'Legacy rows/sec', 'Columnar rows/sec', 'Speedup'],
+                   tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import cProfile
+import logging
+import pstats
+import random
+import sys
+import threading
+import time
+
+from clickhouse_driver.errors import ErrorCodes
+from tabulate import tabulate
+
+from columnar_server import ColumnarServer
+from connection_pool import ConnectionPool
+from insert_simulator import CONFIG, create_simulator
+from load_controller import percentile
+from retry_policy import SERVER_OVERLOADED, RetryPolicy
+from select_queries import load_workload
+
+# Прогон клиентского кода (чтение и пакетирование, пул, повторы, выполнение запросов)
+# против columnar_server.ColumnarServer без ClickHouse. Сбои и задержки сервера
+# воспроизводимы: seed фиксирован
+SERVER_CONFIG = {
+    'base_latency': 0.002,
+    'per_row_latency': 0.0000005,
+    'per_granule_latency': 0.00002,
+    'max_concurrent_queries': 8,
+    'error_rate': 0.02,
+    'error_codes': {SERVER_OVERLOADED: 3, ErrorCodes.TIMEOUT_EXCEEDED: 1},
+    'seed': 1,
+}
+
+TABLE = 'logs_insert_test'
+# Схема как у logs_ordered (skripts/select_optimization.sql), гранулы помельче под объем CSV
+TABLE_DDL = f"""
+    CREATE TABLE {TABLE} (
+        timestamp DateTime,
+        login LowCardinality(String),
+        event LowCardinality(String),
+        subsystem LowCardinality(String),
+        comment String,
+        description String
+    ) ENGINE = MergeTree()
+    ORDER BY (timestamp, login, event, subsystem)
+    SETTINGS index_granularity = 1024
+"""
+
+BENCH = {
+    'insert_sec': 15,
+    'select_sec': 15,
+    'select_clients': 4,
+    'workload_files': 'queries_select/*.txt',
+}
+
+INSERT_CONFIG = {
+    **CONFIG,
+    'target_table': TABLE,
+    'duration_minutes': BENCH['insert_sec'] / 60,
+    'min_delay_sec': 0.0,
+    'max_delay_sec': 0.01,
+    'retry': {**CONFIG['retry'], 'base_delay_sec': 0.01},
+    'metrics': {**CONFIG['metrics'], 'enabled': False},
+}
+
+
+def select_client(pool, policy, conditions, deadline, seed, samples, profile):
+    if profile:
+        profile.enable()
+    rng = random.Random(seed)
+    while time.time() < deadline:
+        query = f"SELECT count(*) FROM {TABLE} WHERE {rng.choice(conditions)}"
+        conn = pool.get_connection()
+        start = time.perf_counter()
+        try:
+            policy.execute(conn, query)
+            samples.append(time.perf_counter() - start)
+        except Exception:
+            samples.append(None)
+        finally:
+            pool.return_connection(conn)
+    if profile:
+        profile.disable()
+
+
+def run_inserts(server, profile):
+    simulator = create_simulator(INSERT_CONFIG, client_factory=server.client)
+    start = time.time()
+    if profile:
+        profile.enable()
+    simulator.simulate_load()
+    if profile:
+        profile.disable()
+    elapsed = time.time() - start
+    counters = simulator.retry_policy.snapshot()
+    return ['insert', len(simulator.insert_latencies), simulator.inserted_rows, elapsed,
+            percentile(simulator.insert_latencies, 50) * 1000, percentile(simulator.insert_latencies, 99) * 1000,
+            counters['retries'], counters['failures'], '-']
+
+
+def run_selects(server, profiles):
+    conditions = load_workload(BENCH['workload_files'])
+    clients = BENCH['select_clients']
+    pool = ConnectionPool({}, max_size=clients, client_factory=server.client)
+    policy = RetryPolicy(base_delay_sec=0.01, rng=random.Random(1))
+    deadline = time.time() + BENCH['select_sec']
+    samples = [[] for _ in range(clients)]
+    threads = [threading.Thread(target=select_client,
+                                args=(pool, policy, conditions, deadline, i, samples[i], profiles[i]))
+               for i in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    pool.close_all()
+
+    latencies = [latency for client in samples for latency in client if latency is not None]
+    counters = policy.snapshot()
+    stats = server.stats
+    pruned = 1 - stats['granules_read'] / stats['granules_total'] if stats['granules_total'] else 0.0
+    return ['select', len(latencies), stats['read_rows'], elapsed, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, counters['retries'], counters['failures'], f"{pruned:.1%}"]
+
+
+def main():
+    # python bench_offline.py [--profile] - с --profile в конце выводятся самые дорогие
+    # функции клиентского кода (cProfile по потоку генератора вставок и потокам SELECT).
+    # Rows - вставленные строки для insert и прочитанные сервером для select
+    logging.getLogger().setLevel(logging.ERROR + 10)
+    profile = '--profile' in sys.argv
+    server = ColumnarServer(tables=[TABLE_DDL], **SERVER_CONFIG)
+    profiles = [cProfile.Profile() if profile else None for _ in range(BENCH['select_clients'] + 1)]
+
+    print(f"Inserting into stand-in server for {BENCH['insert_sec']} sec...")
+    results = [run_inserts(server, profiles[0])]
+    # SELECT-ы не должны делить время с отложенными слияниями вставок
+    server.tables[TABLE].wait_merges()
+    print(f"Running {BENCH['select_clients']} select clients for {BENCH['select_sec']} sec...")
+    results.append(run_selects(server, profiles[1:]))
+
+    table = [[phase, queries, rows, f"{queries / elapsed:.1f}", f"{rows / elapsed:.0f}", f"{p50:.2f}", f"{p99:.2f}",
+              retries, failures, pruned]
+             for phase, queries, rows, elapsed, p50, p99, retries, failures, pruned in results]
+    print(tabulate(table, headers=['Phase', 'Queries', 'Rows', 'Queries/sec', 'Rows/sec', 'p50 (ms)', 'p99 (ms)',
+                                   'Retries', 'Failures', 'Granules pruned'], tablefmt='grid'))
+    print(f"Server: {server.queries} queries, {server.errors} injected errors, "
+          f"{server.tables[TABLE].rows} rows in {len(server.tables[TABLE].parts)} parts")
+
+    if profile:
+        stats = pstats.Stats(profiles[0])
+        for other in profiles[1:]:
+            stats.add(other)
+        # Собственное время функций без кода самого сервера-заглушки
+        stats.sort_stats('tottime').print_stats(r'^(?!.*(columnar_server|fake_clickhouse|numpy|time.sleep))', 25)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import logging
+import sys
+import time
+from datetime import datetime
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from columnar_batch import LOG_COLUMNS
+from fake_clickhouse import FakeServer
+from insert_simulator import CONFIG, create_simulator
+from load_controller import percentile
+from partition_buffer import partition_function
+from query_log_collector import QueryLogCollector
+
+TABLE = 'logs_partitioned'
+# Выражение PARTITION BY таблицы logs_partitioned (skripts/select_optimization.sql)
+EXPRESSION = 'toYear(timestamp) * 10 + (toMonth(timestamp) > 6)'
+# Сколько ждать фоновых слияний после прогона перед чтением system.part_log
+MERGE_WAIT_SEC = 30
+
+PARTITIONED_CONFIG = {
+    **CONFIG,
+    'target_table': TABLE,
+    'duration_minutes': 0.25,
+    'min_delay_sec': 0.0,
+    'max_delay_sec': 0.05,
+}
+
+VARIANTS = {
+    'random batches': {'enabled': False},
+    'by partition': {'enabled': True},
+}
+
+
+# FakeServer, который считает куски: одна вставка создает по куску в каждой задетой партиции
+class PartCountingServer(FakeServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        used, self.key = partition_function(EXPRESSION, LOG_COLUMNS)
+        self.key_indexes = [LOG_COLUMNS.index(name) for name in used]
+        self.parts = 0
+
+    def execute(self, query, params=None, columnar=False, **kwargs):
+        result = super().execute(query, params, columnar=columnar, **kwargs)
+        if params and columnar and query.lstrip().upper().startswith('INSERT'):
+            parts = len(set(map(self.key, *[params[i] for i in self.key_indexes])))
+            with self.lock:
+                self.parts += parts
+        return result
+
+
+def part_log(conn, start):
+    conn.execute("SYSTEM FLUSH LOGS")
+    rows = conn.execute("""
+        SELECT
+            countIf(event_type = 'NewPart'),
+            countIf(event_type = 'MergeParts'),
+            sumIf(ProfileEvents['UserTimeMicroseconds'] + ProfileEvents['SystemTimeMicroseconds'],
+                  event_type = 'MergeParts') / 1e6
+        FROM system.part_log
+        WHERE database = currentDatabase() AND table = %(table)s AND event_time >= %(start)s
+    """, {'table': TABLE, 'start': start})
+    return rows[0]
+
+
+def run(name, partitioning, fake):
+    config = {**PARTITIONED_CONFIG, 'partitioning': {**CONFIG['partitioning'], **partitioning}}
+    if fake:
+        server = PartCountingServer()
+        config['partitioning']['expression'] = config['partitioning']['expression'] or EXPRESSION
+        simulator = create_simulator(config, client_factory=server.client)
+    else:
+        conn = Client(**CONFIG['ch_config'])
+        conn.execute(f"TRUNCATE TABLE {TABLE}")
+        start = datetime.now().replace(microsecond=0)
+        # Вставки прогона в benchmark_query_log, вариант - способ формирования пакетов
+        collector = QueryLogCollector('partition', tables=[TABLE], variant=lambda row: name,
+                                      config=CONFIG['ch_config']).start()
+        simulator = create_simulator(config)
+
+    simulator.simulate_load()
+    duration = config['duration_minutes'] * 60
+
+    if fake:
+        parts, merges, merge_cpu = server.parts, '-', '-'
+    else:
+        # Слияния идут в фоне и после окончания вставок
+        collector.stop()
+        time.sleep(MERGE_WAIT_SEC)
+        parts, merges, merge_cpu = part_log(conn, start)
+        merge_cpu = f"{merge_cpu:.2f}"
+        conn.disconnect()
+
+    return [name, simulator.inserted_rows, f"{simulator.inserted_rows / duration:.0f}", parts,
+            f"{parts / duration:.1f}", f"{simulator.inserted_rows / parts if parts else 0:.0f}", merges, merge_cpu,
+            f"{percentile(simulator.delivery_latencies, 99) * 1000:.0f}"]
+
+
+def main():
+    # --fake: вместо сервера PartCountingServer, куски считаются на стороне клиента,
+    # слияния и их CPU не измеряются
+    fake = '--fake' in sys.argv
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    for name, partitioning in VARIANTS.items():
+        print(f"Running '{name}' into {TABLE}...")
+        results.append(run(name, partitioning, fake))
+    print(tabulate(results, headers=['Batching', 'Rows', 'Rows/sec', 'New parts', 'Parts/sec', 'Rows/part',
+                                     'Merges', 'Merge CPU (s)', 'Delivery p99 (ms)'], tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
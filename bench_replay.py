@@ -0,0 +1,92 @@
+import logging
+import sys
+import time
+from datetime import datetime
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from fake_clickhouse import FakeServer
+from insert_simulator import CONFIG, create_simulator
+from load_controller import percentile
+
+# Таблица для вставки -> таблица, в которой создаются куски
+TARGET_TABLES = {
+    'logs_insert_test': 'logs_insert_test',
+    'logs_buffer': 'logs_insert_test',
+    'logs_partitioned': 'logs_partitioned',
+}
+
+PROFILES = {
+    'diurnal': {'type': 'diurnal', 'period_sec': 60, 'min_factor': 0.2, 'max_factor': 3.0},
+    'spike': {'type': 'spike', 'every_sec': 30, 'duration_sec': 5, 'factor': 20.0},
+    'step': {'type': 'step', 'steps': [[0, 1.0], [20, 5.0], [40, 10.0]]},
+}
+
+REPLAY_CONFIG = {
+    **CONFIG,
+    'load_mode': 'replay',
+    'duration_minutes': 1,
+}
+
+
+def parts_activity(client, table, start_time):
+    # Созданные куски и слияния за время прогона по system.part_log
+    client.execute("SYSTEM FLUSH LOGS")
+    rows = client.execute("""
+        SELECT
+            countIf(event_type = 'NewPart'),
+            countIf(event_type = 'MergeParts')
+        FROM system.part_log
+        WHERE database = currentDatabase()
+          AND table = %(table)s
+          AND event_time >= %(start_time)s
+    """, {'table': table, 'start_time': start_time})
+    return rows[0] if rows else (0, 0)
+
+
+def run(table, profile_name, fake):
+    config = {
+        **REPLAY_CONFIG,
+        'target_table': table,
+        'replay': {**CONFIG['replay'], 'profile': PROFILES[profile_name]},
+    }
+    simulator = create_simulator(config, client_factory=FakeServer().client if fake else Client)
+
+    start_time = datetime.now().replace(microsecond=0)
+    start = time.perf_counter()
+    simulator.simulate_load()
+    duration = time.perf_counter() - start
+
+    new_parts, merges = ('-', '-')
+    if not fake:
+        client = Client(**CONFIG['ch_config'])
+        new_parts, merges = parts_activity(client, TARGET_TABLES[table], start_time)
+        client.disconnect()
+
+    return [
+        table, profile_name, simulator.inserted_rows,
+        f"{simulator.inserted_rows / duration:.0f}",
+        f"{percentile(simulator.insert_latencies, 99) * 1000:.1f}",
+        f"{percentile(simulator.delivery_latencies, 99) * 1000:.1f}",
+        new_parts, merges,
+    ]
+
+
+def main():
+    # --fake: прогон против fake_clickhouse.FakeServer без реального сервера
+    fake = '--fake' in sys.argv
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for table in TARGET_TABLES:
+        for profile_name in PROFILES:
+            print(f"Replaying into {table} with {profile_name} profile...")
+            results.append(run(table, profile_name, fake))
+
+    print(tabulate(results, headers=['Table', 'Profile', 'Rows', 'Rows/sec', 'Insert p99 (ms)',
+                                     'Delivery p99 (ms)', 'New parts', 'Merges'], tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import csv
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from connection_pool import ConnectionPool
+from insert_simulator import CONFIG, create_simulator
+from load_controller import percentile
+from query_log_collector import RESULT_TABLE, QueryLogCollector, log_comment_variant
+from result_cache import CACHE, ResultCache, Watermarks
+from retry_policy import execute_with_retry
+from select_queries import load_workload
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+
+# Дашборд: clients клиентов повторяют запросы из queries_select/*.txt, пока симулятор
+# воспроизводит логи файла по времени в отдельную таблицу (новые строки приходят
+# в возрастающем диапазоне timestamp, как в живой системе)
+BENCH = {
+    'source_table': 'logs_with_indexes_v2',   # Схема таблицы для прогона
+    'table': 'result_cache_logs',
+    'clients': 8,
+    'duration_sec': 60,
+    'workload_files': 'queries_select/*.txt',
+    # no_cache - все запросы на сервер; table - вставка сбрасывает все записи таблицы;
+    # range - только записи с пересекающимся диапазоном timestamp
+    'modes': ['no_cache', 'table', 'range'],
+    'results_file': 'results/result_cache.csv',
+}
+
+SIMULATOR_CONFIG = {
+    **CONFIG,
+    'target_table': BENCH['table'],
+    'duration_minutes': BENCH['duration_sec'] / 60,
+    'load_mode': 'replay',
+    'replay': {**CONFIG['replay'], 'profile': {'type': 'constant'}},
+    'metrics': {**CONFIG['metrics'], 'enabled': False},
+}
+
+
+def dashboard_client(cache, pool, table, conditions, stop, latencies):
+    while not stop.is_set():
+        query = f"SELECT count(*) FROM {table} WHERE {random.choice(conditions)}"
+        start = time.perf_counter()
+        try:
+            if cache:
+                cache.execute(table, query)
+            else:
+                conn = pool.get_connection()
+                try:
+                    execute_with_retry(conn, query)
+                finally:
+                    pool.return_connection(conn)
+        except Exception as e:
+            logging.warning(f"Dashboard query failed: {e}")
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def run_mode(mode, run_id, conditions):
+    table = BENCH['table']
+    conn = Client(**CH_CONFIG)
+    execute_with_retry(conn, f"DROP TABLE IF EXISTS {table}")
+    execute_with_retry(conn, f"CREATE TABLE {table} AS {BENCH['source_table']}")
+    conn.disconnect()
+
+    watermarks = Watermarks()
+    config = {**CH_CONFIG, 'settings': {'log_comment': f"{run_id}-{mode}"}}
+    pool = ConnectionPool(config, max_size=BENCH['clients'])
+    cache = None
+    if mode != 'no_cache':
+        cache = ResultCache(pool, watermarks, precise=mode == 'range')
+    simulator = create_simulator(SIMULATOR_CONFIG, watermarks=watermarks)
+
+    print(f"Running {mode} with {BENCH['clients']} clients for {BENCH['duration_sec']} sec...")
+    stop = threading.Event()
+    latencies = [[] for _ in range(BENCH['clients'])]
+    clients = [threading.Thread(target=dashboard_client, args=(cache, pool, table, conditions, stop, samples))
+               for samples in latencies]
+    start = time.time()
+    for client in clients:
+        client.start()
+    simulator.simulate_load()
+    stop.set()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - start
+    pool.close_all()
+
+    latencies = [latency for samples in latencies for latency in samples]
+    stats = cache.snapshot() if cache else {}
+    return {
+        'queries': len(latencies),
+        'qps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'inserts': watermarks.inserts[table],
+        'hit_rate': stats.get('hit_rate', 0.0),
+        'coalesced': stats.get('coalesced', 0),
+        'invalidated': stats.get('invalidated', 0),
+        'saved_read_bytes': stats.get('saved_read_bytes', 0),
+    }
+
+
+def server_reads(run_id):
+    conn = Client(**CH_CONFIG)
+    rows = execute_with_retry(conn, f"""
+        SELECT variant, count(), sum(read_bytes)
+        FROM {RESULT_TABLE}
+        WHERE benchmark = 'result_cache' AND run_id = %(run_id)s AND query_kind = 'Select'
+        GROUP BY variant
+    """, {'run_id': run_id}) or []
+    conn.disconnect()
+    return {variant: (queries, read_bytes) for variant, queries, read_bytes in rows}
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    modes = sys.argv[1:] or BENCH['modes']
+    conditions = load_workload(BENCH['workload_files'])
+    run_id = uuid.uuid4().hex[:8]
+
+    collector = QueryLogCollector('result_cache', run_id=run_id, log_comment_prefix=run_id,
+                                  variant=log_comment_variant, config=CH_CONFIG).start()
+    results = {}
+    try:
+        for mode in modes:
+            results[mode] = run_mode(mode, run_id, conditions)
+    finally:
+        collector.stop()
+    reads = server_reads(run_id)
+
+    headers = ['Mode', 'Queries', 'QPS', 'p50 (ms)', 'p99 (ms)', 'Inserts', 'Hit rate', 'Coalesced',
+               'Invalidated', 'Server queries', 'Server read MB', 'Saved read MB']
+    table = []
+    for mode in modes:
+        result = results[mode]
+        server_queries, read_bytes = reads.get(mode, (0, 0))
+        table.append([mode, result['queries'], result['qps'], result['p50_ms'], result['p99_ms'], result['inserts'],
+                      result['hit_rate'], result['coalesced'], result['invalidated'], server_queries,
+                      read_bytes / 1024 / 1024, result['saved_read_bytes'] / 1024 / 1024])
+    print(tabulate(table, headers=headers, tablefmt='grid', floatfmt='.2f'))
+    print(f"Cache: max_entries={CACHE['max_entries']}, ttl_sec={CACHE['ttl_sec']}")
+
+    with open(BENCH['results_file'], 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['run_id'] + headers)
+        writer.writerows([run_id, *row] for row in table)
+    print(f"\nResults saved to {BENCH['results_file']}")
+
+
+if __name__ == "__main__":
+    main()
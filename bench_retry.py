@@ -0,0 +1,53 @@
+import logging
+import shutil
+
+from tabulate import tabulate
+
+from fake_clickhouse import FakeServer
+from insert_simulator import CONFIG, create_simulator
+
+DURATION_SEC = 20
+# Сервер недоступен (ошибка перегрузки на каждый запрос) с 5-й по 12-ю секунду
+OUTAGES = [(5, 12)]
+SPOOL_DIR = 'spool_bench'
+
+SCENARIOS = {
+    'no breaker': {'circuit_breaker': {'failure_threshold': 10 ** 9, 'reset_timeout_sec': 1.0}},
+    'breaker': {},
+    'breaker + spool': {'spool': {**CONFIG['spool'], 'enabled': True, 'directory': SPOOL_DIR}},
+}
+
+
+def run(name, overrides):
+    shutil.rmtree(SPOOL_DIR, ignore_errors=True)
+    server = FakeServer(outages=OUTAGES, error_rate=0.01, seed=1)
+    config = {
+        **CONFIG,
+        'duration_minutes': DURATION_SEC / 60,
+        'min_delay_sec': 0.0,
+        'max_delay_sec': 0.05,
+        **overrides,
+    }
+    simulator = create_simulator(config, client_factory=server.client)
+    simulator.simulate_load()
+    counters = simulator.retry_policy.snapshot()
+    left = sum(1 for _ in simulator.spool.pending()) if simulator.spool else '-'
+    shutil.rmtree(SPOOL_DIR, ignore_errors=True)
+    return [
+        name, simulator.inserted_rows, server.queries, server.errors,
+        counters['retries'], counters['failures'], counters['trips'], counters['shed'], left,
+    ]
+
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR + 10)
+    results = []
+    for name, overrides in SCENARIOS.items():
+        print(f"Running '{name}' with outage {OUTAGES} for {DURATION_SEC} sec...")
+        results.append(run(name, overrides))
+    print(tabulate(results, headers=['Scenario', 'Inserted rows', 'Server queries', 'Failed queries', 'Retries',
+                                     'Failures', 'Trips', 'Shed', 'Left in spool'], tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
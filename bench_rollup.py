@@ -0,0 +1,234 @@
+import csv
+import logging
+import sys
+import time
+import uuid
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from connection_pool import ConnectionPool
+from insert_simulator import CONFIG, create_simulator
+from load_controller import percentile
+from retry_policy import execute_with_retry
+from rollup import backfill, create_rollup, drop_rollup, populate, rollup_count_queries
+from select_queries import load_workload
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+
+BENCH = {
+    'source_table': 'logs_ordered',
+    'intervals': ['minute', 'hour'],
+    'backfill_chunks': 16,
+    'backfill_workers': 4,
+    # Вставки симулятора в копию source_table с разными наборами представлений
+    'insert_table': 'rollup_insert_test',
+    'insert_sec': 30,
+    'view_sets': {
+        'none': [],
+        'failed_events': ['failed_events'],
+        'minute': ['minute'],
+        'hour': ['hour'],
+        'all': ['failed_events', 'minute', 'hour'],
+    },
+    'workload_files': 'queries_select/*.txt',
+    'repetitions': 3,
+    'keep_rollups': True,  # Сводки source_table остаются для повторного прогона queries
+    'results_prefix': 'results/rollup',
+}
+
+# Представление из skripts/test_view.sql: копия неудачных событий
+FAILED_EVENTS_VIEW = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS {table}_failed_events_mv
+    ENGINE = MergeTree()
+    ORDER BY (timestamp, login)
+    AS SELECT timestamp, login, event, subsystem, comment
+    FROM {table}
+    WHERE event LIKE '%_failed'
+"""
+
+INSERT_CONFIG = {
+    **CONFIG,
+    'target_table': BENCH['insert_table'],
+    'duration_minutes': BENCH['insert_sec'] / 60,
+    'min_delay_sec': 0.0,
+    'max_delay_sec': 0.0,
+    'metrics': {**CONFIG['metrics'], 'enabled': False},
+}
+
+
+def timed(conn, query):
+    # Время и число прочитанных сервером строк
+    start = time.perf_counter()
+    result = execute_with_retry(conn, query)
+    elapsed = time.perf_counter() - start
+    return result[0][0] or 0, elapsed, conn.last_query.progress.rows
+
+
+def run_backfill(conn, pool):
+    source = BENCH['source_table']
+    total = execute_with_retry(conn, f"SELECT count() FROM {source}")[0][0]
+    results = []
+    for interval in BENCH['intervals']:
+        drop_rollup(conn, source, interval)
+        print(f"Populating {interval} rollup of {source}...")
+        populate_sec = populate(conn, source, interval)
+
+        print(f"Backfilling {interval} rollup in {BENCH['backfill_chunks']} chunks...")
+        table = create_rollup(conn, source, interval)
+        start = time.perf_counter()
+        chunks = backfill(pool, source, interval, BENCH['backfill_chunks'], BENCH['backfill_workers'])
+        backfill_sec = time.perf_counter() - start
+        slowest = max((elapsed for _, elapsed in chunks), default=0.0)
+
+        rows, events = execute_with_retry(conn, f"SELECT count(), countMerge(events) FROM {table}")[0]
+        results.append([interval, total, rows, f"{total / rows if rows else 0:.1f}", f"{populate_sec:.2f}",
+                         f"{backfill_sec:.2f}", len(chunks), f"{slowest:.2f}", f"{populate_sec / backfill_sec:.2f}",
+                         'ok' if events == total else f"{events} != {total}"])
+    headers = ['Interval', 'Source rows', 'Rollup rows', 'Compression', 'POPULATE (sec)', 'Backfill (sec)',
+               'Chunks', 'Slowest chunk (sec)', 'Speedup', 'Check']
+    return headers, results
+
+
+def run_queries(conn):
+    source = BENCH['source_table']
+    conditions = load_workload(BENCH['workload_files'])
+    intervals = BENCH['intervals']
+    results = []
+    for condition in dict.fromkeys(conditions):
+        raw = [timed(conn, f"SELECT count(*) FROM {source} WHERE {condition}")
+               for _ in range(BENCH['repetitions'])]
+        count = raw[0][0]
+        row = [condition, count, f"{sum(r[1] for r in raw) / len(raw) * 1000:.1f}", raw[0][2]]
+        for interval in intervals:
+            queries = rollup_count_queries(source, interval, condition)
+            if queries is None:
+                row += ['-', '-', '-']
+                continue
+            runs = [[timed(conn, query) for query in queries] for _ in range(BENCH['repetitions'])]
+            answer = sum(r[0] for r in runs[0])
+            duration = sum(r[1] for run in runs for r in run) / len(runs)
+            read_rows = sum(r[2] for r in runs[0])
+            row += [f"{duration * 1000:.1f}", read_rows, 'ok' if answer == count else answer]
+        results.append(row)
+    headers = ['Condition', 'Count', 'Raw (ms)', 'Raw read rows']
+    for interval in intervals:
+        headers += [f"{interval} (ms)", f"{interval} read rows", f"{interval} check"]
+    return headers, results
+
+
+def create_views(conn, table, views):
+    for view in views:
+        if view == 'failed_events':
+            execute_with_retry(conn, FAILED_EVENTS_VIEW.format(table=table))
+        else:
+            create_rollup(conn, table, view)
+
+
+def drop_views(conn, table):
+    execute_with_retry(conn, f"DROP VIEW IF EXISTS {table}_failed_events_mv")
+    for interval in BENCH['intervals']:
+        drop_rollup(conn, table, interval)
+
+
+def view_costs(conn, comment):
+    # Время каждого представления на вставках прогона (system.query_views_log)
+    execute_with_retry(conn, "SYSTEM FLUSH LOGS")
+    return execute_with_retry(conn, """
+        SELECT view_name, count(), avg(view_duration_ms), sum(written_rows)
+        FROM system.query_views_log
+        WHERE event_date >= yesterday() AND initial_query_id IN (
+            SELECT query_id FROM system.query_log
+            WHERE event_date >= yesterday() AND type = 'QueryFinish' AND log_comment = %(comment)s
+        )
+        GROUP BY view_name
+        ORDER BY view_name
+    """, {'comment': comment}) or []
+
+
+def run_inserts(conn, run_id):
+    table = BENCH['insert_table']
+    results = []
+    costs = []
+    baseline = None
+    for name, views in BENCH['view_sets'].items():
+        drop_views(conn, table)
+        execute_with_retry(conn, f"DROP TABLE IF EXISTS {table}")
+        execute_with_retry(conn, f"CREATE TABLE {table} AS {BENCH['source_table']}")
+        create_views(conn, table, views)
+
+        comment = f"{run_id}-{name}"
+        ch_config = {**CONFIG['ch_config'], 'settings': {**CONFIG['ch_config']['settings'], 'log_comment': comment}}
+        simulator = create_simulator({**INSERT_CONFIG, 'ch_config': ch_config})
+        print(f"Inserting for {BENCH['insert_sec']} sec with views: {', '.join(views) or 'none'}...")
+        simulator.simulate_load()
+        rate = simulator.inserted_rows / BENCH['insert_sec']
+        # Замедление - относительно первого набора (без представлений)
+        baseline = baseline or rate
+        latencies = simulator.insert_latencies
+
+        views_ms = 0.0
+        for view_name, inserts, duration_ms, written_rows in view_costs(conn, comment):
+            costs.append([name, view_name, inserts, f"{duration_ms:.2f}", written_rows])
+            views_ms += duration_ms
+        slowdown = f"{1 - rate / baseline:.1%}" if baseline else '-'
+        results.append([name, simulator.inserted_rows, f"{rate:.0f}", slowdown, len(latencies),
+                        f"{percentile(latencies, 50) * 1000:.1f}", f"{percentile(latencies, 99) * 1000:.1f}",
+                        f"{views_ms:.2f}"])
+    drop_views(conn, table)
+    execute_with_retry(conn, f"DROP TABLE IF EXISTS {table}")
+    headers = ['Views', 'Rows', 'Rows/sec', 'Slowdown', 'Inserts', 'p50 (ms)', 'p99 (ms)', 'Views ms/insert']
+    return headers, results, costs
+
+
+def save(name, run_id, headers, rows):
+    path = f"{BENCH['results_prefix']}_{name}.csv"
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['run_id'] + headers)
+        writer.writerows([run_id, *row] for row in rows)
+    print(f"Results saved to {path}\n")
+
+
+def main():
+    # python bench_rollup.py [backfill] [queries] [inserts] - по умолчанию все этапы;
+    # queries без backfill использует сводки, оставшиеся с прошлого прогона
+    logging.getLogger().setLevel(logging.WARNING)
+    phases = sys.argv[1:] or ['backfill', 'queries', 'inserts']
+    run_id = uuid.uuid4().hex[:8]
+    conn = Client(**CH_CONFIG)
+
+    if 'backfill' in phases:
+        pool = ConnectionPool(CH_CONFIG, max_size=BENCH['backfill_workers'])
+        headers, rows = run_backfill(conn, pool)
+        pool.close_all()
+        print(tabulate(rows, headers=headers, tablefmt='grid'))
+        save('backfill', run_id, headers, rows)
+
+    if 'queries' in phases:
+        print(f"Comparing {BENCH['source_table']} with its rollups...")
+        headers, rows = run_queries(conn)
+        print(tabulate(rows, headers=headers, tablefmt='grid'))
+        print("'-' - the condition uses columns that are not in the rollup")
+        save('queries', run_id, headers, rows)
+
+    if 'inserts' in phases:
+        headers, rows, costs = run_inserts(conn, run_id)
+        print(tabulate(rows, headers=headers, tablefmt='grid'))
+        print(tabulate(costs, headers=['Views', 'View', 'Inserts', 'Avg ms/insert', 'Written rows'],
+                       tablefmt='grid'))
+        save('inserts', run_id, headers, rows)
+
+    if not BENCH['keep_rollups']:
+        for interval in BENCH['intervals']:
+            drop_rollup(conn, BENCH['source_table'], interval)
+    conn.disconnect()
+
+
+if __name__ == "__main__":
+    main()
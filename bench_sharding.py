@@ -0,0 +1,52 @@
+import logging
+import sys
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from fake_clickhouse import FakeServer
+from insert_simulator import CONFIG, create_simulator
+
+# Локальные "узлы" для прогона без кластера: у каждого шарда свой FakeServer
+FAKE_SHARDS = [{'host': f"shard{i}"} for i in range(4)]
+KEYS = ['login', 'timestamp_bucket']
+
+SHARDING_CONFIG = {
+    **CONFIG,
+    'duration_minutes': 0.25,
+    'min_delay_sec': 0.0,
+    'max_delay_sec': 0.05,
+    'workers_count': 8,
+}
+
+
+def run(key, fake):
+    shards = FAKE_SHARDS if fake else CONFIG['sharding']['shards']
+    servers = {shard['host']: FakeServer() for shard in shards}
+    client_factory = (lambda **config: servers[config['host']].client(**config)) if fake else Client
+    config = {
+        **SHARDING_CONFIG,
+        'sharding': {**CONFIG['sharding'], 'enabled': True, 'key': key, 'shards': shards},
+    }
+    simulator = create_simulator(config, client_factory=client_factory)
+    simulator.simulate_load()
+    print(simulator.sink.report())
+
+    rows = [shard.rows for shard in simulator.sink.shards]
+    mean = sum(rows) / len(rows)
+    return [key, len(rows), simulator.inserted_rows,
+            f"{simulator.inserted_rows / (config['duration_minutes'] * 60):.0f}",
+            f"{max(rows) / mean if mean else 0:.2f}", f"{min(rows) / mean if mean else 0:.2f}"]
+
+
+def main():
+    # --fake: шарды - локальные FakeServer, иначе узлы из CONFIG['sharding']['shards']
+    fake = '--fake' in sys.argv
+    logging.getLogger().setLevel(logging.WARNING)
+    results = [run(key, fake) for key in KEYS]
+    print(tabulate(results, headers=['Key', 'Shards', 'Rows', 'Rows/sec', 'Max/mean', 'Min/mean'],
+                   tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import time
+
+from tabulate import tabulate
+
+from columnar_batch import ColumnarBatch
+from log_reader import read_log_blocks
+from spool import BatchSpool
+
+LOG_FILE = 'data/logs_data_3_000.csv'
+SPOOL_DIR = 'spool_bench'
+BATCH_SIZES = [100, 500, 1000, 5000, 10000]
+TOTAL_ROWS = 200000
+# fsync после каждого пакета, пачками по 10 и только по таймеру
+FSYNC_MODES = {'every batch': 1, 'every 10': 10, 'interval 0.5s': 10 ** 9}
+
+
+def load_block(file_path):
+    block = next(read_log_blocks(file_path, block_size=max(BATCH_SIZES)))
+    batch = ColumnarBatch(max(BATCH_SIZES))
+    while not batch.is_full():
+        batch.extend(block, 0, len(block))
+    return batch
+
+
+def run(block, batch_size, fsync_every):
+    shutil.rmtree(SPOOL_DIR, ignore_errors=True)
+    spool = BatchSpool(SPOOL_DIR, fsync_every=fsync_every)
+    batch = ColumnarBatch(batch_size)
+    batch.extend(block, 0, batch_size)
+    batches = TOTAL_ROWS // batch_size
+
+    # Запись: кодирование + append + fsync
+    start = time.perf_counter()
+    for _ in range(batches):
+        spool.append(batch)
+    spool.sync()
+    write_time = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in spool.segments())
+
+    # Чтение после перезапуска: последовательный проход по сегментам и декодирование
+    start = time.perf_counter()
+    replayed = sum(len(replayed_batch) for _, replayed_batch in spool.pending())
+    read_time = time.perf_counter() - start
+
+    # Подтверждение всех пакетов удаляет сегменты
+    for seq in range(1, batches + 1):
+        spool.ack(seq)
+    spool.close()
+    shutil.rmtree(SPOOL_DIR, ignore_errors=True)
+
+    return [
+        batch_size,
+        write_time / batches * 1e6,
+        batches * batch_size / write_time,
+        spool.syncs,
+        size / (batches * batch_size),
+        replayed / read_time,
+    ]
+
+
+def main():
+    block = load_block(LOG_FILE)
+    for mode, fsync_every in FSYNC_MODES.items():
+        print(f"\nSpool overhead, fsync {mode} ({TOTAL_ROWS} rows per run)")
+        results = [run(block, batch_size, fsync_every) for batch_size in BATCH_SIZES]
+        print(tabulate(results, headers=['Batch size', 'Append (us/batch)', 'Append rows/sec', 'fsyncs',
+                                         'Bytes/row', 'Replay rows/sec'],
+                       tablefmt='grid', floatfmt='.1f'))
+
+
+if __name__ == "__main__":
+    main()
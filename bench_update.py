@@ -0,0 +1,197 @@
+import csv
+import logging
+import random
+import sys
+import time
+import uuid
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from columnar_batch import LOG_COLUMNS
+from log_reader import read_log_blocks
+from query_log_collector import RESULT_TABLE, QueryLogCollector, log_comment_variant
+from retry_policy import execute_with_retry
+from schema_matrix import double_table
+from update_engine import (VERSIONED_COLUMNS, UnsupportedStrategyError, create_strategy, create_versioned_table,
+                           select_query)
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+
+BENCH = {
+    'strategies': ['mutation', 'reinsert', 'lightweight'],
+    'log_file': 'data/logs_data_3_000.csv',
+    'rows': 1_000_000,
+    'table_prefix': 'update_',  # Таблица на стратегию: update_mutation, update_reinsert, ...
+    # Число запросов каждого вида: point - одна секунда (timestamp =), narrow - один
+    # пользователь (login =), wide - подсистема целиком (subsystem =), как в test_update.sql
+    'requests': {'point': 200, 'narrow': 20, 'wide': 2},
+    'batch_requests': 100,      # Запросов обновления на одну вставку (reinsert)
+    'read_repetitions': 5,
+    'keep_tables': False,
+    'results_file': 'results/test_update_strategies.csv',
+}
+
+UPDATE_VALUES = [
+    {'comment': 'two tee to two two'},
+    {'description': 'hello world'},
+    {'comment': 'updated', 'description': 'updated by bench_update'},
+]
+
+# Чтения после обновлений; для reinsert выполняются с FINAL и без него
+READ_QUERIES = [
+    "SELECT count() FROM {table} WHERE subsystem = 'bd'",
+    "SELECT login, count() FROM {table} WHERE comment = 'two tee to two two' GROUP BY login",
+    "SELECT * FROM {table} WHERE timestamp = %(timestamp)s",
+]
+
+
+def load(conn, table, rows):
+    # Файл вставляется блоками, затем таблица удваивается на сервере с неповторяющимися
+    # timestamp (schema_matrix.double_table), чтобы копии не совпали по ключу ReplacingMergeTree.
+    # Загрузка детерминирована: у всех стратегий одни и те же строки
+    loaded = 0
+    columns = ', '.join(LOG_COLUMNS)
+    for block in read_log_blocks(BENCH['log_file']):
+        data = block.data()
+        execute_with_retry(conn, f"INSERT INTO {table} ({columns}, version, is_deleted) VALUES",
+                           [*data, [0] * len(block), [0] * len(block)], columnar=True)
+        loaded += len(block)
+    double_table(lambda query: execute_with_retry(conn, query), table, loaded, rows, VERSIONED_COLUMNS)
+    execute_with_retry(conn, f"OPTIMIZE TABLE {table} FINAL")
+    return execute_with_retry(conn, f"SELECT count() FROM {table}")[0][0]
+
+
+def make_requests(conn, table):
+    # Условия обновлений по значениям из таблицы, одинаковые для всех стратегий
+    requests = []
+    for kind, column in (('point', 'timestamp'), ('narrow', 'login'), ('wide', 'subsystem')):
+        count = BENCH['requests'][kind]
+        values = [row[0] for row in execute_with_retry(
+            conn, f"SELECT DISTINCT {column} FROM {table} ORDER BY rand() LIMIT {count}")]
+        for value in values:
+            literal = value.strftime('%Y-%m-%d %H:%M:%S') if column == 'timestamp' else value
+            requests.append((kind, f"{column} = '{literal}'", random.choice(UPDATE_VALUES)))
+    random.shuffle(requests)
+    return requests
+
+
+def matched_rows(conn, table, requests):
+    return sum(execute_with_retry(conn, f"SELECT count() FROM {table} WHERE {where}")[0][0]
+               for _, where, _ in requests)
+
+
+def active_parts(conn, table):
+    return execute_with_retry(conn, """
+        SELECT count() FROM system.parts
+        WHERE database = currentDatabase() AND table = %(table)s AND active
+    """, {'table': table})[0][0]
+
+
+def run_reads(conn, strategy, run_id, timestamp):
+    phases = [('read_final', True), ('read', False)] if strategy.read_final else [('read', False)]
+    for phase, final in phases:
+        settings = {'log_comment': f"{run_id}-{strategy.name}.{phase}"}
+        for _ in range(BENCH['read_repetitions']):
+            for query in READ_QUERIES:
+                query = query.format(table=strategy.table)
+                if final:
+                    query = select_query(strategy, query)
+                execute_with_retry(conn, query, {'timestamp': timestamp}, settings=settings)
+
+
+def run_strategy(name, run_id, requests, timestamp):
+    table = f"{BENCH['table_prefix']}{name}"
+    conn = Client(**CH_CONFIG, settings={'log_comment': f"{run_id}-{name}.update"})
+    execute_with_retry(conn, f"DROP TABLE IF EXISTS {table}")
+    create_versioned_table(conn, table, lightweight=name == 'lightweight')
+    load(conn, table, BENCH['rows'])
+    options = {'batch_requests': BENCH['batch_requests']} if name == 'reinsert' else {}
+    strategy = create_strategy(name, conn, table, **options)
+
+    print(f"Running {len(requests)} updates with {name}...")
+    start = time.perf_counter()
+    try:
+        for _, where, values in requests:
+            strategy.update(where, values)
+        strategy.flush()
+    except UnsupportedStrategyError as e:
+        print(e)
+        return None
+    elapsed = time.perf_counter() - start
+    parts = active_parts(conn, table)
+    run_reads(conn, strategy, run_id, timestamp)
+    if not BENCH['keep_tables']:
+        execute_with_retry(conn, f"DROP TABLE IF EXISTS {table}")
+    conn.disconnect()
+    return elapsed, parts
+
+
+def read_costs(conn, run_id):
+    # Стоимость чтений по фазам: variant = '<стратегия>.<read|read_final>'
+    rows = execute_with_retry(conn, f"""
+        SELECT variant, avg(query_duration_ms), avg(read_rows)
+        FROM {RESULT_TABLE}
+        WHERE benchmark = 'update_strategies' AND run_id = %(run_id)s AND query_kind = 'Select'
+        GROUP BY variant
+    """, {'run_id': run_id}) or []
+    return {variant: (duration, read_rows) for variant, duration, read_rows in rows}
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    strategies = sys.argv[1:] or BENCH['strategies']
+    run_id = uuid.uuid4().hex[:8]
+    conn = Client(**CH_CONFIG)
+
+    # Запросы строятся по первой загруженной таблице и повторяются для всех стратегий
+    sample = f"{BENCH['table_prefix']}sample"
+    execute_with_retry(conn, f"DROP TABLE IF EXISTS {sample}")
+    create_versioned_table(conn, sample)
+    loaded = load(conn, sample, BENCH['rows'])
+    print(f"Loaded {loaded} rows into {sample}")
+    requests = make_requests(conn, sample)
+    rows = matched_rows(conn, sample, requests)
+    timestamp = execute_with_retry(conn, f"SELECT any(timestamp) FROM {sample}")[0][0]
+    execute_with_retry(conn, f"DROP TABLE IF EXISTS {sample}")
+
+    collector = QueryLogCollector('update_strategies', run_id=run_id, log_comment_prefix=run_id,
+                                  variant=log_comment_variant, config=CH_CONFIG).start()
+    results = {}
+    try:
+        for name in strategies:
+            results[name] = run_strategy(name, run_id, requests, timestamp)
+    finally:
+        collector.stop()
+    costs = read_costs(conn, run_id)
+    conn.disconnect()
+
+    headers = ['Strategy', 'Requests', 'Rows', 'Total (sec)', 'Requests/sec', 'Rows/sec', 'Active parts',
+               'Read (ms)', 'Read rows', 'Read FINAL (ms)', 'Read FINAL rows']
+    table = []
+    for name in strategies:
+        if results[name] is None:
+            table.append([name, len(requests), rows] + ['-'] * 8)
+            continue
+        elapsed, parts = results[name]
+        read = costs.get(f"{name}.read", ('-', '-'))
+        final = costs.get(f"{name}.read_final", ('-', '-'))
+        table.append([name, len(requests), rows, f"{elapsed:.2f}", f"{len(requests) / elapsed:.1f}",
+                      f"{rows / elapsed:.0f}", parts, *read, *final])
+    print(tabulate(table, headers=headers, tablefmt='grid', floatfmt='.1f'))
+    print("reinsert reads without FINAL may return stale row versions until parts are merged")
+
+    with open(BENCH['results_file'], 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['run_id'] + headers)
+        writer.writerows([run_id, *row] for row in table)
+    print(f"\nResults saved to {BENCH['results_file']}")
+
+
+if __name__ == "__main__":
+    main()
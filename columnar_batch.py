@@ -0,0 +1,83 @@
+LOG_COLUMNS = ('timestamp', 'login', 'event', 'subsystem', 'comment', 'description')
+
+
+# Пакет логов в column-oriented формате с заранее выделенными буферами
+class ColumnarBatch:
+    def __init__(self, capacity, column_names=LOG_COLUMNS):
+        self.column_names = tuple(column_names)
+        self.columns = [[None] * capacity for _ in self.column_names]
+        self.capacity = capacity
+        self.size = 0
+        # Время постановки в очередь вставки (заполняется симулятором)
+        self.enqueued_at = None
+        # Номер записи в спуле (spool.BatchSpool), если пакет сохранен на диск
+        self.spool_seq = None
+        # Номера записей спула, строки которых вошли в пакет после перегруппировки
+        self.spool_sources = None
+
+    @classmethod
+    def from_columns(cls, columns, column_names=LOG_COLUMNS):
+        # Готовый полностью заполненный пакет из списков колонок
+        batch = cls(0, column_names)
+        batch.columns = [list(column) for column in columns]
+        batch.capacity = batch.size = len(batch.columns[0]) if batch.columns else 0
+        return batch
+
+    def __len__(self):
+        return self.size
+
+    def is_full(self):
+        return self.size >= self.capacity
+
+    def append(self, values):
+        # values - значения одной строки в порядке column_names
+        index = self.size
+        for column, value in zip(self.columns, values):
+            column[index] = value
+        self.size = index + 1
+
+    def fill(self, rows):
+        # Заполняем свободное место из итератора строк, возвращаем число добавленных
+        start = self.size
+        if start >= self.capacity:
+            return 0
+        for values in rows:
+            self.append(values)
+            if self.size >= self.capacity:
+                break
+        return self.size - start
+
+    def extend(self, block, start=0, end=None):
+        # Копируем срез колонок другого пакета, возвращаем число добавленных строк
+        end = len(block) if end is None else end
+        count = min(self.capacity - self.size, end - start)
+        if count <= 0:
+            return 0
+        target_end = self.size + count
+        for column, source in zip(self.columns, block.columns):
+            column[self.size:target_end] = source[start:start + count]
+        self.size = target_end
+        return count
+
+    def column(self, name):
+        return self.data()[self.column_names.index(name)]
+
+    def data(self):
+        # Данные для client.execute(..., columnar=True)
+        if self.size == len(self.columns[0]):
+            return self.columns
+        return [column[:self.size] for column in self.columns]
+
+    def insert_query(self, table):
+        return f"INSERT INTO {table} ({', '.join(self.column_names)}) VALUES"
+
+    def reset(self, capacity=None):
+        # Повторное использование буферов; память выделяется заново только при росте
+        if capacity is not None:
+            if capacity > len(self.columns[0]):
+                self.columns = [[None] * capacity for _ in self.column_names]
+            self.capacity = capacity
+        self.size = 0
+        self.enqueued_at = None
+        self.spool_seq = None
+        self.spool_sources = None
@@ -0,0 +1,492 @@
+import re
+import threading
+
+import numpy as np
+from clickhouse_driver.errors import ErrorCodes, ServerException
+
+from columnar_batch import LOG_COLUMNS
+from fake_clickhouse import FakeServer
+
+DEFAULT_GRANULARITY = 8192
+# Сколько частей таблицы до слияния merge_parts самых мелких
+MAX_PARTS = 16
+MERGE_PARTS = 4
+
+CREATE_TABLE = re.compile(r"^CREATE TABLE\s+(?:IF NOT EXISTS\s+)?(?:\w+\.)?(\w+)", re.IGNORECASE)
+CREATE_AS = re.compile(r"^CREATE TABLE\s+(?:IF NOT EXISTS\s+)?(?:\w+\.)?(\w+)\s+AS\s+(?:\w+\.)?(\w+)\s*$",
+                       re.IGNORECASE)
+ORDER_BY = re.compile(r"\bORDER BY\s+(\([^)]*\)|\S+)", re.IGNORECASE)
+GRANULARITY = re.compile(r"\bindex_granularity\s*=\s*(\d+)", re.IGNORECASE)
+MINMAX_INDEX = re.compile(r"\bINDEX\s+\w+\s+\(?(\w+)\)?\s+TYPE\s+minmax", re.IGNORECASE)
+COLUMN_TYPE = re.compile(r"[(,]\s*(\w+)\s+(DateTime|String|LowCardinality\(String\)|U?Int\d+)", re.IGNORECASE)
+INSERT = re.compile(r"^INSERT INTO\s+(?:\w+\.)?(\w+)\s*(?:\(([^)]*)\))?", re.IGNORECASE)
+COUNT = re.compile(r"^SELECT\s+count\((?:\*)?\)\s+FROM\s+(?:\w+\.)?(\w+)(?:\s+WHERE\s+(.+?))?\s*;?\s*$",
+                   re.IGNORECASE | re.DOTALL)
+TABLE_STATEMENT = re.compile(r"^(DROP|TRUNCATE) TABLE\s+(?:IF EXISTS\s+)?(?:\w+\.)?(\w+)", re.IGNORECASE)
+
+# Условия вида из queries_select/*.txt: сравнение, BETWEEN, LIKE, IN, связки AND/OR/NOT и скобки
+TOKEN = re.compile(r"""
+    (?P<between>(?P<b_column>\w+)\s+BETWEEN\s+(?P<b_low>'[^']*'|\d+)\s+AND\s+(?P<b_high>'[^']*'|\d+))
+  | (?P<like>(?P<l_column>\w+)\s+(?P<l_not>NOT\s+)?LIKE\s+(?P<l_pattern>'[^']*'))
+  | (?P<in>(?P<i_column>\w+)\s+(?P<i_not>NOT\s+)?IN\s*\((?P<i_values>[^)]*)\))
+  | (?P<compare>(?P<c_column>\w+)\s*(?P<c_op><=|>=|!=|<>|<|>|=)\s*(?P<c_value>'[^']*'|\d+))
+  | (?P<keyword>\bAND\b|\bOR\b|\bNOT\b|\(|\))
+  | (?P<space>\s+)
+""", re.IGNORECASE | re.VERBOSE)
+
+
+def literal(text):
+    return text[1:-1] if text.startswith("'") else int(text)
+
+
+def tokenize(condition):
+    tokens = []
+    position = 0
+    while position < len(condition):
+        match = TOKEN.match(condition, position)
+        if not match:
+            raise ServerException(f"Syntax error: unsupported condition at '{condition[position:]}'",
+                                  ErrorCodes.SYNTAX_ERROR)
+        position = match.end()
+        if match.group('between'):
+            tokens.append(('between', match.group('b_column'), literal(match.group('b_low')),
+                           literal(match.group('b_high'))))
+        elif match.group('like'):
+            tokens.append(('like', match.group('l_column'), literal(match.group('l_pattern'))))
+            if match.group('l_not'):
+                tokens[-1] = ('not', tokens[-1])
+        elif match.group('in'):
+            values = [literal(value.strip()) for value in match.group('i_values').split(',') if value.strip()]
+            tokens.append(('in', match.group('i_column'), values))
+            if match.group('i_not'):
+                tokens[-1] = ('not', tokens[-1])
+        elif match.group('compare'):
+            op = {'<>': '!='}.get(match.group('c_op'), match.group('c_op'))
+            tokens.append(('compare', match.group('c_column'), op, literal(match.group('c_value'))))
+        elif match.group('keyword'):
+            tokens.append(match.group('keyword').upper())
+    return tokens
+
+
+def parse_condition(condition):
+    # Дерево условия: ('or', [...]), ('and', [...]), ('not', x) и предикаты-листья
+    tokens = tokenize(condition)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def expression():
+        nonlocal position
+        terms = [term()]
+        while peek() == 'OR':
+            position += 1
+            terms.append(term())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def term():
+        nonlocal position
+        factors = [factor()]
+        while peek() == 'AND':
+            position += 1
+            factors.append(factor())
+        return factors[0] if len(factors) == 1 else ('and', factors)
+
+    def factor():
+        nonlocal position
+        token = peek()
+        position += 1
+        if token == 'NOT':
+            return ('not', factor())
+        if token == '(':
+            node = expression()
+            if peek() != ')':
+                raise ServerException("Syntax error: missing ')'", ErrorCodes.SYNTAX_ERROR)
+            position += 1
+            return node
+        if not isinstance(token, tuple):
+            raise ServerException(f"Syntax error: unexpected {token}", ErrorCodes.SYNTAX_ERROR)
+        return token
+
+    node = expression()
+    if position != len(tokens):
+        raise ServerException(f"Syntax error: unexpected {peek()}", ErrorCodes.SYNTAX_ERROR)
+    return node
+
+
+def like_regex(pattern):
+    parts = (re.escape(part) for part in re.split(r"(%|_)", pattern))
+    return re.compile(''.join({'%': '.*', '_': '.'}.get(part, part) for part in parts) + r'\Z', re.DOTALL)
+
+
+def like_matches(values, pattern):
+    # Частые шаблоны 'abc%', '%abc', '%abc%' - векторно, остальные - регулярным выражением
+    body = pattern.strip('%')
+    if '%' not in body and '_' not in body:
+        if pattern == body + '%':
+            return np.char.startswith(values, body)
+        if pattern == '%' + body:
+            return np.char.endswith(values, body)
+        if pattern == '%' + body + '%':
+            return np.char.find(values, body) >= 0
+    regex = like_regex(pattern)
+    return np.fromiter((bool(regex.match(str(value))) for value in values), bool, len(values))
+
+
+# Колонка части: DateTime - секунды в int64, строки - коды в отсортированном словаре
+# (как LowCardinality), поэтому LIKE вычисляется один раз на значение словаря
+class PartColumn:
+    def __init__(self, values, kind):
+        self.kind = kind
+        if kind == 'string':
+            self.dictionary, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+            self.data = codes.astype(np.int32)
+        elif kind == 'datetime':
+            self.dictionary = None
+            self.data = np.asarray(values, dtype='datetime64[s]').astype(np.int64)
+        else:
+            self.dictionary = None
+            self.data = np.asarray(values, dtype=np.int64)
+
+    def take(self, order):
+        self.data = self.data[order]
+
+    def values(self):
+        if self.kind == 'string':
+            return self.dictionary[self.data]
+        if self.kind == 'datetime':
+            return self.data.astype('datetime64[s]')
+        return self.data
+
+    def encode(self, value):
+        # Значение литерала в единицах data; для строк - позиция в словаре
+        if self.kind == 'datetime':
+            return np.datetime64(value, 's').astype(np.int64)
+        return value
+
+    def code_range(self, low, high):
+        # Коды строк словаря в [low, high): словарь отсортирован, коды идут по порядку строк
+        return np.searchsorted(self.dictionary, low, 'left'), np.searchsorted(self.dictionary, high, 'left')
+
+    def mask(self, predicate, rows):
+        data = self.data[rows]
+        kind = predicate[0]
+        if self.kind == 'string':
+            if kind == 'like':
+                matches = like_matches(self.dictionary, predicate[2])
+            elif kind == 'in':
+                matches = np.isin(self.dictionary, [str(value) for value in predicate[2]])
+            elif kind == 'between':
+                matches = (self.dictionary >= str(predicate[2])) & (self.dictionary <= str(predicate[3]))
+            else:
+                matches = compare(self.dictionary, predicate[2], str(predicate[3]))
+            return matches[data]
+        if kind == 'between':
+            return (data >= self.encode(predicate[2])) & (data <= self.encode(predicate[3]))
+        if kind == 'in':
+            return np.isin(data, [self.encode(value) for value in predicate[2]])
+        if kind == 'like':
+            return like_matches(self.values()[rows].astype(str), predicate[2])
+        return compare(data, predicate[2], self.encode(predicate[3]))
+
+
+def compare(data, op, value):
+    if op == '=':
+        return data == value
+    if op == '!=':
+        return data != value
+    if op == '<':
+        return data < value
+    if op == '<=':
+        return data <= value
+    if op == '>':
+        return data > value
+    return data >= value
+
+
+# Неизменяемая часть таблицы: строки отсортированы по ORDER BY, на каждую гранулу
+# index_granularity строк - минимум и максимум ключевых колонок и колонок индексов minmax
+class Part:
+    def __init__(self, table, columns):
+        self.rows = len(columns[0]) if columns else 0
+        self.columns = {name: PartColumn(values, table.kinds[name]) for name, values in zip(table.columns, columns)}
+        if table.order_by and self.rows:
+            order = np.lexsort([self.columns[name].data for name in reversed(table.order_by)])
+            for column in self.columns.values():
+                column.take(order)
+        self.starts = np.arange(0, self.rows, table.granularity)
+        self.sizes = np.diff(np.append(self.starts, self.rows))
+        self.marks = {}
+        if self.rows:
+            for name in table.indexed_columns():
+                data = self.columns[name].data
+                self.marks[name] = (np.minimum.reduceat(data, self.starts), np.maximum.reduceat(data, self.starts))
+
+    def granules(self, node):
+        # Гранулы, которые могут содержать подходящие строки (отсечение без чтения данных)
+        kind = node[0]
+        if kind == 'and':
+            return np.logical_and.reduce([self.granules(child) for child in node[1]])
+        if kind == 'or':
+            return np.logical_or.reduce([self.granules(child) for child in node[1]])
+        everything = np.ones(len(self.starts), bool)
+        column = self.columns.get(node[1]) if kind != 'not' else None
+        if column is None or node[1] not in self.marks:
+            return everything
+        low, high = self.marks[node[1]]
+        if column.kind == 'string':
+            bounds = string_bounds(node)
+            if bounds is None:
+                return everything
+            first, last = column.code_range(*bounds)
+            return (high >= first) & (low < last)
+        if kind == 'between':
+            return (high >= column.encode(node[2])) & (low <= column.encode(node[3]))
+        if kind == 'in':
+            values = [column.encode(value) for value in node[2]]
+            return (high >= min(values)) & (low <= max(values)) if values else ~everything
+        if kind != 'compare':
+            return everything
+        op, value = node[2], column.encode(node[3])
+        if op == '=':
+            return (low <= value) & (high >= value)
+        if op in ('<', '<='):
+            return low <= value if op == '<=' else low < value
+        if op in ('>', '>='):
+            return high >= value if op == '>=' else high > value
+        return everything
+
+    def evaluate(self, node, rows):
+        kind = node[0]
+        if kind == 'and':
+            return np.logical_and.reduce([self.evaluate(child, rows) for child in node[1]])
+        if kind == 'or':
+            return np.logical_or.reduce([self.evaluate(child, rows) for child in node[1]])
+        if kind == 'not':
+            return ~self.evaluate(node[1], rows)
+        if node[1] not in self.columns:
+            raise ServerException(f"Missing columns: '{node[1]}'", ErrorCodes.UNKNOWN_IDENTIFIER)
+        return self.columns[node[1]].mask(node, rows)
+
+
+def string_bounds(node):
+    # Диапазон строк [low, high) для условия; None - без ограничения
+    kind = node[0]
+    if kind == 'like':
+        prefix = re.split(r"[%_]", node[2], 1)[0]
+        if not prefix:
+            return None
+        if prefix == node[2]:
+            return prefix, prefix + '\0'
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    if kind == 'in':
+        values = sorted(str(value) for value in node[2])
+        return (values[0], values[-1] + '\0') if values else None
+    if kind == 'between':
+        return str(node[2]), str(node[3]) + '\0'
+    op, value = node[2], str(node[3])
+    return {'=': (value, value + '\0'), '<': ('', value), '<=': ('', value + '\0'),
+            '>': (value + '\0', '\U0010ffff'), '>=': (value, '\U0010ffff')}.get(op)
+
+
+class Table:
+    def __init__(self, name, columns=LOG_COLUMNS, kinds=None, order_by=(), granularity=DEFAULT_GRANULARITY,
+                 minmax=()):
+        self.name = name
+        self.columns = tuple(columns)
+        self.kinds = kinds or {column: 'datetime' if column == 'timestamp' else 'string' for column in columns}
+        self.order_by = tuple(order_by)
+        self.granularity = granularity
+        self.minmax = tuple(minmax)
+        self.parts = []
+        self.lock = threading.Lock()
+        # Слияния идут в фоновом потоке, как у MergeTree: вставка не ждет слияния
+        self.merger = None
+
+    def indexed_columns(self):
+        # Разреженный первичный индекс отсекает только по первой колонке ключа
+        return set(self.order_by[:1]) | set(self.minmax)
+
+    def insert(self, column_names, columns):
+        if not columns or not len(columns[0]):
+            return 0
+        # Колонки, которых нет во вставке, заполняются значениями по умолчанию
+        by_name = dict(zip(column_names, columns))
+        rows = len(columns[0])
+        part = Part(self, [by_name.get(name, [''] * rows if self.kinds[name] == 'string' else [0] * rows)
+                           for name in self.columns])
+        with self.lock:
+            self.parts.append(part)
+            if len(self.parts) > MAX_PARTS and self.merger is None:
+                self.merger = threading.Thread(target=self.merge, name=f"Merge-{self.name}", daemon=True)
+                self.merger.start()
+        return part.rows
+
+    def merge(self):
+        # Слияние самых мелких частей в одну, пока частей больше MAX_PARTS. Новая часть
+        # собирается без блокировки; если части тем временем удалил TRUNCATE, она отбрасывается
+        while True:
+            with self.lock:
+                if len(self.parts) <= MAX_PARTS:
+                    self.merger = None
+                    return
+                smallest = sorted(self.parts, key=lambda part: part.rows)[:MERGE_PARTS]
+            columns = [np.concatenate([part.columns[name].values() for part in smallest]) for name in self.columns]
+            merged = Part(self, columns)
+            with self.lock:
+                if all(part in self.parts for part in smallest):
+                    self.parts = [part for part in self.parts if part not in smallest] + [merged]
+
+    def wait_merges(self):
+        merger = self.merger
+        if merger:
+            merger.join()
+
+    def count(self, node):
+        # Возвращает (число строк, прочитано строк, прочитано байт, гранул прочитано, гранул всего)
+        with self.lock:
+            parts = list(self.parts)
+        total = read_rows = read_bytes = granules_read = granules_total = 0
+        for part in parts:
+            granules_total += len(part.starts)
+            if node is None:
+                total += part.rows
+                continue
+            selected = part.granules(node)
+            granules_read += int(selected.sum())
+            rows = np.repeat(selected, part.sizes)
+            count = int(rows.sum())
+            if not count:
+                continue
+            read_rows += count
+            read_bytes += count * sum(part.columns[name].data.itemsize for name in columns_of(node)
+                                      if name in part.columns)
+            total += int(part.evaluate(node, rows).sum())
+        return total, read_rows, read_bytes, granules_read, granules_total
+
+    @property
+    def rows(self):
+        with self.lock:
+            return sum(part.rows for part in self.parts)
+
+
+def columns_of(node):
+    if node[0] in ('and', 'or'):
+        return set().union(*(columns_of(child) for child in node[1]))
+    if node[0] == 'not':
+        return columns_of(node[1])
+    return {node[1]}
+
+
+def parse_create(statement):
+    name = CREATE_TABLE.match(statement).group(1)
+    columns = COLUMN_TYPE.findall(statement)
+    kinds = {column: 'datetime' if kind.lower() == 'datetime' else 'string' if 'string' in kind.lower() else 'int'
+             for column, kind in columns}
+    order = ORDER_BY.search(statement)
+    order_by = []
+    if order:
+        order_by = [key.strip() for key in order.group(1).strip('()').split(',')]
+        order_by = [key for key in order_by if key in kinds]
+    granularity = GRANULARITY.search(statement)
+    return Table(name, [column for column, _ in columns] or LOG_COLUMNS, kinds or None, order_by,
+                 int(granularity.group(1)) if granularity else DEFAULT_GRANULARITY,
+                 MINMAX_INDEX.findall(statement))
+
+
+# Локальный сервер для прогонов без ClickHouse: вставленные колонки хранятся в NumPy по
+# частям с разреженным индексом, SELECT count(*) ... WHERE вычисляется векторно только
+# по гранулам, не отсеченным индексом. Задержки и сбои - как у FakeServer, плюс
+# per_granule_latency на каждую прочитанную гранулу. Таблицы создаются CREATE TABLE
+# (ORDER BY, index_granularity, INDEX ... TYPE minmax) или при первой вставке
+class ColumnarServer(FakeServer):
+    def __init__(self, per_granule_latency=0.00001, tables=(), **kwargs):
+        super().__init__(**kwargs)
+        self.per_granule_latency = per_granule_latency
+        self.tables = {}
+        for statement in tables:
+            self.create(statement)
+        self.stats = {'selects': 0, 'granules_read': 0, 'granules_total': 0, 'read_rows': 0, 'read_bytes': 0}
+
+    def create(self, statement):
+        statement = ' '.join(statement.split())
+        match = CREATE_AS.match(statement)
+        if match:
+            source = self.table(match.group(2))
+            table = Table(match.group(1), source.columns, source.kinds, source.order_by, source.granularity,
+                          source.minmax)
+        else:
+            table = parse_create(statement)
+        with self.lock:
+            if 'IF NOT EXISTS' in statement.upper() and table.name in self.tables:
+                return
+            self.tables[table.name] = table
+
+    def table(self, name):
+        with self.lock:
+            table = self.tables.get(name)
+        if table is None:
+            raise ServerException(f"Table {name} does not exist", ErrorCodes.UNKNOWN_TABLE)
+        return table
+
+    def execute(self, query, params=None, columnar=False, **kwargs):
+        self.check_fault()
+        statement = query.strip()
+        keyword = statement.split(None, 1)[0].upper() if statement else ''
+        if keyword == 'INSERT':
+            result, latency = self.insert(statement, params, columnar)
+        elif keyword == 'SELECT':
+            result, latency = self.select(statement)
+        else:
+            if keyword == 'CREATE':
+                self.create(statement)
+            elif keyword in ('DROP', 'TRUNCATE'):
+                self.drop(statement)
+            result, latency = [], self.base_latency
+        self.delay(latency)
+        with self.lock:
+            self.queries += 1
+        return result
+
+    def insert(self, statement, params, columnar):
+        match = INSERT.match(statement)
+        name = match.group(1)
+        column_names = [column.strip() for column in (match.group(2) or '').split(',') if column.strip()]
+        with self.lock:
+            table = self.tables.get(name)
+            if table is None:
+                table = self.tables[name] = Table(name, column_names or LOG_COLUMNS)
+        columns = params if columnar else [list(column) for column in zip(*params)] if params else []
+        rows = table.insert(column_names or table.columns, columns)
+        with self.lock:
+            self.inserted_rows += rows
+        return [], self.base_latency + self.per_row_latency * rows
+
+    def select(self, statement):
+        match = COUNT.match(statement)
+        if not match:
+            # Проверки соединения (SELECT 1) и прочие запросы без данных
+            return ([(1,)] if statement.upper() == 'SELECT 1' else []), self.base_latency
+        table = self.table(match.group(1))
+        node = parse_condition(match.group(2)) if match.group(2) else None
+        count, read_rows, read_bytes, granules_read, granules_total = table.count(node)
+        self.progress.value = (read_rows, read_bytes)
+        with self.lock:
+            self.stats['selects'] += 1
+            self.stats['granules_read'] += granules_read
+            self.stats['granules_total'] += granules_total
+            self.stats['read_rows'] += read_rows
+            self.stats['read_bytes'] += read_bytes
+        return [(count,)], self.base_latency + self.per_granule_latency * granules_read
+
+    def drop(self, statement):
+        match = TABLE_STATEMENT.match(statement)
+        if not match:
+            return
+        with self.lock:
+            if match.group(1).upper() == 'DROP':
+                self.tables.pop(match.group(2), None)
+            elif match.group(2) in self.tables:
+                table = self.tables[match.group(2)]
+                with table.lock:
+                    table.parts = []
@@ -0,0 +1,187 @@
+import collections
+import itertools
+import logging
+import threading
+import time
+
+from clickhouse_driver import Client
+
+from load_controller import percentile
+
+# Перцентили metrics() считаются по стольким последним замерам: память не растет с длиной прогона
+METRICS_WINDOW = 10000
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+# Простаивающее соединение в пуле
+class PooledConnection:
+    def __init__(self, conn, host):
+        self.conn = conn
+        self.host = host
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.checked_out_at = None
+
+
+# Пул соединений для ClickHouse: от min_size до max_size соединений, простаивающие
+# дольше idle_timeout_sec закрываются, перед выдачей давно не использованное соединение
+# проверяется запросом SELECT 1. Сломанные соединения в пул не возвращаются.
+# Если в конфигурации есть 'hosts' (реплики/шарды), соединения распределяются по ним по кругу
+class ConnectionPool:
+    def __init__(self, config, min_size=1, max_size=5, idle_timeout_sec=60.0, health_check_interval_sec=30.0,
+                 checkout_timeout_sec=5.0, client_factory=Client, wait_histogram=None):
+        self.config = {key: value for key, value in config.items() if key != 'hosts'}
+        self.hosts = itertools.cycle(config.get('hosts') or [config.get('host', 'localhost')])
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.idle_timeout_sec = idle_timeout_sec
+        self.health_check_interval_sec = health_check_interval_sec
+        self.checkout_timeout_sec = checkout_timeout_sec
+        self.client_factory = client_factory
+        # Необязательная telemetry.LatencyHistogram для времени ожидания соединения
+        self.wait_histogram = wait_histogram
+
+        self.condition = threading.Condition()
+        self.idle = []
+        self.in_use = {}
+        self.opening = 0
+        self.closed = False
+
+        # Метрики: ожидание соединения, время удержания, счетчики
+        self.wait_times = collections.deque(maxlen=METRICS_WINDOW)
+        self.checkout_durations = collections.deque(maxlen=METRICS_WINDOW)
+        self.counters = {'created': 0, 'evicted': 0, 'broken': 0, 'health_check_failed': 0, 'timeouts': 0}
+        self.peak_in_use = 0
+
+        for _ in range(self.min_size):
+            self.idle.append(self._create_connection())
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.in_use) + self.opening
+
+    def _create_connection(self):
+        host = next(self.hosts)
+        host, _, port = host.partition(':')
+        config = {**self.config, 'host': host}
+        if port:
+            config['port'] = int(port)
+        conn = PooledConnection(self.client_factory(**config), host)
+        with self.condition:
+            self.counters['created'] += 1
+        return conn
+
+    def _is_alive(self, pooled):
+        if time.monotonic() - pooled.last_used < self.health_check_interval_sec:
+            return True
+        try:
+            pooled.conn.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logging.warning(f"Connection to {pooled.host} failed health check: {e}")
+            with self.condition:
+                self.counters['health_check_failed'] += 1
+            return False
+
+    def _evict_idle(self):
+        # Вызывается под self.condition
+        now = time.monotonic()
+        keep = []
+        for pooled in self.idle:
+            if (now - pooled.last_used > self.idle_timeout_sec and
+                    len(keep) + len(self.in_use) + self.opening >= self.min_size):
+                pooled.conn.disconnect()
+                self.counters['evicted'] += 1
+            else:
+                keep.append(pooled)
+        self.idle = keep
+
+    def get_connection(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout_sec
+        while True:
+            with self.condition:
+                if self.closed:
+                    raise PoolExhaustedError("Connection pool is closed")
+                self._evict_idle()
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters['timeouts'] += 1
+                        raise PoolExhaustedError(f"No free connection in {self.checkout_timeout_sec}s "
+                                                 f"(max_size={self.max_size})")
+                    self.condition.wait(remaining)
+                pooled = self.idle.pop() if self.idle else None
+                if pooled is None:
+                    self.opening += 1
+
+            # Проверка и создание соединения - вне блокировки
+            if pooled is None:
+                try:
+                    pooled = self._create_connection()
+                finally:
+                    # При ошибке создания место в пуле освобождается - будим ожидающий поток
+                    with self.condition:
+                        self.opening -= 1
+                        self.condition.notify()
+            elif not self._is_alive(pooled):
+                pooled.conn.disconnect()
+                with self.condition:
+                    self.condition.notify()
+                continue
+
+            with self.condition:
+                pooled.checked_out_at = time.monotonic()
+                self.in_use[id(pooled.conn)] = pooled
+                self.peak_in_use = max(self.peak_in_use, len(self.in_use))
+                self.wait_times.append(pooled.checked_out_at - start)
+            if self.wait_histogram:
+                self.wait_histogram.record(pooled.checked_out_at - start)
+            return pooled.conn
+
+    def return_connection(self, conn, broken=False):
+        with self.condition:
+            pooled = self.in_use.pop(id(conn), None)
+            if pooled is None:
+                conn.disconnect()
+                return
+            now = time.monotonic()
+            self.checkout_durations.append(now - pooled.checked_out_at)
+            if broken or self.closed:
+                # Сломанное соединение закрывается, на его место при необходимости создается новое
+                conn.disconnect()
+                if broken:
+                    self.counters['broken'] += 1
+            else:
+                pooled.last_used = now
+                self.idle.append(pooled)
+            # Без новых запросов соединений простаивающие закрываются здесь
+            self._evict_idle()
+            self.condition.notify()
+
+    def metrics(self):
+        with self.condition:
+            wait_times = list(self.wait_times)
+            checkout_durations = list(self.checkout_durations)
+            metrics = {
+                'size': self.size,
+                'in_use': len(self.in_use),
+                'peak_in_use': self.peak_in_use,
+                **self.counters,
+            }
+        metrics['wait_p99_ms'] = round(percentile(wait_times, 99) * 1000, 2)
+        metrics['checkout_p50_ms'] = round(percentile(checkout_durations, 50) * 1000, 2)
+        metrics['checkout_p99_ms'] = round(percentile(checkout_durations, 99) * 1000, 2)
+        return metrics
+
+    def close_all(self):
+        # Соединения, которые сейчас у worker-ов, закроются при возврате
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+        for pooled in idle:
+            pooled.conn.disconnect()
@@ -1,6 +1,15 @@
+import argparse
+import calendar
+import csv
+import os
 import random
+import string
+import time
 from datetime import datetime, timedelta
-import csv
+from functools import lru_cache
+from multiprocessing import Pool
+
+import numpy as np
 
 # Конфигурация генератора
 NUM_RECORDS = 3000
@@ -8,19 +17,51 @@ START_DATE = datetime(2000, 1, 1)
 END_DATE = datetime(2024, 12, 31)
 CSV_FILE = 'logs_data_3_000.csv'
 
+# Параллельная генерация
+NUM_SHARDS = 1           # Число шардов (файлов); при 1 шарде пишется CSV_FILE
+NUM_PROCESSES = os.cpu_count()
+BLOCK_SIZE = 100_000     # Строк в одном векторизованном блоке
+SEED = 42                # Один seed -> одинаковые данные при любом числе процессов
+OUTPUT_FORMAT = 'csv'    # csv, native, parquet
+OUTPUT_DIR = '.'
+
+COLUMNS = ['timestamp', 'login', 'event', 'subsystem', 'comment', 'description']
+
+# Распределения значений: uniform - как в исходном генераторе,
+# skewed - перекос и кластеризация как в реальных журналах
+DISTRIBUTIONS = {
+    'uniform': {
+        'login': {'type': 'uniform'},
+        'event': {'type': 'uniform'},
+        'subsystem': {'type': 'uniform'},
+        'session': None,
+        'time_clusters': None,
+    },
+    'skewed': {
+        'login': {'type': 'zipf', 'alpha': 1.1},
+        'event': {'type': 'zipf', 'alpha': 1.3},
+        'subsystem': {'type': 'zipf', 'alpha': 0.8},
+        # Сессия - серия событий одного пользователя в одной подсистеме с короткими паузами
+        'session': {'mean_events': 20, 'mean_gap_sec': 30},
+        # Кластеры плотности во времени (инциденты, релизы); background - доля равномерного фона
+        'time_clusters': {'count': 200, 'spread_days': 3, 'background': 0.3},
+    },
+}
+DISTRIBUTION = 'uniform'
+
 
 # Генерация данных
-def generate_logins(num_logins=1000):
+def generate_logins(num_logins=1000, rng=random):
     domains = ['gmail.com', 'yahoo.com', 'outlook.com', 'company.org', 'domain.net']
     logins = []
     for i in range(1, num_logins + 1):
         user = f'user{i}'
-        domain = random.choice(domains)
+        domain = rng.choice(domains)
         logins.append(f'{user}@{domain}')
     return logins
 
 
-def generate_events(num_events=100):
+def generate_events(num_events=100, rng=random):
     event_types = ['login', 'logout', 'create', 'update', 'delete', 'read', 'search',
                    'export', 'import', 'backup', 'restore', 'error', 'warning', 'info',
                    'audit', 'auth', 'config_change', 'password_reset', 'session_start', 'session_end']
@@ -32,14 +73,14 @@ def generate_events(num_events=100):
             event = event_types[i]
         else:
             # Для оставшихся событий комбинируем базовые типы с суффиксами
-            base_event = random.choice(event_types)
-            suffix = random.choice(['_success', '_failed', '_attempt', '_complete', '_partial'])
+            base_event = rng.choice(event_types)
+            suffix = rng.choice(['_success', '_failed', '_attempt', '_complete', '_partial'])
             event = f"{base_event}{suffix}"
         events.append(event)
     return events
 
 
-def generate_subsystems(num_subsystems=20):
+def generate_subsystems(num_subsystems=20, rng=random):
     base_systems = ['auth', 'db', 'api', 'ui', 'storage', 'network',
                     'reporting', 'monitoring', 'billing', 'messaging']
 
@@ -49,27 +90,29 @@ def generate_subsystems(num_subsystems=20):
             subsystem = base_systems[i]
         else:
             # Для оставшихся подсистем добавляем суффиксы
-            base = random.choice(base_systems)
-            suffix = random.choice(['_backend', '_frontend', '_v2', '_legacy', '_new'])
+            base = rng.choice(base_systems)
+            suffix = rng.choice(['_backend', '_frontend', '_v2', '_legacy', '_new'])
             subsystem = f"{base}{suffix}"
         subsystems.append(subsystem)
     return subsystems
 
 
-def generate_comments():
-    templates = [
-        "User {login} performed {event} in {subsystem}",
-        "Action {event} completed successfully in {subsystem}",
-        "Failed to perform {event} in {subsystem} by {login}",
-        "{event} operation was initiated by {login}",
-        "System recorded {event} for subsystem {subsystem}",
-        "Unexpected behavior during {event}",
-        "Routine operation: {event}",
-        "Security-related action: {event}",
-        "Performance issue detected during {event}",
-        "Debug information for {event}"
-    ]
-    return random.choice(templates)
+COMMENT_TEMPLATES = [
+    "User {login} performed {event} in {subsystem}",
+    "Action {event} completed successfully in {subsystem}",
+    "Failed to perform {event} in {subsystem} by {login}",
+    "{event} operation was initiated by {login}",
+    "System recorded {event} for subsystem {subsystem}",
+    "Unexpected behavior during {event}",
+    "Routine operation: {event}",
+    "Security-related action: {event}",
+    "Performance issue detected during {event}",
+    "Debug information for {event}"
+]
+
+
+def generate_comments(rng=random):
+    return rng.choice(COMMENT_TEMPLATES)
 
 
 def generate_descriptions(event):
@@ -94,46 +137,354 @@ def generate_descriptions(event):
         return f"System event: {event}"
 
 
-def random_timestamp(start, end):
+def random_timestamp(start, end, rng=random):
     delta = end - start
-    random_seconds = random.randint(0, int(delta.total_seconds()))
+    random_seconds = rng.randint(0, int(delta.total_seconds()))
     return start + timedelta(seconds=random_seconds)
 
 
-# Генерация данных
-logins = generate_logins()
-events = generate_events()
-subsystems = generate_subsystems()
-
-# Генерация CSV-файла
-with open(CSV_FILE, 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-
-    # Записываем заголовки
-    writer.writerow(['timestamp', 'login', 'event', 'subsystem', 'comment', 'description'])
-
-    for i in range(NUM_RECORDS):
-        timestamp = random_timestamp(START_DATE, END_DATE)
-        login = random.choice(logins)
-        event = random.choice(events)
-        subsystem = random.choice(subsystems)
-
-        # Генерация комментария с подстановкой значений
-        comment_template = generate_comments()
-        comment = comment_template.format(login=login, event=event, subsystem=subsystem)
-
-        description = generate_descriptions(event)
-
-        # Записываем строку в CSV
-        writer.writerow([
-            timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            login,
-            event,
-            subsystem,
-            comment,
-            description
-        ])
-
-    print(f"Generated a CSV file with {NUM_RECORDS} log entries")
-
-print("Data generation completed")
\ No newline at end of file
+# Словари значений строятся один раз из seed и передаются во все шарды
+def build_vocabulary(seed=SEED):
+    rng = random.Random(seed)
+    logins = generate_logins(rng=rng)
+    events = generate_events(rng=rng)
+    subsystems = generate_subsystems(rng=rng)
+    descriptions = [generate_descriptions(event) for event in events]
+    # Если ни одно значение не требует экранирования, CSV пишется простым join
+    values = logins + events + subsystems + descriptions + COMMENT_TEMPLATES
+    return {
+        'logins': np.array(logins, dtype=object),
+        'events': np.array(events, dtype=object),
+        'subsystems': np.array(subsystems, dtype=object),
+        'descriptions': np.array(descriptions, dtype=object),
+        'csv_plain': not any(char in value for value in values for char in ',"\r\n'),
+    }
+
+
+def _format_comments(template_idx, login, event, subsystem):
+    # Подстановка в шаблоны сложением object-массивов, без format() на каждую строку
+    values = {'login': login, 'event': event, 'subsystem': subsystem}
+    comments = np.empty(len(template_idx), dtype=object)
+    for k, template in enumerate(COMMENT_TEMPLATES):
+        mask = template_idx == k
+        if not mask.any():
+            continue
+        result = np.full(mask.sum(), '', dtype=object)
+        for literal, field, _, _ in string.Formatter().parse(template):
+            if literal:
+                result = result + literal
+            if field:
+                result = result + values[field][mask]
+        comments[mask] = result
+    return comments
+
+
+@lru_cache(maxsize=1)
+def _timestamp_tables():
+    num_days = (END_DATE - START_DATE).days + 1
+    day_names = np.array([(START_DATE + timedelta(days=d)).strftime('%Y-%m-%d ') for d in range(num_days)],
+                         dtype=object)
+    time_names = np.array([f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}' for s in range(86400)],
+                          dtype=object)
+    return day_names, time_names
+
+
+def _format_timestamps(seconds):
+    # Строка даты из таблицы дней + строка времени из таблицы секунд суток
+    day_names, time_names = _timestamp_tables()
+    days, day_seconds = np.divmod(seconds - _epoch(START_DATE), 86400)
+    return day_names[days] + time_names[day_seconds]
+
+
+def _epoch(moment):
+    # Даты без часового пояса трактуются как UTC, чтобы секунды и строки совпадали
+    return calendar.timegm(moment.timetuple())
+
+
+def _value_weights(settings, size, rng):
+    if settings['type'] == 'uniform':
+        return None
+    # Zipf на конечном словаре: вес ранга k пропорционален 1 / k^alpha,
+    # ранги случайно (но воспроизводимо) распределены по значениям
+    weights = 1.0 / np.arange(1, size + 1) ** settings['alpha']
+    return rng.permutation(weights / weights.sum())
+
+
+# Параметры распределений строятся из seed один раз, одинаково для всех шардов
+def build_distribution(name=DISTRIBUTION, vocabulary=None, seed=SEED):
+    settings = DISTRIBUTIONS[name]
+    rng = np.random.default_rng(seed)
+    distribution = {
+        'login': _value_weights(settings['login'], len(vocabulary['logins']), rng),
+        'event': _value_weights(settings['event'], len(vocabulary['events']), rng),
+        'subsystem': _value_weights(settings['subsystem'], len(vocabulary['subsystems']), rng),
+        'session': settings['session'],
+        'time_clusters': None,
+    }
+
+    clusters = settings['time_clusters']
+    if clusters:
+        distribution['time_clusters'] = {
+            'centers': rng.integers(_epoch(START_DATE), _epoch(END_DATE) + 1, clusters['count']),
+            'weights': _value_weights({'type': 'zipf', 'alpha': 1.0}, clusters['count'], rng),
+            'spread_sec': clusters['spread_days'] * 86400,
+            'background': clusters['background'],
+        }
+    return distribution
+
+
+def _sample_values(rng, size, num_values, weights):
+    if weights is None:
+        return rng.integers(0, num_values, size)
+    return rng.choice(num_values, size, p=weights)
+
+
+def _sample_times(rng, size, clusters):
+    start = _epoch(START_DATE)
+    end = _epoch(END_DATE)
+    times = rng.integers(start, end + 1, size)
+    if not clusters:
+        return times
+
+    clustered = rng.random(size) >= clusters['background']
+    count = int(clustered.sum())
+    centers = clusters['centers'][rng.choice(len(clusters['centers']), count, p=clusters['weights'])]
+    times[clustered] = centers + rng.normal(0, clusters['spread_sec'], count).astype(np.int64)
+    return np.clip(times, start, end)
+
+
+def _sample_sessions(rng, num_rows, settings):
+    # Длины сессий ~ геометрическое распределение; возвращает номер сессии каждой строки
+    # и смещение строки от начала сессии в секундах
+    lengths = rng.geometric(1 / settings['mean_events'], num_rows // settings['mean_events'] + 1)
+    while lengths.sum() < num_rows:
+        lengths = np.concatenate([lengths, rng.geometric(1 / settings['mean_events'], len(lengths))])
+    session_of_row = np.repeat(np.arange(len(lengths)), lengths)[:num_rows]
+    num_sessions = int(session_of_row[-1]) + 1
+
+    first_row = np.concatenate([[0], np.cumsum(lengths[:num_sessions - 1])])
+    gaps = rng.exponential(settings['mean_gap_sec'], num_rows)
+    gaps[first_row] = 0
+    elapsed = np.cumsum(gaps)
+    offsets = (elapsed - elapsed[first_row][session_of_row]).astype(np.int64)
+    return session_of_row, num_sessions, offsets
+
+
+# Один блок строк в виде колонок NumPy; timestamp - секунды Unix (int64)
+def generate_block(rng, num_rows, vocabulary, distribution=None):
+    distribution = distribution or build_distribution('uniform', vocabulary)
+    num_logins = len(vocabulary['logins'])
+    num_subsystems = len(vocabulary['subsystems'])
+
+    session = distribution['session']
+    if session:
+        # Логин, подсистема и время начала выбираются на сессию, события - на строку
+        session_of_row, num_sessions, offsets = _sample_sessions(rng, num_rows, session)
+        login_idx = _sample_values(rng, num_sessions, num_logins, distribution['login'])[session_of_row]
+        subsystem_idx = _sample_values(rng, num_sessions, num_subsystems, distribution['subsystem'])[session_of_row]
+        session_start = _sample_times(rng, num_sessions, distribution['time_clusters'])
+        timestamps = np.minimum(session_start[session_of_row] + offsets, _epoch(END_DATE))
+    else:
+        login_idx = _sample_values(rng, num_rows, num_logins, distribution['login'])
+        subsystem_idx = _sample_values(rng, num_rows, num_subsystems, distribution['subsystem'])
+        timestamps = _sample_times(rng, num_rows, distribution['time_clusters'])
+
+    event_idx = _sample_values(rng, num_rows, len(vocabulary['events']), distribution['event'])
+    template_idx = rng.integers(0, len(COMMENT_TEMPLATES), num_rows)
+
+    login = vocabulary['logins'][login_idx]
+    event = vocabulary['events'][event_idx]
+    subsystem = vocabulary['subsystems'][subsystem_idx]
+
+    return {
+        'timestamp': timestamps,
+        'login': login,
+        'event': event,
+        'subsystem': subsystem,
+        'comment': _format_comments(template_idx, login, event, subsystem),
+        'description': vocabulary['descriptions'][event_idx],
+    }
+
+
+# Запись блоков в файл выбранного формата
+class CsvWriter:
+    def __init__(self, path, plain=False):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+        self.plain = plain
+
+    def write(self, block):
+        columns = [block[name].tolist() for name in COLUMNS[1:]]
+        columns.insert(0, _format_timestamps(block['timestamp']).tolist())
+        if self.plain:
+            self.file.write(''.join(map(_csv_line, zip(*columns))))
+        else:
+            self.writer.writerows(zip(*columns))
+
+    def close(self):
+        self.file.close()
+
+
+def _csv_line(row):
+    return ','.join(row) + '\r\n'
+
+
+def _varint(value):
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _native_strings(values):
+    encoded = [value.encode('utf-8') for value in values]
+    return b''.join([_varint(len(item)) + item for item in encoded])
+
+
+# Формат Native ClickHouse: блок = число колонок, число строк, затем
+# для каждой колонки имя, тип и данные (DateTime - UInt32 LE, String - varint длина + байты)
+class NativeWriter:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+
+    def write(self, block):
+        num_rows = len(block['timestamp'])
+        parts = [_varint(len(COLUMNS)), _varint(num_rows)]
+        for name in COLUMNS:
+            type_name = 'DateTime' if name == 'timestamp' else 'String'
+            parts.append(_native_strings([name, type_name]))
+            if name == 'timestamp':
+                parts.append(block[name].astype('<u4').tobytes())
+            else:
+                parts.append(_native_strings(block[name]))
+        self.file.write(b''.join(parts))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([('timestamp', pa.timestamp('s'))] + [(name, pa.string()) for name in COLUMNS[1:]])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, block):
+        arrays = [self.pa.array(block['timestamp'].astype('datetime64[s]'))]
+        arrays += [self.pa.array(block[name].tolist(), type=self.pa.string()) for name in COLUMNS[1:]]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+# Вставка блоков прямо в ClickHouse, без промежуточных файлов
+class InsertSink:
+    def __init__(self, table, ch_config):
+        from clickhouse_driver import Client
+        self.client = Client(**ch_config)
+        self.query = f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES"
+
+    def write(self, block):
+        columns = [block[name].tolist() for name in COLUMNS]
+        columns[0] = block['timestamp'].astype('datetime64[s]').astype(object).tolist()
+        self.client.execute(self.query, columns, columnar=True)
+
+    def close(self):
+        self.client.disconnect()
+
+
+WRITERS = {
+    'csv': (CsvWriter, 'csv'),
+    'native': (NativeWriter, 'native'),
+    'parquet': (ParquetWriter, 'parquet'),
+}
+
+
+def shard_path(options, shard):
+    if options['shards'] == 1 and options['format'] == 'csv':
+        return os.path.join(options['output_dir'], CSV_FILE)
+    extension = WRITERS[options['format']][1]
+    return os.path.join(options['output_dir'], f"logs_data_part_{shard:04d}.{extension}")
+
+
+def generate_shard(args):
+    shard, num_rows, seed_sequence, vocabulary, distribution, options = args
+    rng = np.random.Generator(np.random.PCG64(seed_sequence))
+    if options['sink_table']:
+        sink = InsertSink(options['sink_table'], options['ch_config'])
+    elif options['format'] == 'csv':
+        sink = CsvWriter(shard_path(options, shard), plain=vocabulary['csv_plain'])
+    else:
+        sink = WRITERS[options['format']][0](shard_path(options, shard))
+
+    start = time.process_time()
+    written = 0
+    try:
+        while written < num_rows:
+            block_rows = min(options['block_size'], num_rows - written)
+            sink.write(generate_block(rng, block_rows, vocabulary, distribution))
+            written += block_rows
+    finally:
+        sink.close()
+    return shard, written, time.process_time() - start
+
+
+def generate(options):
+    vocabulary = build_vocabulary(options['seed'])
+    distribution = build_distribution(options['distribution'], vocabulary, options['seed'])
+    # Независимый поток случайных чисел на каждый шард
+    seeds = np.random.SeedSequence(options['seed']).spawn(options['shards'])
+    base, extra = divmod(options['rows'], options['shards'])
+    tasks = [(shard, base + (1 if shard < extra else 0), seeds[shard], vocabulary, distribution, options)
+             for shard in range(options['shards'])]
+
+    start = time.time()
+    with Pool(min(options['processes'], options['shards'])) as pool:
+        shards = pool.map(generate_shard, tasks)
+    duration = time.time() - start
+
+    total_rows = sum(rows for _, rows, _ in shards)
+    cpu_time = sum(cpu for _, _, cpu in shards)
+    processes = min(options['processes'], options['shards'])
+    print(f"Generated {total_rows} log entries in {options['shards']} shard(s) "
+          f"using {processes} process(es) in {duration:.2f} sec")
+    print(f"Throughput: {total_rows / duration:.0f} rows/sec total, "
+          f"{total_rows / duration / processes:.0f} rows/sec per core "
+          f"({total_rows / cpu_time:.0f} rows per CPU-second)")
+    return shards
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description='Synthetic log generator')
+    parser.add_argument('--rows', type=int, default=NUM_RECORDS)
+    parser.add_argument('--shards', type=int, default=NUM_SHARDS)
+    parser.add_argument('--processes', type=int, default=NUM_PROCESSES)
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--format', choices=list(WRITERS), default=OUTPUT_FORMAT)
+    parser.add_argument('--distribution', choices=list(DISTRIBUTIONS), default=DISTRIBUTION)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--sink-table', help='insert into this ClickHouse table instead of writing files')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--database', default='course_db')
+    args = parser.parse_args()
+
+    options = vars(args)
+    options['ch_config'] = {
+        'host': options.pop('host'),
+        'user': 'default',
+        'password': '',
+        'database': options.pop('database'),
+    }
+    return options
+
+
+if __name__ == "__main__":
+    generate(parse_options())
+    print("Data generation completed")
@@ -0,0 +1,104 @@
+import random
+import threading
+import time
+
+from clickhouse_driver.errors import ErrorCodes, ServerException
+from clickhouse_driver.result import QueryInfo
+
+from retry_policy import SERVER_OVERLOADED
+
+# Тексты ошибок как у сервера, чтобы логи прогона выглядели так же
+ERROR_MESSAGES = {
+    SERVER_OVERLOADED: "CPU is overloaded, CPU is waiting for execution way more than executing",
+    ErrorCodes.TIMEOUT_EXCEEDED: "Timeout exceeded: elapsed 30.000 seconds, maximum: 30",
+    ErrorCodes.TOO_MANY_SIMULTANEOUS_QUERIES: "Too many simultaneous queries. Maximum: 100",
+    ErrorCodes.MEMORY_LIMIT_EXCEEDED: "Memory limit (total) exceeded",
+    ErrorCodes.TOO_MANY_PARTS: "Too many parts (300). Merges are processing significantly slower than inserts",
+}
+
+
+# Локальная имитация сервера ClickHouse для бенчмарков без реального сервера:
+# задержка вставки = base_latency + per_row_latency * rows, число одновременно
+# обрабатываемых запросов ограничено max_concurrent_queries.
+# Внесение сбоев: доля запросов error_rate и все запросы в интервалах outages
+# (секунды от создания сервера) завершаются ошибкой с кодом error_code. error_codes -
+# смесь кодов с весами, например {SERVER_OVERLOADED: 3, ErrorCodes.TIMEOUT_EXCEEDED: 1}
+class FakeServer:
+    def __init__(self, base_latency=0.005, per_row_latency=0.000002, max_concurrent_queries=None,
+                 error_rate=0.0, error_code=ErrorCodes.TOO_MANY_SIMULTANEOUS_QUERIES, outages=(), seed=None,
+                 error_codes=None):
+        self.base_latency = base_latency
+        self.per_row_latency = per_row_latency
+        self.slots = threading.BoundedSemaphore(max_concurrent_queries) if max_concurrent_queries else None
+        self.error_rate = error_rate
+        self.error_codes = dict(error_codes or {error_code: 1})
+        self.outages = list(outages)
+        self.rng = random.Random(seed)
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.inserted_rows = 0
+        self.queries = 0
+        self.errors = 0
+        # Прочитанные строки/байты последнего запроса потока - для FakeClient.last_query
+        self.progress = threading.local()
+
+    def fault(self):
+        # Код ошибки для запроса или None
+        elapsed = time.monotonic() - self.started_at
+        if not any(start <= elapsed < end for start, end in self.outages):
+            if not self.error_rate or self.rng.random() >= self.error_rate:
+                return None
+        return self.rng.choices(list(self.error_codes), weights=list(self.error_codes.values()))[0]
+
+    def delay(self, seconds):
+        if self.slots:
+            with self.slots:
+                time.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+    def check_fault(self):
+        with self.lock:
+            code = self.fault()
+            if code is not None:
+                self.errors += 1
+        if code is not None:
+            time.sleep(self.base_latency)
+            raise ServerException(ERROR_MESSAGES.get(code, f"Injected fault (code {code})"), code)
+
+    def client(self, **config):
+        return FakeClient(self, **config)
+
+    def execute(self, query, params=None, columnar=False, **kwargs):
+        self.check_fault()
+        rows = 0
+        if params and query.lstrip().upper().startswith('INSERT'):
+            rows = len(params[0]) if columnar else len(params)
+
+        self.delay(self.base_latency + self.per_row_latency * rows)
+
+        with self.lock:
+            self.queries += 1
+            self.inserted_rows += rows
+        return []
+
+
+# Клиент с интерфейсом clickhouse_driver.Client, привязанный к FakeServer
+class FakeClient:
+    def __init__(self, server, **config):
+        self.server = server
+        self.config = config
+        self.settings = dict(config.get('settings') or {})
+        self.last_query = None
+
+    def execute(self, query, params=None, **kwargs):
+        self.server.progress.value = None
+        result = self.server.execute(query, params, **kwargs)
+        # Как у clickhouse_driver: last_query.progress - прочитанные сервером строки и байты
+        self.last_query = QueryInfo()
+        if self.server.progress.value:
+            self.last_query.progress.rows, self.last_query.progress.bytes = self.server.progress.value
+        return result
+
+    def disconnect(self):
+        pass
@@ -0,0 +1,282 @@
+import csv
+import re
+import sys
+import uuid
+from glob import glob
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from columnar_batch import LOG_COLUMNS
+from query_log_collector import RESULT_TABLE
+from retry_policy import execute_with_retry
+from schema_matrix import rename
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+
+ADVISOR = {
+    'poor_pruning_ratio': 0.5,   # Запрос читает не меньше этой доли таблицы - отсечение плохое
+    'sample_fraction': 0.1,      # Доля строк в копии для проверки кандидатов
+    'max_sample_rows': 1_000_000,
+    'repetitions': 3,
+    'max_candidates': 10,        # Сколько кандидатов с наибольшим весом проверять
+    'prefix': 'advisor_',        # Префикс копий таблицы
+    'select_files': 'queries_select/*.txt',
+    'results_file': 'results/index_advisor.csv',
+}
+
+# Условие на колонку логов: column [NOT] LIKE/=/IN/</BETWEEN значение
+PREDICATE = re.compile(
+    rf"\b({'|'.join(LOG_COLUMNS)})\s+(NOT\s+)?(LIKE|ILIKE|IN|BETWEEN|=|!=|<=|>=|<|>)\s*('(?:[^'\\]|\\.)*'|\([^)]*\))",
+    re.IGNORECASE)
+
+
+def classify_predicate(operator, value):
+    operator = operator.upper()
+    if operator in ('LIKE', 'ILIKE'):
+        pattern = value.strip("'")
+        return 'substring' if pattern.startswith('%') else 'prefix'
+    if operator in ('=', 'IN'):
+        return 'equality'
+    if operator == '!=':
+        return None
+    return 'range'
+
+
+def predicates(query):
+    # (колонка, вид условия) для условий запроса; отрицания индексами не ускоряются
+    where = re.split(r"\bWHERE\b", query, maxsplit=1, flags=re.IGNORECASE)
+    if len(where) < 2:
+        return []
+    result = []
+    for column, negation, operator, value in PREDICATE.findall(where[1]):
+        kind = None if negation else classify_predicate(operator, value)
+        if kind and (column, kind) not in result:
+            result.append((column, kind))
+    return result
+
+
+def candidates_for(column, kind):
+    # Кандидаты для условия: индекс пропуска, проекция и ключ сортировки
+    candidates = []
+    if kind in ('prefix', 'substring'):
+        candidates.append(('index', f"{column} ngrambf_v1",
+                           f"ADD INDEX advisor_{column}_ngram {column} TYPE ngrambf_v1(3, 1024, 3, 0) GRANULARITY 1"))
+    if kind == 'equality':
+        candidates.append(('index', f"{column} bloom_filter",
+                           f"ADD INDEX advisor_{column}_bloom {column} TYPE bloom_filter GRANULARITY 1"))
+    if kind == 'range':
+        candidates.append(('index', f"{column} minmax",
+                           f"ADD INDEX advisor_{column}_minmax {column} TYPE minmax GRANULARITY 1"))
+    if kind in ('prefix', 'equality', 'range'):
+        # LIKE 'abc%' и равенство используют первичный ключ, LIKE '%abc' - нет
+        key = f"({column}, timestamp)" if column != 'timestamp' else "(timestamp)"
+        candidates.append(('projection', f"projection by {column}",
+                           f"ADD PROJECTION advisor_by_{column} (SELECT * ORDER BY {key})"))
+        candidates.append(('order_by', f"ORDER BY {key}", key))
+    return candidates
+
+
+class IndexAdvisor:
+    def __init__(self, table, settings=ADVISOR, config=CH_CONFIG):
+        self.table = table
+        self.settings = settings
+        self.database = config.get('database', 'default')
+        self.client = Client(**config)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.sequence = 0
+
+    def total_rows(self, table):
+        return execute_with_retry(self.client, f"SELECT count() FROM {table}")[0][0]
+
+    def workload(self, run_id=None):
+        # Запросы к таблице из собранного журнала (benchmark_query_log): средние read_rows и длительность
+        rows = execute_with_retry(self.client, f"""
+            SELECT query, avg(read_rows), avg(query_duration_ms), count(), groupUniqArrayArray(projections)
+            FROM {RESULT_TABLE}
+            WHERE has(tables, %(table)s) AND query_kind = 'Select'
+              AND (%(run_id)s = '' OR run_id = %(run_id)s)
+            GROUP BY query
+        """, {'table': f"{self.database}.{self.table}", 'run_id': run_id or ''}) or []
+        if rows:
+            return [{'query': query, 'read_rows': read_rows, 'duration_ms': duration, 'runs': runs,
+                     'projections': projections} for query, read_rows, duration, runs, projections in rows]
+        # Журнала нет - условия из queries_select/*.txt, замер на самой таблице
+        print(f"No collected queries for {self.table}, measuring queries from {self.settings['select_files']}")
+        queries = []
+        for file_path in sorted(glob(self.settings['select_files'])):
+            with open(file_path, 'r') as f:
+                queries.extend(f"SELECT count(*) FROM {self.table} WHERE {line.strip()}" for line in f if line.strip())
+        stats = self.measure(self.table, queries)
+        return [{'query': query, 'read_rows': stat['read_rows'], 'duration_ms': stat['duration_ms'], 'runs': 1,
+                 'projections': []} for query, stat in zip(queries, stats['queries'])]
+
+    def poorly_pruned(self, workload):
+        total = self.total_rows(self.table)
+        threshold = self.settings['poor_pruning_ratio'] * total
+        return [query for query in workload if total and query['read_rows'] >= threshold], total
+
+    def existing_indexes(self):
+        rows = execute_with_retry(self.client, """
+            SELECT expr, type
+            FROM system.data_skipping_indices
+            WHERE database = currentDatabase() AND table = %(table)s
+        """, {'table': self.table}) or []
+        return {(expr, index_type) for expr, index_type in rows}
+
+    def propose(self, poor_queries):
+        # Кандидат -> запросы, которым он может помочь; вес - суммарная длительность этих запросов.
+        # Индексы, которые уже есть у таблицы, не предлагаются
+        existing = self.existing_indexes()
+        proposals = {}
+        for query in poor_queries:
+            for column, kind in predicates(query['query']):
+                for candidate in candidates_for(column, kind):
+                    if candidate[0] == 'index' and (column, candidate[1].split()[1]) in existing:
+                        continue
+                    entry = proposals.setdefault(candidate, {'queries': [], 'weight': 0.0})
+                    if query['query'] not in entry['queries']:
+                        entry['queries'].append(query['query'])
+                        entry['weight'] += query['duration_ms'] * query['runs']
+        return sorted(proposals.items(), key=lambda item: -item[1]['weight'])
+
+    def run_query(self, query):
+        self.sequence += 1
+        query_id = f"{self.run_id}-advisor-{self.sequence}"
+        execute_with_retry(self.client, query, query_id=query_id)
+        return query_id
+
+    def measure(self, table, queries):
+        # Выбранные засечки (гранулы), прочитанные строки и длительность по query_log
+        query_ids = {}
+        for query in queries:
+            runs = [self.run_query(rename(query, self.table, table)) for _ in range(self.settings['repetitions'])]
+            for query_id in runs:
+                query_ids[query_id] = query
+        execute_with_retry(self.client, "SYSTEM FLUSH LOGS")
+        rows = execute_with_retry(self.client, """
+            SELECT query_id, ProfileEvents['SelectedMarks'], read_rows, query_duration_ms
+            FROM system.query_log
+            WHERE type = 'QueryFinish' AND event_date >= yesterday() AND query_id IN %(query_ids)s
+        """, {'query_ids': list(query_ids)}) or []
+        per_query = {query: {'marks': [], 'read_rows': [], 'duration_ms': []} for query in queries}
+        for query_id, marks, read_rows, duration in rows:
+            stat = per_query[query_ids[query_id]]
+            stat['marks'].append(marks)
+            stat['read_rows'].append(read_rows)
+            stat['duration_ms'].append(duration)
+        stats = [{key: sorted(values)[len(values) // 2] if values else 0 for key, values in stat.items()}
+                 for stat in per_query.values()]
+        return {
+            'queries': stats,
+            'marks': sum(stat['marks'] for stat in stats),
+            'read_rows': sum(stat['read_rows'] for stat in stats),
+            'duration_ms': sum(stat['duration_ms'] for stat in stats),
+        }
+
+    def table_size(self, table):
+        rows = execute_with_retry(self.client, """
+            SELECT sum(marks), sum(bytes_on_disk)
+            FROM system.parts
+            WHERE database = currentDatabase() AND table = %(table)s AND active
+        """, {'table': table})
+        return rows[0] if rows else (0, 0)
+
+    def create_sample(self, name):
+        execute_with_retry(self.client, f"DROP TABLE IF EXISTS {name}")
+        execute_with_retry(self.client, f"CREATE TABLE {name} AS {self.table}")
+        execute_with_retry(self.client, f"""
+            INSERT INTO {name} SELECT * FROM {self.table}
+            WHERE randCanonical() < {self.settings['sample_fraction']}
+            LIMIT {self.settings['max_sample_rows']}
+        """)
+        execute_with_retry(self.client, f"OPTIMIZE TABLE {name} FINAL")
+
+    def create_candidate(self, name, base, candidate):
+        kind, _, ddl = candidate
+        execute_with_retry(self.client, f"DROP TABLE IF EXISTS {name}")
+        if kind == 'order_by':
+            execute_with_retry(self.client, f"CREATE TABLE {name} ENGINE = MergeTree() ORDER BY {ddl} "
+                                            f"AS SELECT * FROM {base}")
+        else:
+            # Индекс и проекция строятся при вставке, отдельная материализация не нужна
+            execute_with_retry(self.client, f"CREATE TABLE {name} AS {base}")
+            execute_with_retry(self.client, f"ALTER TABLE {name} {ddl}")
+            execute_with_retry(self.client, f"INSERT INTO {name} SELECT * FROM {base}")
+        execute_with_retry(self.client, f"OPTIMIZE TABLE {name} FINAL")
+
+    def validate(self, proposals, limit):
+        base = f"{self.settings['prefix']}{self.table}_base"
+        name = f"{self.settings['prefix']}{self.table}_candidate"
+        self.create_sample(base)
+        base_marks, base_bytes = self.table_size(base)
+        results = []
+        try:
+            for candidate, entry in proposals[:limit]:
+                queries = entry['queries']
+                baseline = self.measure(base, queries)
+                try:
+                    self.create_candidate(name, base, candidate)
+                except Exception as e:
+                    print(f"Skipping {candidate[1]}: {e}")
+                    continue
+                measured = self.measure(name, queries)
+                _, candidate_bytes = self.table_size(name)
+                results.append([
+                    candidate[0], candidate[1], len(queries),
+                    baseline['marks'], measured['marks'],
+                    f"{(1 - measured['marks'] / baseline['marks']) * 100 if baseline['marks'] else 0:.1f}",
+                    f"{(1 - measured['read_rows'] / baseline['read_rows']) * 100 if baseline['read_rows'] else 0:.1f}",
+                    baseline['duration_ms'], measured['duration_ms'],
+                    f"{(candidate_bytes / base_bytes - 1) * 100 if base_bytes else 0:+.1f}",
+                    candidate[2] if candidate[0] != 'order_by' else candidate[1],
+                ])
+        finally:
+            execute_with_retry(self.client, f"DROP TABLE IF EXISTS {name}")
+            execute_with_retry(self.client, f"DROP TABLE IF EXISTS {base}")
+        print(f"Sample: {base_marks} marks, {base_bytes} bytes")
+        return results
+
+    def run(self, run_id=None):
+        workload = self.workload(run_id)
+        poor_queries, total = self.poorly_pruned(workload)
+        print(f"{len(poor_queries)} of {len(workload)} queries on {self.table} read at least "
+              f"{self.settings['poor_pruning_ratio'] * 100:.0f}% of {total} rows")
+        for query in poor_queries:
+            projections = f" (projections: {', '.join(query['projections'])})" if query['projections'] else ''
+            print(f"  {query['read_rows'] / total * 100:5.1f}% rows, {query['duration_ms']:.0f} ms: "
+                  f"{query['query'][:100]}{projections}")
+        proposals = self.propose(poor_queries)
+        if not proposals:
+            print("No candidates")
+            return []
+
+        results = self.validate(proposals, self.settings['max_candidates'])
+        results.sort(key=lambda row: -float(row[5]))
+        headers = ['Kind', 'Candidate', 'Queries', 'Marks before', 'Marks after', 'Granule pruning gain %',
+                   'Read rows gain %', 'Time before (ms)', 'Time after (ms)', 'Storage %', 'DDL']
+        print(tabulate(results, headers=headers, tablefmt='grid'))
+        with open(self.settings['results_file'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['table'] + headers)
+            writer.writerows([self.table, *row] for row in results)
+        print(f"\nResults saved to {self.settings['results_file']}")
+        return results
+
+
+def main():
+    # python index_advisor.py <таблица> [run_id] - кандидаты по запросам из benchmark_query_log
+    # (всех прогонов или одного run_id) с проверкой на выборке из таблицы
+    if len(sys.argv) < 2:
+        print("Usage: python index_advisor.py <table> [run_id]")
+        sys.exit(1)
+    IndexAdvisor(sys.argv[1]).run(sys.argv[2] if len(sys.argv) > 2 else None)
+
+
+if __name__ == "__main__":
+    main()
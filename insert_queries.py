@@ -1,143 +1,442 @@
 from clickhouse_driver import Client
+from concurrent.futures import ThreadPoolExecutor
 import time
 import csv
-from datetime import datetime
-from time import sleep
-
-client = Client(
-    host='localhost',
-    user='default',
-    password='',
-    database='course_db'
-)
-
-def read_csv_file(file_path):
-    data = []
-    with open(file_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            timestamp = datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S')
-
-            data.append({
-                'timestamp': timestamp,
-                'login': row['login'],
-                'event': row['event'],
-                'subsystem': row['subsystem'],
-                'comment': row['comment'],
-                'description': row['description']
-            })
-    return data
-
-def execute_with_retry(query, params=None, max_retries=3, initial_retry_delay=5):
-    retry_delay = initial_retry_delay
-    for attempt in range(max_retries):
-        try:
-            return client.execute(query, params) if params else client.execute(query)
-        except Exception as e:
-            if "CPU is overloaded" in str(e) and attempt < max_retries - 1:
-                print(f"CPU overload detected, retrying in {retry_delay} seconds (attempt {attempt + 1}/{max_retries})")
-                sleep(retry_delay)
-                retry_delay *= 2
-                continue
-            raise e
-    return None
-
-def insert_single(data):
+import sys
+import threading
+import uuid
+
+from columnar_batch import ColumnarBatch
+from columnar_server import ColumnarServer
+from load_controller import percentile
+from log_reader import read_log_blocks, DEFAULT_BLOCK_SIZE
+from query_log_collector import QueryLogCollector, log_comment_variant
+from retry_policy import execute_with_retry
+
+CSV_FILE = 'logs_data_3_000.csv'
+TARGET_TABLE = 'logs_insert_test'
+BUFFER_TABLE = 'logs_buffer'  # Buffer(..., 'logs_insert_test', ...) из skripts/test_insert.sql
+
+# Мелкие вставки для async_insert и микро-пакетов: столько строк в одном запросе клиента
+SMALL_INSERT_ROWS = 10
+# Одновременных клиентов с мелкими вставками для async_insert
+ASYNC_CLIENTS = 16
+# Клиентские микро-пакеты: отправка по flush_rows строк или через flush_interval_sec
+MICRO_BATCH = {
+    'flush_rows': 1000,
+    'flush_interval_sec': 1.0,
+}
+# Видимость строк проверяется запросом count() к TARGET_TABLE
+VISIBILITY = {
+    'poll_interval_sec': 0.05,
+    'timeout_sec': 60.0,
+}
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+# Фабрика соединений: clickhouse_driver.Client или клиент локального сервера (--fake)
+client_factory = Client
+client = Client(**CH_CONFIG)
+
+# Локальный columnar_server.ColumnarServer вместо ClickHouse: таблица как в skripts/test_insert.sql
+FAKE_SERVER = {
+    'base_latency': 0.001,
+    'per_row_latency': 0.0000005,
+}
+TARGET_DDL = f"""
+    CREATE TABLE {TARGET_TABLE} (
+        timestamp DateTime,
+        login LowCardinality(String),
+        event LowCardinality(String),
+        subsystem LowCardinality(String),
+        comment String,
+        description String
+    ) ENGINE = MergeTree()
+    ORDER BY (timestamp, login, event, subsystem)
+"""
+
+def connect(**options):
+    # Новое соединение с дополнительными параметрами клиента (сжатие, настройки)
+    global client
+    client.disconnect()
+    client = client_factory(**CH_CONFIG, **options)
+    return client
+
+def use_fake_server():
+    # Buffer-таблицы и async_insert локальный сервер не воспроизводит: async-вставки
+    # выполняются как обычные, стратегия buffer пропускается
+    global client_factory
+    server = ColumnarServer(tables=[TARGET_DDL], **FAKE_SERVER)
+    client_factory = server.client
+    return server
+
+# Потоковое чтение блоками по колонкам: файл целиком в память не загружается. Время
+# чтения и разбора блоков копится отдельно и вычитается из времени стратегии
+class BlockReader:
+    def __init__(self, file_path, block_size=DEFAULT_BLOCK_SIZE):
+        self.blocks = read_log_blocks(file_path, block_size)
+        self.read_sec = 0.0
+        self.read_cpu_sec = 0.0
+
+    def __iter__(self):
+        while True:
+            start, cpu_start = time.perf_counter(), time.process_time()
+            block = next(self.blocks, None)
+            self.read_sec += time.perf_counter() - start
+            self.read_cpu_sec += time.process_time() - cpu_start
+            if block is None:
+                return
+            yield block
+
+def read_csv_file(file_path, block_size=DEFAULT_BLOCK_SIZE):
+    return BlockReader(file_path, block_size)
+
+def read_time(blocks):
+    # Время чтения блоков, если они из BlockReader
+    return getattr(blocks, 'read_sec', 0.0)
+
+def small_chunks(blocks, rows=SMALL_INSERT_ROWS):
+    # Поток мелких вставок, как от множества источников событий
+    for block in blocks:
+        for start in range(0, len(block), rows):
+            chunk = ColumnarBatch(min(rows, len(block) - start))
+            chunk.extend(block, start)
+            yield chunk
+
+# Замер видимости: отдельное соединение опрашивает count() целевой таблицы, время
+# видимости каждой вставки - от передачи строк клиенту до первого опроса, в котором
+# их уже видно (вместо фиксированной паузы на сброс буфера)
+class VisibilityProbe:
+    def __init__(self, table=TARGET_TABLE, poll_interval_sec=VISIBILITY['poll_interval_sec']):
+        self.table = table
+        self.poll_interval_sec = poll_interval_sec
+        self.conn = client_factory(**CH_CONFIG)
+        self.base_rows = self.count()
+        self.submitted = []
+        self.polls = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='VisibilityProbe', daemon=True)
+
+    def count(self):
+        return execute_with_retry(self.conn, f"SELECT count() FROM {self.table}")[0][0]
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.polls.append((time.time(), self.count() - self.base_rows))
+            self.stop_event.wait(self.poll_interval_sec)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, total_rows):
+        # Строки до total_rows (нарастающим итогом) переданы на вставку
+        self.submitted.append((time.time(), total_rows))
+
+    def wait(self, total_rows, timeout_sec=VISIBILITY['timeout_sec']):
+        # Время, когда стали видны все строки, или None по таймауту
+        deadline = time.time() + timeout_sec
+        while time.time() < deadline:
+            if self.polls and self.polls[-1][1] >= total_rows:
+                break
+            time.sleep(self.poll_interval_sec)
+        self.stop_event.set()
+        self.thread.join()
+        self.conn.disconnect()
+        visible = [poll_time for poll_time, rows in self.polls if rows >= total_rows]
+        return visible[0] if visible else None
+
+    def latencies(self):
+        # Задержка видимости для каждой переданной порции строк
+        result = []
+        polls = iter(self.polls)
+        poll_time, rows = next(polls, (None, 0))
+        for submit_time, total_rows in self.submitted:
+            while poll_time is not None and (rows < total_rows or poll_time < submit_time):
+                poll_time, rows = next(polls, (None, 0))
+            if poll_time is None:
+                break
+            result.append(poll_time - submit_time)
+        return result
+
+def submit(probe, rows):
+    if probe:
+        probe.submit(rows)
+
+def insert_single(blocks, probe=None, table=TARGET_TABLE):
     print("Starting single-row insertion...")
     start = time.time()
+    rows = 0
 
-    for row in data:
-        execute_with_retry(
-            "INSERT INTO logs_insert_test VALUES",
-            [row]
-        )
+    for block in blocks:
+        for row in zip(*block.data()):
+            rows += 1
+            submit(probe, rows)
+            execute_with_retry(
+                client,
+                f"INSERT INTO {table} VALUES",
+                [row]
+            )
 
-    duration = time.time() - start
+    duration = time.time() - start - read_time(blocks)
     print(f"Single-row insertion completed. Time: {duration:.2f} sec")
-    return duration
+    return duration, rows
 
-def insert_bulk(data):
+def insert_bulk(blocks, probe=None, table=TARGET_TABLE):
     print("Starting bulk insertion...")
     start = time.time()
+    rows = 0
 
-    execute_with_retry(
-        "INSERT INTO logs_insert_test VALUES",
-        data
-    )
+    for block in blocks:
+        rows += len(block)
+        submit(probe, rows)
+        execute_with_retry(
+            client,
+            block.insert_query(table),
+            block.data(),
+            columnar=True
+        )
 
-    duration = time.time() - start
+    duration = time.time() - start - read_time(blocks)
     print(f"Bulk insertion completed. Time: {duration:.2f} sec")
-    return duration
+    return duration, rows
 
-def insert_buffer(data):
+def insert_buffer(blocks, probe=None):
+    # Время - до подтверждения вставки в буфер; когда строки появятся в целевой
+    # таблице, показывает VisibilityProbe
     print("Starting buffer insertion...")
     start = time.time()
+    rows = 0
 
-    execute_with_retry(
-        "INSERT INTO logs_buffer VALUES",
-        data
-    )
-
-    sleep(11)
+    for block in blocks:
+        rows += len(block)
+        submit(probe, rows)
+        execute_with_retry(
+            client,
+            block.insert_query(BUFFER_TABLE),
+            block.data(),
+            columnar=True
+        )
 
-    duration = time.time() - start
+    duration = time.time() - start - read_time(blocks)
     print(f"Buffer insertion completed. Time: {duration:.2f} sec")
-    return duration
+    return duration, rows
 
-def insert_native(data):
+def insert_native(blocks, probe=None, table=TARGET_TABLE):
     print("Starting Native format insertion...")
     start = time.time()
+    rows = 0
 
-    execute_with_retry(
-        "INSERT INTO logs_insert_test FORMAT Native",
-        data
-    )
+    for block in blocks:
+        rows += len(block)
+        submit(probe, rows)
+        execute_with_retry(
+            client,
+            f"INSERT INTO {table} FORMAT Native",
+            block.data(),
+            columnar=True
+        )
 
-    duration = time.time() - start
+    duration = time.time() - start - read_time(blocks)
     print(f"Native insertion completed. Time: {duration:.2f} sec")
-    return duration
+    return duration, rows
 
-def save_results(results, data_length, filename='insertion_results.csv'):
-    with open(filename, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Method', 'Time (sec)', 'Rows/sec'])
-        for method, duration in results.items():
-            writer.writerow([method, f"{duration:.2f}", f"{data_length/duration:.0f}"])
-    print(f"\nResults saved to {filename}")
+def insert_async(blocks, probe=None, wait=True):
+    # Мелкие вставки от ASYNC_CLIENTS клиентов одновременно, сервер сам собирает их
+    # в пакеты (async_insert). С wait_for_async_insert = 1 подтверждение приходит после
+    # записи пакета на диск, с 0 - сразу после попадания в буфер сервера
+    print(f"Starting async insertion (wait_for_async_insert={int(wait)})...")
+    start = time.time()
+    rows = 0
+    settings = {**client.settings, 'async_insert': 1, 'wait_for_async_insert': int(wait)}
+    local = threading.local()
+    connections = []
 
-def main():
-    data = read_csv_file('logs_data_3_000.csv')
+    def send(chunk):
+        if not hasattr(local, 'conn'):
+            local.conn = client_factory(**CH_CONFIG, settings=settings)
+            connections.append(local.conn)
+        execute_with_retry(local.conn, chunk.insert_query(TARGET_TABLE), chunk.data(), columnar=True)
 
-    # Проверяем количество загруженных строк
-    print(f"Loaded {len(data)} rows from file")
+    with ThreadPoolExecutor(max_workers=ASYNC_CLIENTS) as executor:
+        futures = []
+        for chunk in small_chunks(blocks):
+            rows += len(chunk)
+            submit(probe, rows)
+            futures.append(executor.submit(send, chunk))
+        for future in futures:
+            future.result()
+    for conn in connections:
+        conn.disconnect()
 
-    results = {}
+    duration = time.time() - start - read_time(blocks)
+    print(f"Async insertion completed. Time: {duration:.2f} sec")
+    return duration, rows
+
+def insert_async_nowait(blocks, probe=None):
+    return insert_async(blocks, probe, wait=False)
+
+# Клиентские микро-пакеты: мелкие вставки копятся в ColumnarBatch и отправляются
+# одним INSERT, когда набралось flush_rows строк или прошло flush_interval_sec
+# с первой строки пакета (по таймеру в отдельном потоке)
+class MicroBatcher:
+    def __init__(self, send, flush_rows=MICRO_BATCH['flush_rows'],
+                 flush_interval_sec=MICRO_BATCH['flush_interval_sec']):
+        self.send = send
+        self.flush_rows = flush_rows
+        self.flush_interval_sec = flush_interval_sec
+        self.lock = threading.Lock()
+        self.batch = ColumnarBatch(flush_rows)
+        self.first_row_at = None
+        self.flushes = {'size': 0, 'time': 0, 'close': 0}
+        self.stop_event = threading.Event()
+        self.timer = threading.Thread(target=self.run, name='MicroBatcher', daemon=True)
+        self.timer.start()
+
+    def add(self, block):
+        start = 0
+        while start < len(block):
+            with self.lock:
+                if self.first_row_at is None:
+                    self.first_row_at = time.time()
+                start += self.batch.extend(block, start)
+                full = self.batch.is_full()
+            if full:
+                self.flush('size')
 
-    # Тест 1: Одиночная вставка
-    #results['single'] = insert_single(data)
-    #client.execute("TRUNCATE TABLE logs_insert_test")
+    def flush(self, reason):
+        with self.lock:
+            if not len(self.batch):
+                return
+            batch, self.batch = self.batch, ColumnarBatch(self.flush_rows)
+            self.first_row_at = None
+            self.flushes[reason] += 1
+        self.send(batch)
 
-    # Тест 2: Пакетная вставка
-    #results['bulk'] = insert_bulk(data)
-    #client.execute("TRUNCATE TABLE logs_insert_test")
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval_sec / 4):
+            with self.lock:
+                due = self.first_row_at is not None and time.time() - self.first_row_at >= self.flush_interval_sec
+            if due:
+                self.flush('time')
+
+    def close(self):
+        self.stop_event.set()
+        self.timer.join()
+        self.flush('close')
+
+def insert_micro_batch(blocks, probe=None):
+    print("Starting client-side micro-batch insertion...")
+    start = time.time()
+    rows = 0
+    send_lock = threading.Lock()
 
-    # Тест 3: Вставка через буфер
-    #results['buffer'] = insert_buffer(data)
-    #client.execute("TRUNCATE TABLE logs_insert_test")
+    def send(batch):
+        # Отправка и из потока вставок, и из таймера: соединение одно
+        with send_lock:
+            execute_with_retry(client, batch.insert_query(TARGET_TABLE), batch.data(), columnar=True)
 
-    # Тест 4: Вставка в Native-формате (новый метод)
-    results['native'] = insert_native(data)
-    client.execute("TRUNCATE TABLE logs_insert_test")
+    batcher = MicroBatcher(send)
+    for chunk in small_chunks(blocks):
+        rows += len(chunk)
+        submit(probe, rows)
+        batcher.add(chunk)
+    batcher.close()
+
+    duration = time.time() - start - read_time(blocks)
+    print(f"Micro-batch insertion completed. Time: {duration:.2f} sec, flushes: {batcher.flushes}")
+    return duration, rows
+
+STRATEGIES = {
+    'single': insert_single,
+    'bulk': insert_bulk,
+    'native': insert_native,
+    'buffer': insert_buffer,
+    'async_wait': insert_async,
+    'async_nowait': insert_async_nowait,
+    'micro_batch': insert_micro_batch,
+}
+
+def run_strategy(name):
+    # Прием: время до подтверждения последней вставки; видимость: до появления
+    # всех строк в TARGET_TABLE и задержки видимости отдельных вставок
+    probe = VisibilityProbe().start()
+    duration, rows = STRATEGIES[name](read_csv_file(CSV_FILE), probe)
+    acked_at = time.time()
+    visible_at = probe.wait(rows)
+    latencies = probe.latencies()
+    start = probe.submitted[0][0] if probe.submitted else acked_at - duration
+    return {
+        'duration': duration,
+        'rows': rows,
+        'visible_sec': visible_at - start if visible_at else None,
+        'lag_sec': max(0.0, visible_at - acked_at) if visible_at else None,
+        'p50_sec': percentile(latencies, 50),
+        'p99_sec': percentile(latencies, 99),
+    }
+
+def save_results(results, filename='insertion_results.csv'):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Method', 'Time (sec)', 'Rows/sec', 'Visible after (sec)', 'Visibility lag (sec)',
+                         'Visibility p50 (sec)', 'Visibility p99 (sec)'])
+        for method, result in results.items():
+            writer.writerow([method, f"{result['duration']:.2f}", f"{result['rows'] / result['duration']:.0f}",
+                             format_sec(result['visible_sec']), format_sec(result['lag_sec']),
+                             format_sec(result['p50_sec']), format_sec(result['p99_sec'])])
+    print(f"\nResults saved to {filename}")
+
+def format_sec(value):
+    return '-' if value is None else f"{value:.2f}"
+
+def main():
+    # python insert_queries.py [стратегия ...] - по умолчанию все стратегии из STRATEGIES.
+    # Каждая стратегия заново читает файл потоково, блоками по DEFAULT_BLOCK_SIZE строк;
+    # время чтения и разбора в замер не входит.
+    # Запросы стратегии помечаются log_comment '<run_id>-<стратегия>' и собираются в benchmark_query_log.
+    # --fake: локальный ColumnarServer вместо ClickHouse, без сбора журнала запросов
+    fake = '--fake' in sys.argv
+    names = [name for name in sys.argv[1:] if name != '--fake'] or list(STRATEGIES)
+    results = {}
+    run_id = uuid.uuid4().hex[:8]
+    collector = None
+    if fake:
+        use_fake_server()
+        if 'buffer' in names:
+            print("buffer: Buffer tables are not emulated by the stand-in server, skipped")
+            names.remove('buffer')
+    else:
+        collector = QueryLogCollector('insert', run_id=run_id, log_comment_prefix=run_id,
+                                      variant=log_comment_variant, config=CH_CONFIG).start()
+
+    for name in names:
+        connect(settings={'log_comment': f"{run_id}-{name}"})
+        # Остаток буфера прошлых прогонов сбрасывается в целевую таблицу до ее очистки
+        client.execute(f"OPTIMIZE TABLE {BUFFER_TABLE}")
+        client.execute(f"TRUNCATE TABLE {TARGET_TABLE}")
+        try:
+            results[name] = run_strategy(name)
+        except Exception as e:
+            print(f"Error in {name}: {e}")
+    client.execute(f"TRUNCATE TABLE {TARGET_TABLE}")
 
+    if collector:
+        collector.stop()
 
     # Вывод результатов
     print("\nPerformance test results:")
-    for method, duration in results.items():
-        rows_per_sec = len(data) / duration
-        print(f"{method}: {duration:.2f} sec ({rows_per_sec:.0f} rows/sec)")
+    for method, result in results.items():
+        rows_per_sec = result['rows'] / result['duration']
+        print(f"{method}: {result['rows']} rows, {result['duration']:.2f} sec ({rows_per_sec:.0f} rows/sec), "
+              f"visible after {format_sec(result['visible_sec'])} sec, "
+              f"visibility p50/p99 {format_sec(result['p50_sec'])}/{format_sec(result['p99_sec'])} sec")
 
-    save_results(results, len(data))
+    save_results(results)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,155 +1,508 @@
 from clickhouse_driver import Client
 from clickhouse_driver import errors as ch_errors
+import asyncio
+import collections
+import itertools
 import time
 import random
-import csv
-from datetime import datetime
 import threading
 import queue
 import logging
 from socket import error as socket_error
-from time import sleep
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('log_simulator.log'),
-        logging.StreamHandler()
-    ]
-)
-
-
-def execute_with_retry(conn, query, params=None, max_retries=3, initial_retry_delay=5):
-    retry_delay = initial_retry_delay
-    for attempt in range(max_retries):
-        try:
-            return conn.execute(query, params) if params else conn.execute(query)
-        except Exception as e:
-            if ("CPU is overloaded" in str(e) or
-                "Timeout exceeded" in str(e)) and attempt < max_retries - 1:
-                logging.warning(
-                    f"Retryable error detected: {e}, retrying in {retry_delay} seconds (attempt {attempt + 1}/{max_retries})")
-                sleep(retry_delay)
-                retry_delay *= 2
-                continue
-            raise e
-    return None
-
-
-# Пул соединений для ClickHouse
-class ConnectionPool:
-    def __init__(self, config, size=5):
-        self.config = config
-        self.pool = queue.Queue(size)
-        for _ in range(size):
-            self.pool.put(self._create_connection())
-
-    def _create_connection(self):
-        return Client(**self.config)
-
-    def get_connection(self):
-        try:
-            return self.pool.get(timeout=5)
-        except queue.Empty:
-            logging.warning("Connection pool exhausted, creating new connection")
-            return self._create_connection()
+from async_transport import ExecutorTransport
+from connection_pool import ConnectionPool
+from columnar_batch import ColumnarBatch, LOG_COLUMNS
+from transport_settings import TransportSettings
+from load_controller import AimdController, percentile, report_operating_point, search_operating_point
+from load_profiles import LogReplayer, create_profile, load_sorted_logs
+from log_reader import LogBlockStream
+from partition_buffer import PartitionBuffer, fetch_partition_key
+from retry_policy import CONNECTION_ERRORS, CircuitBreaker, CircuitOpenError, RetryPolicy
+from sharded_sink import ShardedSink
+from spool import BatchSpool, deduplication_window
+from telemetry import Metrics, MetricsServer, start_queue_logging
 
-    def return_connection(self, conn):
-        try:
-            self.pool.put(conn, timeout=5)
-        except queue.Full:
-            conn.disconnect()
+# Настройка логирования
+# Запись в файл и консоль - в отдельном потоке, worker-ы только кладут записи в очередь
+start_queue_logging(logging.FileHandler('log_simulator.log'), logging.StreamHandler())
 
-    def close_all(self):
-        while not self.pool.empty():
-            conn = self.pool.get()
-            conn.disconnect()
+# Стадии, для которых ведутся гистограммы задержек
+STAGES = ('read', 'regroup', 'queue_wait', 'checkout', 'serialize', 'insert', 'retry_backoff', 'delivery')
 
 
 class LogSimulator:
-    def __init__(self, config):
+    def __init__(self, config, client_factory=Client, watermarks=None):
         self.config = config
-        self.connection_pool = ConnectionPool(config['ch_config'], size=config['workers_count'] + 2)
+        self.client_factory = client_factory
+        # Диапазоны timestamp вставленных пакетов публикуются для кеша результатов (result_cache.py)
+        self.watermarks = watermarks
+        # Гистограммы задержек по стадиям и gauge-метрики (telemetry.py)
+        self.metrics = Metrics(STAGES)
+        self.metrics_server = None
+        # Сжатие при передаче (transport_settings.py)
+        self.transport_settings = TransportSettings(**config['transport'])
+        # Номер пакета для выборочного замера сериализации
+        self.serialize_counter = itertools.count()
+        # Повторы с джиттером и предохранитель, общий для всех соединений пула
+        self.retry_policy = RetryPolicy(**config['retry'], breaker=CircuitBreaker(**config['circuit_breaker']),
+                                        sleep=self.retry_sleep)
+        # Вставка в один узел через пул или по шардам в их локальные таблицы (sharded_sink.py)
+        self.sink = self.create_sink()
+        self.connection_pool = None
+        if not self.sink:
+            self.connection_pool = ConnectionPool({**config['ch_config'], **self.transport_settings.client_settings()},
+                                                  max_size=self.pool_size(), client_factory=client_factory,
+                                                  wait_histogram=self.metrics.histograms['checkout'],
+                                                  **config['pool'])
         self.log_queue = queue.Queue(maxsize=config['max_queue_size'])
         self.running = False
         self.workers = []
+        # Отработавшие пакеты возвращаются сюда и переиспользуются генератором
+        self.free_batches = queue.SimpleQueue()
+        # Статистика вставок: задержки (сек) и число вставленных строк
+        self.stats_lock = threading.Lock()
+        self.insert_latencies = []
+        # Время от постановки пакета в очередь до окончания вставки
+        self.delivery_latencies = []
+        self.inserted_rows = 0
+        # Регулятор нагрузки для режима 'target_rate' и точки кривой скорости
+        self.controller = self.create_controller()
+        self.curve = []
+        self.last_adjust = (time.time(), 0, 0)
+        # Журнал пакетов на диске: пакет удаляется из него только после успешной вставки
+        self.spool = self.create_spool()
+        if self.spool:
+            self.check_deduplication()
+        # Неудачные пакеты из спула; генератор ставит их в очередь раньше новых
+        self.failed_batches = collections.deque()
+        # Перегруппировка строк по партициям целевой таблицы перед вставкой
+        self.partitioner = self.create_partitioner()
+        # Записи спула, строки которых еще не вставлены после перегруппировки:
+        # номер записи -> число пакетов партиций с ее строками
+        self.spool_refs = {}
+        self.spool_lock = threading.Lock()
+        self.register_gauges()
+
+    def create_sink(self):
+        settings = self.config['sharding']
+        if not settings['enabled']:
+            return None
+        return ShardedSink(
+            {**self.config['ch_config'], **self.transport_settings.client_settings()},
+            settings,
+            pool_settings={**self.config['pool'], 'max_size': self.pool_size(),
+                           'wait_histogram': self.metrics.histograms['checkout']},
+            retry_settings={**self.config['retry'], 'sleep': self.retry_sleep},
+            breaker_settings=self.config['circuit_breaker'],
+            client_factory=self.client_factory
+        )
+
+    def create_spool(self):
+        settings = self.config['spool']
+        if not settings['enabled']:
+            return None
+        return BatchSpool(
+            settings['directory'],
+            segment_bytes=settings['segment_mb'] * 1024 * 1024,
+            fsync_every=settings['fsync_every'],
+            fsync_interval_sec=settings['fsync_interval_sec']
+        )
+
+    def create_partitioner(self):
+        settings = self.config['partitioning']
+        if not settings['enabled']:
+            return None
+        expression = settings['expression'] or self.fetch_partition_key()
+        if not expression:
+            logging.warning(f"Table {self.config['target_table']} is not partitioned, partitioning disabled")
+            return None
+        logging.info(f"Regrouping batches by partition key: {expression}")
+        return PartitionBuffer(
+            expression,
+            LOG_COLUMNS,
+            flush_rows=settings['flush_rows'],
+            flush_age_sec=settings['flush_age_sec'],
+            max_buffered_rows=settings['max_buffered_rows']
+        )
+
+    def fetch_partition_key(self):
+        # Выражение PARTITION BY целевой таблицы из system.tables
+        return self.query_target(fetch_partition_key)
+
+    def check_deduplication(self):
+        # Без окна дедупликации повторно отправленный из спула пакет вставится дважды
+        window = self.query_target(deduplication_window)
+        if window == 0:
+            logging.warning(f"Table {self.config['target_table']} has non_replicated_deduplication_window = 0, "
+                            f"batches resent from spool may be inserted twice")
+
+    def query_target(self, function):
+        # function(conn, table) на соединении с целевой таблицей (первым шардом)
+        if self.sink:
+            shard = self.sink.shards[0]
+            pool, table = shard.pool, shard.table
+        else:
+            pool, table = self.connection_pool, self.config['target_table']
+        conn = pool.get_connection()
+        try:
+            return function(conn, table)
+        finally:
+            pool.return_connection(conn)
+
+    def register_gauges(self):
+        pools = [shard.pool for shard in self.sink.shards] if self.sink else [self.connection_pool]
+        self.metrics.gauge('queue_depth', self.log_queue.qsize, 'Batches waiting for a worker')
+        self.metrics.gauge('pool_connections', lambda: sum(pool.size for pool in pools), 'Open connections')
+        self.metrics.gauge('pool_in_use', lambda: sum(len(pool.in_use) for pool in pools), 'Checked out connections')
+        self.metrics.gauge('failed_batches', lambda: len(self.failed_batches), 'Batches waiting for resend')
+        self.metrics.gauge('inserted_rows', lambda: self.inserted_rows, 'Rows inserted since start')
+        if self.partitioner:
+            self.metrics.gauge('partition_buffered_rows', lambda: self.partitioner.buffered_rows,
+                               'Rows buffered by partition')
+
+    def retry_sleep(self, delay):
+        # Пауза между повторами тоже стадия: видно, сколько времени уходит на ожидание
+        self.metrics.observe('retry_backoff', delay)
+        time.sleep(delay)
+
+    def pool_size(self):
+        return self.config['workers_count'] + 2
+
+    def create_controller(self):
+        if self.config['load_mode'] != 'target_rate':
+            return None
+        settings = self.config['controller']
+        return AimdController(
+            target_rate=settings['target_rows_per_sec'],
+            min_batch_size=self.config['min_batch_size'],
+            max_batch_size=self.config['max_batch_size'],
+            latency_target=settings['latency_target_sec'],
+            queue_high_watermark=settings['queue_high_watermark']
+        )
 
     def read_logs(self):
-        try:
-            with open(self.config['log_file'], 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    yield {
-                        'timestamp': datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S'),
-                        'login': row['login'],
-                        'event': row['event'],
-                        'subsystem': row['subsystem'],
-                        'comment': row['comment'],
-                        'description': row['description']
-                    }
-        except Exception as e:
-            logging.error(f"Error reading log file: {e}")
-            raise
+        # Пустой файл логов - ошибка запуска, а не каждого шага генерации
+        if self.config['load_mode'] == 'replay':
+            # Воспроизведение по временным меткам файла с ускорением и профилем всплесков
+            settings = self.config['replay']
+            logs = load_sorted_logs(self.config['log_file'])
+            if not len(logs):
+                raise ValueError(f"No logs in {self.config['log_file']}")
+            return LogReplayer(logs, settings['speedup'], create_profile(settings['profile']))
+        # Поток блоков CSV, из которого заполняются пакеты произвольного размера
+        stream = LogBlockStream(self.config['log_file'], self.config['read_block_size'])
+        if stream.is_empty():
+            raise ValueError(f"No logs in {self.config['log_file']}")
+        return stream
 
     # Поток-обработчик для вставки логов
     def worker(self):
         while self.running or not self.log_queue.empty():
-            conn = None
+            # Соединение берется из пула только когда пакет уже получен
             try:
-                conn = self.connection_pool.get_connection()
                 batch = self.log_queue.get(timeout=1)
-                if batch:
-                    self.insert_batch(conn, batch)
-                    self.log_queue.task_done()
             except queue.Empty:
                 continue
-            except (socket_error, ch_errors.Error) as e:
-                logging.warning(f"Connection error: {e}")
-                if conn:
-                    conn.disconnect()
-                time.sleep(1)
-            except Exception as e:
-                logging.error(f"Worker error: {e}")
-                time.sleep(1)
+            try:
+                self.send_batch(batch)
+            except Exception:
+                time.sleep(self.cooldown(batch))
+                self.retry_later(batch)
             finally:
-                if conn:
-                    self.connection_pool.return_connection(conn)
-
-    def insert_batch(self, conn, batch):
+                self.log_queue.task_done()
+
+    def cooldown(self, batch):
+        # При шардировании предохранители у каждого шарда свои
+        if self.sink:
+            return self.sink.cooldown(batch)
+        return self.retry_policy.cooldown()
+
+    def retry_later(self, batch):
+        # Без спула неудачный пакет теряется (в том числе сброшенный открытым
+        # предохранителем), со спулом - отправляется повторно
+        if batch.spool_seq is not None or batch.spool_sources:
+            self.failed_batches.append(batch)
+
+    def acknowledge(self, batch):
+        # Запись спула удаляется, когда вставлены все пакеты с ее строками
+        if batch.spool_seq is not None:
+            self.spool.ack(batch.spool_seq)
+        for seq in batch.spool_sources or ():
+            with self.spool_lock:
+                self.spool_refs[seq] -= 1
+                delivered = not self.spool_refs[seq]
+                if delivered:
+                    del self.spool_refs[seq]
+            if delivered:
+                self.spool.ack(seq)
+
+    def pending_batches(self, source):
+        retries = []
+        while self.failed_batches:
+            retries.append(self.failed_batches.popleft())
+        return retries + self.next_batches(source)
+
+    def send_batch(self, batch):
+        conn = None
+        broken = False
+        if batch.enqueued_at is not None:
+            self.metrics.observe('queue_wait', time.time() - batch.enqueued_at)
+        self.measure_serialize(batch)
+        try:
+            if self.sink:
+                self.sink.send(batch, self.insert_batch)
+            else:
+                conn = self.connection_pool.get_connection()
+                self.insert_batch(conn, batch)
+            self.acknowledge(batch)
+            self.free_batches.put(batch)
+        except CircuitOpenError:
+            raise
+        except (socket_error, ch_errors.Error) as e:
+            logging.warning(f"Connection error: {e}")
+            # Соединение после сетевой ошибки в пул не возвращается
+            broken = isinstance(e, CONNECTION_ERRORS)
+            raise
+        except Exception as e:
+            logging.error(f"Worker error: {e}")
+            raise
+        finally:
+            if conn:
+                self.connection_pool.return_connection(conn, broken=broken)
+
+    def measure_serialize(self, batch):
+        # Драйвер сериализует блок внутри execute, поэтому время 'insert' включает его.
+        # Отдельно - каждый serialize_sample_every-й пакет сериализуется драйвером без
+        # отправки (batch.data() и кодирование Native-блока, со сжатием), процессорное время потока
+        every = self.config['metrics']['serialize_sample_every']
+        if every and next(self.serialize_counter) % every == 0:
+            self.metrics.observe('serialize', self.transport_settings.measure(batch)[1])
+
+    def insert_batch(self, conn, batch, table=None, retry_policy=None):
         try:
             start_time = time.time()
 
-            # Подготовка данных в column-oriented формате
-            columns = [
-                ('timestamp', [log['timestamp'] for log in batch]),
-                ('login', [log['login'] for log in batch]),
-                ('event', [log['event'] for log in batch]),
-                ('subsystem', [log['subsystem'] for log in batch]),
-                ('comment', [log['comment'] for log in batch]),
-                ('description', [log['description'] for log in batch])
-            ]
-
-            # Формируем данные для вставки
-            data = [tuple(col[1][i] for col in columns) for i in range(len(batch))]
-
-            # Выполняем запрос с повторами при ошибках
-            execute_with_retry(
+            # Пакет уже хранится по колонкам - отправляем его без сборки кортежей.
+            # Повторная отправка пакета из спула дедуплицируется сервером по токену
+            settings = None
+            if batch.spool_seq is not None:
+                settings = {'insert_deduplication_token': self.spool.insert_token(batch.spool_seq)}
+            (retry_policy or self.retry_policy).execute(
                 conn,
-                f"INSERT INTO {self.config['target_table']} VALUES",
-                data
+                batch.insert_query(table or self.config['target_table']),
+                batch.data(),
+                columnar=True,
+                settings=settings
             )
 
-            elapsed = time.time() - start_time
+            end_time = time.time()
+            elapsed = end_time - start_time
+            self.metrics.observe('insert', elapsed)
+            if batch.enqueued_at is not None:
+                self.metrics.observe('delivery', end_time - batch.enqueued_at)
+            with self.stats_lock:
+                self.insert_latencies.append(elapsed)
+                if batch.enqueued_at is not None:
+                    self.delivery_latencies.append(end_time - batch.enqueued_at)
+                self.inserted_rows += len(batch)
+            if self.watermarks:
+                self.watermarks.publish_batch(self.config['target_table'], batch)
             logging.info(f"Inserted {len(batch)} logs in {elapsed:.2f}s ({len(batch) / elapsed:.1f} logs/sec)")
 
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logging.error(f"Insert failed after retries: {e}")
             raise
 
+    def take_batch(self, batch_size):
+        try:
+            batch = self.free_batches.get_nowait()
+            batch.reset(batch_size)
+        except queue.Empty:
+            batch = ColumnarBatch(batch_size)
+        return batch
+
+    def next_batch(self, log_stream):
+        if self.controller:
+            batch_size = self.controller.batch_size
+        else:
+            batch_size = random.randint(
+                self.config['min_batch_size'],
+                self.config['max_batch_size']
+            )
+
+        batch = self.take_batch(batch_size)
+        if not log_stream.fill(batch):
+            raise ValueError(f"No logs in {self.config['log_file']}")
+        return batch
+
+    def next_batches(self, source):
+        start = time.perf_counter()
+        if self.config['load_mode'] == 'replay':
+            # Все наступившие за тик события, порезанные на пакеты до max_batch_size
+            position, end = source.due_range(time.time() - self.start_time)
+            batches = []
+            while position < end:
+                batch = self.take_batch(min(end - position, self.config['max_batch_size']))
+                position += batch.extend(source.logs, position, end)
+                batches.append(batch)
+        else:
+            batches = [self.next_batch(source)]
+        self.metrics.observe('read', time.perf_counter() - start)
+        if self.spool:
+            # Пакеты пишутся в спул при приеме, до буфера партиций
+            for batch in batches:
+                batch.spool_seq = self.spool.append(batch)
+
+        if self.partitioner:
+            start = time.perf_counter()
+            batches = self.regroup(batches)
+            self.metrics.observe('regroup', time.perf_counter() - start)
+        return self.prepare(batches)
+
+    def regroup(self, batches):
+        # Строки копируются в буферы партиций, исходные пакеты сразу переиспользуются.
+        # Запись спула исходного пакета живет, пока не вставлены все пакеты партиций с его
+        # строками; у них нет токена дедупликации, повтор после сбоя может дать дубли
+        for batch in batches:
+            partitions = self.partitioner.add(batch)
+            if batch.spool_seq is not None and partitions:
+                with self.spool_lock:
+                    self.spool_refs[batch.spool_seq] = partitions
+            elif batch.spool_seq is not None:
+                self.spool.ack(batch.spool_seq)
+            self.free_batches.put(batch)
+        return self.partitioner.due()
+
+    def prepare(self, batches):
+        enqueued_at = time.time()
+        for batch in batches:
+            # У пакетов из буфера партиций - время первой строки в буфере
+            if batch.enqueued_at is None:
+                batch.enqueued_at = enqueued_at
+        return batches
+
+    def final_batches(self):
+        # Остаток буфера партиций после остановки генератора
+        if not self.partitioner:
+            return []
+        return self.prepare(self.partitioner.drain())
+
+    def spooled_batches(self):
+        # Пакеты, не вставленные в прошлых запусках, отправляются первыми
+        if not self.spool:
+            return
+        count = 0
+        for seq, batch in self.spool.pending():
+            batch.spool_seq = seq
+            batch.enqueued_at = time.time()
+            count += 1
+            yield batch
+        if count:
+            logging.info(f"Replayed {count} batches from spool")
+
+    def next_delay(self):
+        if self.config['load_mode'] == 'replay':
+            return self.config['replay']['tick_sec']
+        if self.controller:
+            return self.controller.flush_interval
+        return random.uniform(
+            self.config['min_delay_sec'],
+            self.config['max_delay_sec']
+        )
+
+    # Раз в adjust_interval_sec: точка кривой скорости и корректировка регулятора
+    def adjust_controller(self, queue_depth):
+        now = time.time()
+        last_time, last_rows, last_count = self.last_adjust
+        if not self.controller or now - last_time < self.config['controller']['adjust_interval_sec']:
+            return
+
+        with self.stats_lock:
+            latencies = self.insert_latencies[last_count:]
+            rows = self.inserted_rows
+            count = len(self.insert_latencies)
+        self.last_adjust = (now, rows, count)
+
+        p99 = percentile(latencies, 99)
+        self.curve.append({
+            'elapsed_sec': round(now - self.start_time, 1),
+            'rows_per_sec': round((rows - last_rows) / (now - last_time)),
+            'batch_size': self.controller.batch_size,
+            'flush_interval_sec': round(self.controller.flush_interval, 3),
+            'p99_latency_sec': p99,
+            'queue_depth': queue_depth,
+        })
+        self.controller.update(p99, queue_depth)
+
+    def report(self):
+        logging.info(f"Stage latencies:\n{self.metrics.summary()}")
+        logging.info(f"Retry policy: {self.retry_policy.snapshot()}")
+        if self.sink:
+            logging.info(self.sink.report())
+        else:
+            logging.info(f"Connection pool: {self.connection_pool.metrics()}")
+        if self.partitioner:
+            logging.info(f"Partition regrouping: {self.partitioner.flushed_batches} batches "
+                         f"by {self.partitioner.expression}")
+        if not self.curve:
+            return
+        # Рабочая точка - медиана второй половины прогона, когда регулятор устоялся
+        tail = self.curve[len(self.curve) // 2:]
+        best = {key: sorted(point[key] for point in tail)[len(tail) // 2] for key in tail[0]}
+        best.pop('elapsed_sec')
+        report_operating_point("Target rate throughput curve", best, self.curve,
+                               self.config['controller']['report_file'])
+
+    # Поиск рабочей точки: серия коротких прогонов с фиксированным размером пакета
+    def run_trial(self, batch_size, concurrency):
+        trial_config = {
+            **self.config,
+            'load_mode': 'random',
+            'duration_minutes': self.config['controller']['search_trial_sec'] / 60,
+            'min_batch_size': batch_size,
+            'max_batch_size': batch_size,
+            'min_delay_sec': 0.0,
+            'max_delay_sec': 0.0,
+            'workers_count': concurrency,
+            'max_in_flight': concurrency,
+            'max_queue_size': concurrency * 2,
+        }
+        trial = type(self)(trial_config, client_factory=self.client_factory)
+        start = time.time()
+        trial.simulate_load()
+        duration = time.time() - start
+        return trial.inserted_rows / duration, percentile(trial.insert_latencies, 99)
+
+    def search(self):
+        settings = self.config['controller']
+        best, curve = search_operating_point(
+            self.run_trial,
+            settings['search_batch_sizes'],
+            settings['search_concurrency'],
+            settings['latency_target_sec']
+        )
+        report_operating_point("Capacity search throughput curve", best, curve, settings['report_file'])
+        return best
+
+    def start_metrics_server(self):
+        settings = self.config['metrics']
+        if not settings['enabled']:
+            return
+        try:
+            self.metrics_server = MetricsServer(self.metrics, settings['host'], settings['port']).start()
+            logging.info(f"Metrics endpoint: {self.metrics_server.address}")
+        except OSError as e:
+            logging.warning(f"Metrics endpoint is not started: {e}")
+
     def simulate_load(self):
+        source = self.read_logs()
         self.running = True
+        self.start_time = time.time()
+        self.last_adjust = (self.start_time, 0, 0)
+        self.start_metrics_server()
 
         # Запуск worker-ов
         for i in range(self.config['workers_count']):
@@ -161,32 +514,24 @@ class LogSimulator:
             worker_thread.start()
             self.workers.append(worker_thread)
 
+        for batch in self.spooled_batches():
+            self.log_queue.put(batch)
+
         # Генерация нагрузки
-        log_generator = self.read_logs()
         end_time = time.time() + self.config['duration_minutes'] * 60
 
         while time.time() < end_time and self.running:
             try:
-                batch_size = random.randint(
-                    self.config['min_batch_size'],
-                    self.config['max_batch_size']
-                )
-
-                batch = []
-                for _ in range(batch_size):
+                batches = self.pending_batches(source)
+                for position, batch in enumerate(batches):
                     try:
-                        batch.append(next(log_generator))
-                    except StopIteration:
-                        log_generator = self.read_logs()
-                        batch.append(next(log_generator))
-
-                self.log_queue.put(batch, timeout=5)
-
-                delay = random.uniform(
-                    self.config['min_delay_sec'],
-                    self.config['max_delay_sec']
-                )
-                time.sleep(delay)
+                        self.log_queue.put(batch, timeout=5)
+                    except queue.Full:
+                        # Неотправленный остаток ставится в очередь первым на следующем шаге
+                        self.failed_batches.extendleft(reversed(batches[position:]))
+                        raise
+                self.adjust_controller(self.log_queue.qsize())
+                time.sleep(self.next_delay())
 
             except queue.Full:
                 logging.warning("Queue is full, waiting...")
@@ -195,14 +540,99 @@ class LogSimulator:
                 logging.error(f"Simulation error: {e}")
                 time.sleep(1)
 
+        for batch in self.final_batches():
+            self.log_queue.put(batch)
+
         self.shutdown()
+        self.report()
         logging.info("Simulation completed")
 
     def shutdown(self):
         self.running = False
         for worker in self.workers:
             worker.join(timeout=5)
-        self.connection_pool.close_all()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.sink:
+            self.sink.close()
+        else:
+            self.connection_pool.close_all()
+        if self.spool:
+            # Не отправленные пакеты остаются на диске до следующего запуска
+            self.spool.close()
+            left = self.log_queue.qsize() + len(self.failed_batches)
+            if left:
+                logging.warning(f"{left} batches left in spool {self.spool.directory}")
+
+
+# Асинхронный режим: один event loop, ограниченное число вставок "в полете"
+# и обратное давление на генератор через ограниченную asyncio.Queue
+class AsyncLogSimulator(LogSimulator):
+    def __init__(self, config, client_factory=Client, transport=None, watermarks=None):
+        super().__init__(config, client_factory=client_factory, watermarks=watermarks)
+        self.transport = transport or ExecutorTransport(self.send_batch, config['max_in_flight'])
+
+    def pool_size(self):
+        return self.config['max_in_flight'] + 2
+
+    async def sender(self, batches):
+        while True:
+            batch = await batches.get()
+            try:
+                await self.transport.insert(batch)
+            except Exception:
+                await asyncio.sleep(self.cooldown(batch))
+                self.retry_later(batch)
+            finally:
+                batches.task_done()
+
+    async def run(self):
+        source = self.read_logs()
+        self.running = True
+        self.start_time = time.time()
+        self.last_adjust = (self.start_time, 0, 0)
+        self.start_metrics_server()
+        batches = asyncio.Queue(maxsize=self.config['max_in_flight'])
+        self.metrics.gauge('queue_depth', batches.qsize, 'Batches waiting for an insert slot')
+        senders = [asyncio.create_task(self.sender(batches))
+                   for _ in range(self.config['max_in_flight'])]
+
+        for batch in self.spooled_batches():
+            await batches.put(batch)
+
+        end_time = time.time() + self.config['duration_minutes'] * 60
+
+        while time.time() < end_time and self.running:
+            try:
+                # put блокирует генератор, пока все слоты вставки заняты
+                for batch in self.pending_batches(source):
+                    await batches.put(batch)
+                self.adjust_controller(batches.qsize())
+                await asyncio.sleep(self.next_delay())
+            except Exception as e:
+                logging.error(f"Simulation error: {e}")
+                await asyncio.sleep(1)
+
+        for batch in self.final_batches():
+            await batches.put(batch)
+
+        await batches.join()
+        for task in senders:
+            task.cancel()
+        await asyncio.gather(*senders, return_exceptions=True)
+        await self.transport.close()
+
+    def simulate_load(self):
+        asyncio.run(self.run())
+        self.shutdown()
+        self.report()
+        logging.info("Simulation completed")
+
+
+def create_simulator(config, client_factory=Client, watermarks=None):
+    if config['mode'] == 'async':
+        return AsyncLogSimulator(config, client_factory=client_factory, watermarks=watermarks)
+    return LogSimulator(config, client_factory=client_factory, watermarks=watermarks)
 
 
 CONFIG = {
@@ -211,12 +641,15 @@ CONFIG = {
         'user': 'default',
         'password': '',
         'database': 'course_db',
+        # Реплики/шарды: соединения пула распределяются по ним по кругу
+        # 'hosts': ['ch1:9000', 'ch2:9000'],
         'settings': {
             'max_execution_time': 30,
             'use_native_format': True  # Включаем Native формат
         }
     },
     'log_file': 'data/logs_data_3_000.csv',
+    'read_block_size': 10000,
     'target_table': 'logs_insert_test',
     'duration_minutes': 2,
     'min_batch_size': 100,
@@ -224,15 +657,107 @@ CONFIG = {
     'min_delay_sec': 0.1,
     'max_delay_sec': 5.0,
     'workers_count': 3,
-    'max_queue_size': 10000
+    'max_queue_size': 10000,
+    'mode': 'thread',  # 'thread' - потоки worker-ов, 'async' - asyncio
+    'max_in_flight': 16,  # Макс. число одновременных вставок в режиме async
+    # 'random' - случайные пакеты и паузы, 'target_rate' - AIMD-регулятор скорости,
+    # 'search' - поиск макс. скорости при ограничении на p99 задержки,
+    # 'replay' - воспроизведение по временным меткам файла (настройки в 'replay')
+    'load_mode': 'random',
+    'controller': {
+        'target_rows_per_sec': 5000,
+        'latency_target_sec': 0.5,        # Цель по p99 задержки вставки
+        'queue_high_watermark': 2,        # Пакетов в очереди до снижения скорости
+        'adjust_interval_sec': 1.0,
+        'search_batch_sizes': [100, 250, 500, 1000, 2500, 5000, 10000],
+        'search_concurrency': [1, 2, 4, 8, 16],
+        'search_trial_sec': 10,
+        'report_file': 'controller_report.csv'
+    },
+    'replay': {
+        'speedup': 10_000_000,  # Во сколько раз время воспроизведения быстрее времени логов
+        'tick_sec': 0.1,       # Один sleep на тик, за тик отправляются все наступившие события
+        # Профиль всплесков: constant, diurnal, spike, step (параметры - в load_profiles.py)
+        'profile': {'type': 'diurnal', 'period_sec': 60, 'min_factor': 0.2, 'max_factor': 3.0}
+    },
+    # Пул соединений (connection_pool.py); максимальный размер - workers_count + 2
+    # (в режиме async - max_in_flight + 2)
+    'pool': {
+        'min_size': 2,
+        'idle_timeout_sec': 60.0,
+        'health_check_interval_sec': 30.0,  # Простаивавшее дольше соединение проверяется SELECT 1
+        'checkout_timeout_sec': 5.0
+    },
+    # Вставка напрямую в локальные таблицы шардов (sharded_sink.py): строки раскладываются
+    # по хешу login или по интервалу времени ('timestamp_bucket'); параметры шарда
+    # дополняют ch_config, у шарда может быть свой список реплик 'hosts' и своя 'table'
+    'sharding': {
+        'enabled': False,
+        'key': 'login',
+        'timestamp_bucket_sec': 3600,
+        'local_table': 'logs_local',
+        'shards': [
+            {'host': 'ch-shard1'},
+            {'host': 'ch-shard2'},
+        ]
+    },
+    # Повторы запросов (retry_policy.py): пауза - случайная от 0 до base_delay_sec * 2^попытка
+    'retry': {
+        'max_retries': 3,
+        'base_delay_sec': 0.5,
+        'max_delay_sec': 10.0
+    },
+    # После failure_threshold ошибок перегрузки/сети подряд вставки не отправляются
+    # reset_timeout_sec: без спула пакеты сбрасываются, со спулом - ждут на диске
+    'circuit_breaker': {
+        'failure_threshold': 5,
+        'reset_timeout_sec': 10.0
+    },
+    # Сжатие при передаче: None, 'lz4', 'zstd' (нужны пакеты lz4/zstd и clickhouse-cityhash).
+    # Словарное кодирование - колонки LowCardinality в схеме целевой таблицы (logs_insert_dict)
+    'transport': {
+        'compression': None
+    },
+    # Журнал пакетов на диске (spool.py): пакеты не теряются при ошибках вставки
+    # и остановке, повторная отправка после перезапуска дедуплицируется по токену
+    'spool': {
+        'enabled': False,
+        'directory': 'spool',
+        'segment_mb': 64,
+        'fsync_every': 10,          # fsync после стольких пакетов
+        'fsync_interval_sec': 0.5   # ...или после такой паузы с прошлого fsync
+    },
+    # Гистограммы задержек по стадиям и gauge-метрики в формате Prometheus на
+    # http://host:port/metrics во время прогона (telemetry.py); сводка - в конце прогона.
+    # Endpoint включается явно: порт фиксированный, а симулятор запускают многие бенчмарки
+    'metrics': {
+        'enabled': False,
+        'host': '127.0.0.1',
+        'port': 9464,
+        # Замер сериализации без отправки на каждом N-м пакете; 0 - не замерять
+        'serialize_sample_every': 10
+    },
+    # Перегруппировка строк по партициям (partition_buffer.py): партиция отправляется,
+    # набрав flush_rows строк или через flush_age_sec после первой строки.
+    # expression - выражение PARTITION BY; None - взять у target_table из system.tables
+    'partitioning': {
+        'enabled': False,
+        'expression': None,
+        'flush_rows': 10000,
+        'flush_age_sec': 5.0,
+        'max_buffered_rows': 200000
+    }
 }
 
 if __name__ == "__main__":
-    simulator = LogSimulator(CONFIG)
+    simulator = create_simulator(CONFIG)
 
     try:
         logging.info("Starting log simulation...")
-        simulator.simulate_load()
+        if CONFIG['load_mode'] == 'search':
+            simulator.search()
+        else:
+            simulator.simulate_load()
     except KeyboardInterrupt:
         logging.info("Simulation interrupted by user")
     except Exception as e:
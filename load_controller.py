@@ -0,0 +1,92 @@
+import csv
+import logging
+
+from tabulate import tabulate
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+# AIMD-регулятор нагрузки: поддерживает заданную скорость (строк/сек),
+# подстраивая размер пакета по задержке вставки, а скорость - по глубине очереди
+class AimdController:
+    def __init__(self, target_rate, min_batch_size, max_batch_size, latency_target,
+                 queue_high_watermark, rate_step=0.1, batch_step=0.1, decrease_factor=0.5):
+        self.target_rate = target_rate
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.latency_target = latency_target
+        self.queue_high_watermark = queue_high_watermark
+        # Аддитивные шаги - доля от целевой скорости и от диапазона размеров пакета
+        self.rate_increase = max(1.0, target_rate * rate_step)
+        self.batch_increase = max(1, int((max_batch_size - min_batch_size) * batch_step))
+        self.decrease_factor = decrease_factor
+
+        self.rate = self.rate_increase
+        self.batch_size = min_batch_size
+
+    @property
+    def flush_interval(self):
+        return self.batch_size / self.rate
+
+    def update(self, p99_latency, queue_depth):
+        # Размер пакета: растет, пока задержка вставки с запасом ниже цели
+        if p99_latency > self.latency_target:
+            self.batch_size = max(self.min_batch_size, int(self.batch_size * self.decrease_factor))
+        elif p99_latency < self.latency_target / 2:
+            self.batch_size = min(self.max_batch_size, self.batch_size + self.batch_increase)
+
+        # Скорость: очередь растет - сервер не успевает, резко снижаем
+        if queue_depth > self.queue_high_watermark or p99_latency > self.latency_target:
+            self.rate = max(self.rate_increase, self.rate * self.decrease_factor)
+        else:
+            self.rate = min(self.target_rate, self.rate + self.rate_increase)
+
+
+# Поиск наибольшей скорости при p99 задержки вставки не выше latency_target.
+# run_trial(batch_size, concurrency) -> (строк/сек, p99 задержки в сек)
+def search_operating_point(run_trial, batch_sizes, concurrency_levels, latency_target):
+    curve = []
+    best = None
+
+    for concurrency in concurrency_levels:
+        for batch_size in batch_sizes:
+            rate, p99 = run_trial(batch_size, concurrency)
+            point = {
+                'concurrency': concurrency,
+                'batch_size': batch_size,
+                'rows_per_sec': rate,
+                'p99_latency_sec': p99,
+                'within_target': p99 <= latency_target,
+            }
+            curve.append(point)
+            logging.info(f"Trial concurrency={concurrency} batch={batch_size}: "
+                         f"{rate:.0f} rows/sec, p99 {p99 * 1000:.1f} ms")
+
+            # Пакеты большего размера дадут еще большую задержку
+            if not point['within_target']:
+                break
+            if best is None or rate > best['rows_per_sec']:
+                best = point
+
+    return best, curve
+
+
+def report_operating_point(title, best, curve, filename):
+    headers = list(curve[0].keys()) if curve else []
+    rows = [list(point.values()) for point in curve]
+    logging.info(f"{title}\n" + tabulate(rows, headers=headers, tablefmt='grid', floatfmt=".3f"))
+    if best:
+        logging.info("Operating point: " + ", ".join(f"{key}={value}" for key, value in best.items()))
+    else:
+        logging.warning("No operating point satisfies the target")
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+    logging.info(f"Throughput curve saved to {filename}")
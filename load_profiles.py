@@ -0,0 +1,89 @@
+import math
+from bisect import bisect_right
+from itertools import chain
+
+from columnar_batch import ColumnarBatch, LOG_COLUMNS
+from log_reader import read_log_blocks
+
+
+# Профили всплесков: множитель скорости воспроизведения от времени прогона (сек)
+def constant_profile():
+    return lambda elapsed: 1.0
+
+
+def diurnal_profile(period_sec=600, min_factor=0.2, max_factor=3.0):
+    # Суточная кривая, сжатая до period_sec: минимум в начале периода, пик в середине
+    def profile(elapsed):
+        phase = (1 - math.cos(2 * math.pi * elapsed / period_sec)) / 2
+        return min_factor + (max_factor - min_factor) * phase
+    return profile
+
+
+def spike_profile(every_sec=120, duration_sec=10, factor=20.0, base_factor=1.0):
+    def profile(elapsed):
+        return factor if elapsed % every_sec < duration_sec else base_factor
+    return profile
+
+
+def step_profile(steps):
+    # steps - список [начало_сек, множитель], отсортированный по времени
+    starts = [start for start, _ in steps]
+
+    def profile(elapsed):
+        index = bisect_right(starts, elapsed) - 1
+        return steps[index][1] if index >= 0 else 1.0
+    return profile
+
+
+PROFILES = {
+    'constant': constant_profile,
+    'diurnal': diurnal_profile,
+    'spike': spike_profile,
+    'step': step_profile,
+}
+
+
+def create_profile(settings):
+    params = {key: value for key, value in settings.items() if key != 'type'}
+    return PROFILES[settings['type']](**params)
+
+
+def load_sorted_logs(file_path):
+    # Воспроизведение идет по оси времени файла, поэтому строки сортируются по timestamp
+    blocks = list(read_log_blocks(file_path))
+    logs = ColumnarBatch.from_columns(
+        [list(chain.from_iterable(block.columns[i] for block in blocks)) for i in range(len(LOG_COLUMNS))]
+    )
+    order = sorted(range(len(logs)), key=logs.columns[0].__getitem__)
+    logs.columns = [[column[i] for i in order] for column in logs.columns]
+    return logs
+
+
+# Воспроизведение логов по их собственным временным меткам с ускорением speedup.
+# За один тик выдается срез всех событий, время которых уже наступило
+class LogReplayer:
+    def __init__(self, logs, speedup, profile):
+        self.logs = logs
+        self.speedup = speedup
+        self.profile = profile
+        self.times = [ts.timestamp() for ts in logs.columns[0]]
+        self.virtual_time = self.times[0] if self.times else 0.0
+        self.position = 0
+        self.last_elapsed = 0.0
+
+    def due_range(self, elapsed):
+        # Виртуальное время продвигается с учетом множителя профиля
+        step = elapsed - self.last_elapsed
+        self.last_elapsed = elapsed
+        self.virtual_time += step * self.speedup * self.profile(elapsed)
+
+        if not self.times:
+            return 0, 0
+        if self.position >= len(self.times):
+            # Файл закончился - начинаем заново с начала оси времени
+            self.position = 0
+            self.virtual_time = self.times[0]
+
+        end = bisect_right(self.times, self.virtual_time, lo=self.position)
+        start, self.position = self.position, end
+        return start, end
@@ -0,0 +1,79 @@
+import csv
+from datetime import datetime
+from itertools import islice
+
+from columnar_batch import ColumnarBatch, LOG_COLUMNS
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_BLOCK_SIZE = 10000
+
+
+def parse_timestamps(values):
+    # datetime.fromisoformat реализован на C и разбирает '%Y-%m-%d %H:%M:%S'
+    # на порядок быстрее strptime; при нестандартном формате откатываемся на strptime
+    try:
+        return list(map(datetime.fromisoformat, values))
+    except ValueError:
+        return [datetime.strptime(value, TIMESTAMP_FORMAT) for value in values]
+
+
+# Потоковое чтение CSV блоками по block_size строк в column-oriented формате
+def read_log_blocks(file_path, block_size=DEFAULT_BLOCK_SIZE):
+    with open(file_path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        order = [header.index(name) for name in LOG_COLUMNS]
+        ts_index = LOG_COLUMNS.index('timestamp')
+
+        while True:
+            rows = list(islice(reader, block_size))
+            if not rows:
+                break
+            # Транспонирование выполняется на C, без цикла по строкам в Python
+            raw_columns = list(zip(*rows))
+            columns = [raw_columns[i] for i in order]
+            columns[ts_index] = parse_timestamps(columns[ts_index])
+            yield ColumnarBatch.from_columns(columns)
+
+
+# Бесконечный поток логов, заполняющий пакеты произвольного размера из блоков файла
+class LogBlockStream:
+    def __init__(self, file_path, block_size=DEFAULT_BLOCK_SIZE, loop=True):
+        self.file_path = file_path
+        self.block_size = block_size
+        self.loop = loop
+        self.blocks = read_log_blocks(file_path, block_size)
+        self.block = None
+        self.position = 0
+
+    def next_block(self):
+        try:
+            return next(self.blocks)
+        except StopIteration:
+            if not self.loop:
+                return None
+            self.blocks = read_log_blocks(self.file_path, self.block_size)
+            return next(self.blocks, None)
+
+    def fill(self, batch):
+        # Возвращает число добавленных строк; 0 - файл закончился (при loop=False) или пуст
+        added = 0
+        while not batch.is_full():
+            if self.block is None or self.position >= len(self.block):
+                self.block = self.next_block()
+                self.position = 0
+                if self.block is None:
+                    break
+            count = batch.extend(self.block, self.position)
+            self.position += count
+            added += count
+        return added
+
+    def is_empty(self):
+        # Первый блок читается заранее и затем используется fill
+        if self.block is None:
+            self.block = self.next_block()
+            self.position = 0
+        return self.block is None
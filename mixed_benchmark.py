@@ -0,0 +1,133 @@
+import csv
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from insert_simulator import CONFIG, create_simulator
+from load_controller import percentile
+from select_queries import CH_CONFIG, LOAD_TEST, load_client, load_workload
+
+# Варианты таблиц, на которых одновременно идут вставка и чтение
+TABLES = ['logs_ordered', 'logs_with_indexes', 'logs_with_projections', 'logs_partitioned']
+
+SCENARIO = {
+    'duration_sec': 120,
+    'sample_interval_sec': 5,
+    'query_clients': 4,
+    'report_dir': 'results',
+}
+
+
+def sample_server(conn, table):
+    parts = conn.execute("""
+        SELECT count(), sum(rows)
+        FROM system.parts
+        WHERE database = currentDatabase() AND table = %(table)s AND active
+    """, {'table': table})
+    merges = conn.execute("""
+        SELECT count()
+        FROM system.merges
+        WHERE database = currentDatabase() AND table = %(table)s
+    """, {'table': table})
+    return parts[0][0], parts[0][1] or 0, merges[0][0]
+
+
+def bucket_latencies(samples, start, interval, num_buckets):
+    buckets = [[] for _ in range(num_buckets)]
+    for finished_at, latency in samples:
+        index = int((finished_at - start) // interval)
+        if 0 <= index < num_buckets:
+            buckets[index].append(latency)
+    return buckets
+
+
+def run_scenario(table, conditions):
+    duration = SCENARIO['duration_sec']
+    interval = SCENARIO['sample_interval_sec']
+    clients = SCENARIO['query_clients']
+    query_prefix = f"{uuid.uuid4().hex[:8]}-mixed-{table}"
+
+    simulator = create_simulator({**CONFIG, 'target_table': table, 'duration_minutes': duration / 60})
+    insert_thread = threading.Thread(target=simulator.simulate_load, name='Inserter', daemon=True)
+    monitor = Client(**CH_CONFIG)
+
+    start = time.time()
+    insert_thread.start()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        futures = [executor.submit(load_client, (table, conditions, duration, query_prefix, i))
+                   for i in range(clients)]
+
+        # Временной ряд: скорость вставки, куски и слияния на момент замера
+        series = []
+        last_rows = 0
+        next_sample = start + interval
+        while time.time() < start + duration:
+            time.sleep(max(0.0, next_sample - time.time()))
+            rows = simulator.inserted_rows
+            active_parts, table_rows, merges = sample_server(monitor, table)
+            series.append({
+                'elapsed_sec': round(next_sample - start),
+                'insert_rows_per_sec': round((rows - last_rows) / interval),
+                'active_parts': active_parts,
+                'table_rows': table_rows,
+                'merges': merges,
+            })
+            last_rows = rows
+            next_sample += interval
+
+        samples = [sample for future in futures for sample in future.result()[0]]
+
+    insert_thread.join()
+    monitor.disconnect()
+
+    for point, latencies in zip(series, bucket_latencies(samples, start, interval, len(series))):
+        point['queries'] = len(latencies)
+        point['query_p50_ms'] = round(percentile(latencies, 50) * 1000, 2)
+        point['query_p99_ms'] = round(percentile(latencies, 99) * 1000, 2)
+
+    latencies = [latency for _, latency in samples]
+    summary = [
+        table,
+        round(simulator.inserted_rows / duration),
+        round(len(latencies) / duration, 2),
+        round(percentile(latencies, 50) * 1000, 2),
+        round(percentile(latencies, 99) * 1000, 2),
+        max((point['active_parts'] for point in series), default=0),
+        max((point['merges'] for point in series), default=0),
+    ]
+    return series, summary
+
+
+def save_series(table, series):
+    path = os.path.join(SCENARIO['report_dir'], f"test_mixed_{table}.csv")
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(series[0].keys()))
+        writer.writeheader()
+        writer.writerows(series)
+    print(f"Time series saved to {path}")
+
+
+def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    conditions = load_workload(LOAD_TEST['workload_files'])
+
+    summaries = []
+    for table in TABLES:
+        print(f"Running mixed insert/select scenario on {table} for {SCENARIO['duration_sec']} sec...")
+        series, summary = run_scenario(table, conditions)
+        if series:
+            save_series(table, series)
+        summaries.append(summary)
+
+    print(tabulate(summaries, headers=['Table', 'Insert rows/sec', 'QPS', 'Query p50 (ms)', 'Query p99 (ms)',
+                                       'Max active parts', 'Max merges'], tablefmt='grid'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import ast
+import time
+from datetime import date, datetime, timedelta
+
+from columnar_batch import ColumnarBatch
+
+# Функции ClickHouse, которые встречаются в выражениях PARTITION BY, и их аналоги в Python
+CLICKHOUSE_FUNCTIONS = {
+    'toYear': lambda value: value.year,
+    'toMonth': lambda value: value.month,
+    'toQuarter': lambda value: (value.month - 1) // 3 + 1,
+    'toDayOfMonth': lambda value: value.day,
+    'toHour': lambda value: value.hour,
+    'toYYYYMM': lambda value: value.year * 100 + value.month,
+    'toYYYYMMDD': lambda value: value.year * 10000 + value.month * 100 + value.day,
+    'toDate': lambda value: value.date() if isinstance(value, datetime) else value,
+    'toStartOfMonth': lambda value: date(value.year, value.month, 1),
+    'toStartOfYear': lambda value: date(value.year, 1, 1),
+    'toMonday': lambda value: (value.date() if isinstance(value, datetime) else value) - timedelta(days=value.weekday()),
+    'toStartOfDay': lambda value: datetime(value.year, value.month, value.day),
+    'intDiv': lambda a, b: a // b,
+}
+ALLOWED_NODES = (
+    ast.Expression, ast.Call, ast.Name, ast.Load, ast.Constant, ast.Tuple,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.FloorDiv, ast.Mod,
+    ast.Compare, ast.Gt, ast.GtE, ast.Lt, ast.LtE, ast.Eq, ast.NotEq,
+)
+
+
+def partition_function(expression, column_names):
+    # Выражение PARTITION BY (из system.tables.partition_key) -> функция от значений строки.
+    # Поддерживаются функции из CLICKHOUSE_FUNCTIONS, арифметика и сравнения
+    tree = ast.parse(expression.strip(), mode='eval')
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"Unsupported partition expression: {expression}")
+        if isinstance(node, ast.Name):
+            if node.id not in CLICKHOUSE_FUNCTIONS and node.id not in column_names:
+                raise ValueError(f"Unknown name {node.id} in partition expression: {expression}")
+            names.add(node.id)
+    code = compile(tree, '<partition_key>', 'eval')
+    used = [name for name in column_names if name in names]
+    return used, lambda *values: eval(code, CLICKHOUSE_FUNCTIONS, dict(zip(used, values)))
+
+
+def fetch_partition_key(conn, table):
+    rows = conn.execute("""
+        SELECT partition_key
+        FROM system.tables
+        WHERE database = currentDatabase() AND name = %(table)s
+    """, {'table': table})
+    return rows[0][0] if rows and rows[0][0] else None
+
+
+# Буфер строк по партициям: каждая партиция копится отдельно и отправляется, когда
+# набрала flush_rows строк или старше flush_age_sec. Одна вставка - один кусок
+# в одной партиции вместо кусков во всех партициях, которые задел случайный пакет
+class PartitionBuffer:
+    def __init__(self, expression, column_names, flush_rows=10000, flush_age_sec=5.0, max_buffered_rows=200000):
+        self.expression = expression
+        self.column_names = tuple(column_names)
+        self.key_columns, self.key = partition_function(expression, self.column_names)
+        self.flush_rows = flush_rows
+        self.flush_age_sec = flush_age_sec
+        self.max_buffered_rows = max_buffered_rows
+        # partition -> (колонки, время первой строки, номера записей спула исходных пакетов)
+        self.partitions = {}
+        self.buffered_rows = 0
+        self.flushed_batches = 0
+
+    def add(self, batch):
+        # Возвращает число партиций, в которые попали строки пакета
+        now = time.time()
+        columns = batch.data()
+        key_values = [columns[batch.column_names.index(name)] for name in self.key_columns]
+        keys = list(map(self.key, *key_values))
+        rows_by_partition = {}
+        for row, partition in enumerate(keys):
+            rows_by_partition.setdefault(partition, []).append(row)
+        for partition, rows in rows_by_partition.items():
+            buffer = self.partitions.get(partition)
+            if buffer is None:
+                buffer = self.partitions[partition] = ([[] for _ in columns], now, set())
+            for target, column in zip(buffer[0], columns):
+                target.extend([column[i] for i in rows])
+            if batch.spool_seq is not None:
+                buffer[2].add(batch.spool_seq)
+        self.buffered_rows += len(batch)
+        return len(rows_by_partition)
+
+    def _flush(self, partition):
+        columns, first_added, sources = self.partitions.pop(partition)
+        batch = ColumnarBatch.from_columns(columns, self.column_names)
+        batch.enqueued_at = first_added
+        batch.spool_sources = sorted(sources) or None
+        self.buffered_rows -= len(batch)
+        self.flushed_batches += 1
+        return batch
+
+    def due(self):
+        now = time.time()
+        ready = [partition for partition, (columns, first_added, _) in self.partitions.items()
+                 if len(columns[0]) >= self.flush_rows or now - first_added >= self.flush_age_sec]
+        batches = [self._flush(partition) for partition in ready]
+        # Ограничение памяти: отправляем самые большие партиции
+        while self.buffered_rows > self.max_buffered_rows:
+            largest = max(self.partitions, key=lambda partition: len(self.partitions[partition][0][0]))
+            batches.append(self._flush(largest))
+        return batches
+
+    def drain(self):
+        return [self._flush(partition) for partition in list(self.partitions)]
@@ -0,0 +1,199 @@
+import logging
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from clickhouse_driver import Client
+
+from retry_policy import execute_with_retry
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+
+# Одна таблица результатов для всех бенчмарков вместо копий test_*_query в каждом скрипте
+RESULT_TABLE = 'benchmark_query_log'
+CREATE_RESULT_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS {RESULT_TABLE} (
+        run_id String,
+        benchmark LowCardinality(String),
+        variant LowCardinality(String),
+        query_id String,
+        query_kind LowCardinality(String),
+        tables Array(String),
+        query String,
+        log_comment String,
+        event_time DateTime,
+        event_time_microseconds DateTime64(6),
+        query_duration_ms UInt64,
+        read_rows UInt64,
+        read_bytes UInt64,
+        written_rows UInt64,
+        written_bytes UInt64,
+        result_rows UInt64,
+        memory_usage UInt64,
+        user_cpu_us UInt64,
+        projections Array(String),
+        views Array(String)
+    ) ENGINE = MergeTree()
+    ORDER BY (benchmark, run_id, variant, event_time)
+"""
+
+QUERY_LOG_COLUMNS = [
+    'query_id', 'query_kind', 'tables', 'query', 'log_comment', 'event_time', 'event_time_microseconds',
+    'query_duration_ms', 'read_rows', 'read_bytes', 'written_rows', 'written_bytes', 'result_rows',
+    'memory_usage', "ProfileEvents['UserTimeMicroseconds']", 'projections', 'views',
+]
+
+COLLECTOR = {
+    'poll_interval_sec': 1.0,
+    'batch_rows': 1000,      # Максимум строк журнала за один опрос
+    'overlap_sec': 10.0,     # Повторно читаемое окно перед отметкой: запись журнала может появиться позже
+}
+
+
+def table_variant(row):
+    # Вариант - первая пользовательская таблица запроса без имени базы
+    for table in row['tables']:
+        database, _, name = table.rpartition('.')
+        if database != 'system':
+            return name
+    return ''
+
+
+def log_comment_variant(row):
+    # Для запросов с log_comment вида '<run_id>-<вариант>'
+    return row['log_comment'].partition('-')[2]
+
+
+# Фоновый сборщик system.query_log: читает новые завершенные запросы по отметке
+# (event_time_microseconds, query_id), помечает их run_id, именем бенчмарка и вариантом
+# и вставляет в RESULT_TABLE одним INSERT на опрос
+class QueryLogCollector:
+    def __init__(self, benchmark, run_id=None, query_id_prefix=None, log_comment_prefix=None, tables=None,
+                 variant=table_variant, config=CH_CONFIG, poll_interval_sec=COLLECTOR['poll_interval_sec'],
+                 batch_rows=COLLECTOR['batch_rows'], overlap_sec=COLLECTOR['overlap_sec'], client_factory=Client):
+        self.benchmark = benchmark
+        self.run_id = run_id or uuid.uuid4().hex[:8]
+        self.query_id_prefix = query_id_prefix
+        self.log_comment_prefix = log_comment_prefix
+        self.tables = tables
+        self.variant = variant
+        self.poll_interval_sec = poll_interval_sec
+        self.batch_rows = batch_rows
+        self.overlap = timedelta(seconds=overlap_sec)
+        self.conn = client_factory(**config)
+        self.database = config.get('database', 'default')
+
+        # Отметка: запросы до нее уже собраны (начальная - время сервера при start()).
+        # Окно перекрытия перед отметкой читается повторно, уже собранные query_id отсекаются
+        self.watermark = (datetime.now(), '')
+        self.collected = 0
+        self.inserts = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def conditions(self):
+        conditions = ["type = 'QueryFinish'",
+                      "event_date >= toDate(%(since)s)",
+                      "event_time_microseconds >= %(since)s",
+                      f"NOT has(tables, '{self.database}.{RESULT_TABLE}')",
+                      f"query_id NOT IN (SELECT query_id FROM {RESULT_TABLE} "
+                      f"WHERE run_id = %(run_id)s AND event_time_microseconds >= %(since)s)"]
+        params = {'since': self.watermark[0] - self.overlap, 'run_id': self.run_id, 'limit': self.batch_rows}
+        if self.query_id_prefix:
+            conditions.append("startsWith(query_id, %(query_id_prefix)s)")
+            params['query_id_prefix'] = self.query_id_prefix
+        if self.log_comment_prefix:
+            conditions.append("startsWith(log_comment, %(log_comment_prefix)s)")
+            params['log_comment_prefix'] = self.log_comment_prefix
+        if self.tables:
+            conditions.append("hasAny(tables, %(tables)s)")
+            params['tables'] = [f"{self.database}.{table}" for table in self.tables]
+        return conditions, params
+
+    def poll(self):
+        # Один опрос: новые строки журнала -> одна пакетная вставка. Возвращает число строк
+        execute_with_retry(self.conn, "SYSTEM FLUSH LOGS")
+        conditions, params = self.conditions()
+        rows = execute_with_retry(self.conn, f"""
+            SELECT {', '.join(QUERY_LOG_COLUMNS)}
+            FROM system.query_log
+            WHERE {' AND '.join(conditions)}
+            ORDER BY event_time_microseconds, query_id
+            LIMIT %(limit)s
+        """, params) or []
+
+        batch = []
+        for values in rows:
+            row = dict(zip(QUERY_LOG_COLUMNS, values))
+            self.watermark = max(self.watermark, (row['event_time_microseconds'], row['query_id']))
+            batch.append([self.run_id, self.benchmark, self.variant(row), *values])
+
+        if batch:
+            execute_with_retry(self.conn, f"INSERT INTO {RESULT_TABLE} VALUES", batch)
+            self.collected += len(batch)
+            self.inserts += 1
+        return len(batch)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                # Полный опрос - журнал мог отстать, читаем дальше без паузы
+                if self.poll() >= self.batch_rows:
+                    continue
+            except Exception as e:
+                logging.error(f"Query log collector error: {e}")
+            self.stop_event.wait(self.poll_interval_sec)
+
+    def start(self):
+        execute_with_retry(self.conn, CREATE_RESULT_TABLE)
+        self.watermark = (execute_with_retry(self.conn, "SELECT now64(6)")[0][0], '')
+        self.thread = threading.Thread(target=self.run, name=f"QueryLogCollector-{self.benchmark}", daemon=True)
+        self.thread.start()
+        logging.info(f"Collecting query log for {self.benchmark} run {self.run_id} into {RESULT_TABLE}")
+        return self
+
+    def stop(self, drain_timeout_sec=30.0):
+        # Остановка фонового опроса и дочитывание журнала, пока в нем есть новые строки
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        deadline = time.time() + drain_timeout_sec
+        while time.time() < deadline and self.poll():
+            pass
+        self.conn.disconnect()
+        logging.info(f"Collected {self.collected} queries in {self.inserts} inserts for run {self.run_id}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    # Сбор статистики для SQL-скриптов, которые выполняются вручную (test_update.sql, test_view.sql,
+    # test_partitioned.sql): python query_log_collector.py update logs_with_indexes_v2,logs_with_projections_v2
+    # Сборщик работает до Ctrl+C
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        print("Usage: python query_log_collector.py <benchmark> [table1,table2,...]")
+        sys.exit(1)
+    tables = sys.argv[2].split(',') if len(sys.argv) > 2 else None
+    collector = QueryLogCollector(sys.argv[1], tables=tables).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    collector.stop()
+
+
+if __name__ == "__main__":
+    main()
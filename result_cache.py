@@ -0,0 +1,246 @@
+import collections
+import re
+import threading
+import time
+from datetime import datetime
+
+from retry_policy import execute_with_retry
+
+CACHE = {
+    'max_entries': 1000,
+    'ttl_sec': 300.0,
+    # True - вставка сбрасывает только записи, диапазон timestamp которых пересекается
+    # с диапазоном вставленных строк; False - все записи таблицы
+    'precise': True,
+}
+
+TIMESTAMP_COMPARISON = re.compile(r"\btimestamp\s*(<=|>=|<|>|=)\s*'([^']+)'", re.IGNORECASE)
+TIMESTAMP_BETWEEN = re.compile(r"\btimestamp\s+BETWEEN\s+'([^']+)'\s+AND\s+'([^']+)'", re.IGNORECASE)
+# При OR/NOT условие на timestamp не ограничивает строки результата
+UNBOUNDED = re.compile(r"\b(OR|NOT)\b", re.IGNORECASE)
+STRING_LITERAL = re.compile(r"('(?:[^'\\]|\\.)*')")
+WHERE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+SELECT = re.compile(r"\bSELECT\b", re.IGNORECASE)
+
+
+def normalize_sql(query):
+    # Пробелы и комментарии вне строковых литералов не влияют на ключ кеша
+    parts = STRING_LITERAL.split(query.strip().rstrip(';'))
+    for i in range(0, len(parts), 2):
+        parts[i] = ' '.join(re.sub(r"--[^\n]*", ' ', parts[i]).split())
+    return ''.join(parts).strip()
+
+
+def parse_time(value):
+    # None - формат не разобран (например '20200101') или с часовым поясом: границы нет
+    try:
+        parsed = datetime.fromisoformat(value) if len(value) > 10 else datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is None else None
+
+
+def timestamp_range(query):
+    # Диапазон timestamp, которым ограничен результат: (low, high), None - без границы.
+    # Остальные условия под AND только сужают результат, поэтому их можно не учитывать
+    # WHERE ищется в любом регистре и вне строковых литералов (литералы заменены пробелами).
+    # Во вложенном запросе условия на timestamp относятся к другой выборке - диапазон не выводится
+    masked = STRING_LITERAL.sub(lambda match: "'" + ' ' * (len(match.group()) - 2) + "'", query)
+    if len(SELECT.findall(masked)) > 1 or len(WHERE.findall(masked)) > 1:
+        return None, None
+    match = WHERE.search(masked)
+    where = query[match.end():] if match else ''
+    if not where or UNBOUNDED.search(STRING_LITERAL.sub("''", where)):
+        return None, None
+    low, high = None, None
+    bounds = [(op, value) for op, value in TIMESTAMP_COMPARISON.findall(where)]
+    for first, last in TIMESTAMP_BETWEEN.findall(where):
+        bounds += [('>=', first), ('<=', last)]
+    for op, value in bounds:
+        value = parse_time(value)
+        if value is None:
+            continue
+        if op in ('>', '>=', '='):
+            low = value if low is None else max(low, value)
+        if op in ('<', '<=', '='):
+            high = value if high is None else min(high, value)
+    return low, high
+
+
+def overlaps(low, high, other_low, other_high):
+    return (high is None or other_low is None or other_low <= high) and \
+        (low is None or other_high is None or low <= other_high)
+
+
+# Отметки вставок по таблицам. Путь вставки публикует диапазон timestamp каждой
+# вставленной пачки, подписчики (кеши) сбрасывают затронутые записи
+class Watermarks:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.max_timestamp = {}
+        self.inserts = collections.Counter()
+        self.listeners = []
+
+    def subscribe(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def publish(self, table, low=None, high=None):
+        # low/high - мин. и макс. timestamp вставленных строк; None - изменилась вся таблица
+        with self.lock:
+            self.inserts[table] += 1
+            if high is not None:
+                self.max_timestamp[table] = max(self.max_timestamp.get(table, high), high)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(table, low, high)
+
+    def publish_batch(self, table, batch):
+        timestamps = batch.column('timestamp')
+        if timestamps:
+            self.publish(table, min(timestamps), max(timestamps))
+
+
+# Отметка по активным частям таблицы для вставок из других процессов: новая часть
+# меняет max_block_number, мутация - data_version. Изменение сбрасывает всю таблицу
+class PartWatermark:
+    def __init__(self, conn, watermarks):
+        self.conn = conn
+        self.watermarks = watermarks
+        self.seen = {}
+
+    def poll(self, tables):
+        rows = execute_with_retry(self.conn, """
+            SELECT table, max(max_block_number), max(data_version)
+            FROM system.parts
+            WHERE database = currentDatabase() AND table IN %(tables)s AND active
+            GROUP BY table
+        """, {'tables': list(tables)}) or []
+        for table, block_number, data_version in rows:
+            mark = (block_number, data_version)
+            if self.seen.setdefault(table, mark) != mark:
+                self.seen[table] = mark
+                self.watermarks.publish(table)
+
+
+class CacheEntry:
+    def __init__(self, result, read_bytes, low, high, expires_at):
+        self.result = result
+        self.read_bytes = read_bytes
+        self.low = low
+        self.high = high
+        self.expires_at = expires_at
+
+
+# Запрос в работе: остальные запросы с тем же ключом ждут его результата
+class InFlight:
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        self.done = threading.Event()
+        self.result = None
+        self.read_bytes = 0
+        self.error = None
+        self.stale = False
+
+
+# Кеш результатов SELECT на стороне клиента. Ключ - таблица, нормализованный SQL
+# и параметры; LRU на max_entries записей с TTL. Одновременные запросы с одним ключом
+# объединяются в один запрос к серверу. Вставка в таблицу сбрасывает записи, диапазон
+# timestamp которых пересекается с вставленным (или все записи таблицы, если precise=False)
+class ResultCache:
+    def __init__(self, pool, watermarks=None, max_entries=CACHE['max_entries'], ttl_sec=CACHE['ttl_sec'],
+                 precise=CACHE['precise'], clock=time.monotonic):
+        self.pool = pool
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.precise = precise
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.in_flight = {}
+        self.stats = collections.Counter()
+        if watermarks:
+            watermarks.subscribe(self.invalidate)
+
+    def execute(self, table, query, params=None, **kwargs):
+        key = (table, normalize_sql(query), repr(sorted(params.items())) if params else '')
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry.expires_at > self.clock():
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                self.stats['saved_read_bytes'] += entry.read_bytes
+                return entry.result
+            if entry:
+                del self.entries[key]
+                self.stats['expired'] += 1
+            waiting = self.in_flight.get(key)
+            owner = waiting is None
+            if owner:
+                waiting = self.in_flight[key] = InFlight(*(timestamp_range(query) if self.precise else (None, None)))
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        if owner:
+            return self.fetch(key, waiting, query, params, kwargs)
+
+        waiting.done.wait()
+        if waiting.error:
+            raise waiting.error
+        with self.lock:
+            self.stats['saved_read_bytes'] += waiting.read_bytes
+        return waiting.result
+
+    def fetch(self, key, waiting, query, params, kwargs):
+        conn = self.pool.get_connection()
+        try:
+            waiting.result = execute_with_retry(conn, query, params, **kwargs)
+            # Прочитанные сервером байты - из последнего Progress-пакета запроса
+            progress = getattr(getattr(conn, 'last_query', None), 'progress', None)
+            waiting.read_bytes = getattr(progress, 'bytes', 0) or 0
+        except Exception as e:
+            waiting.error = e
+        finally:
+            self.pool.return_connection(conn, broken=waiting.error is not None)
+
+        with self.lock:
+            del self.in_flight[key]
+            self.stats['read_bytes'] += waiting.read_bytes
+            if waiting.error is None and not waiting.stale:
+                self.entries[key] = CacheEntry(waiting.result, waiting.read_bytes, waiting.low, waiting.high,
+                                               self.clock() + self.ttl_sec)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.stats['evicted'] += 1
+        waiting.done.set()
+        if waiting.error:
+            raise waiting.error
+        return waiting.result
+
+    def invalidate(self, table, low=None, high=None):
+        # Запрос, выполнявшийся во время вставки, мог не увидеть новых строк - его
+        # результат отдается ожидающим, но в кеш не попадает
+        if not self.precise:
+            low = high = None
+        with self.lock:
+            stale = [key for key, entry in self.entries.items()
+                     if key[0] == table and overlaps(entry.low, entry.high, low, high)]
+            for key in stale:
+                del self.entries[key]
+            for key, waiting in self.in_flight.items():
+                if key[0] == table and overlaps(waiting.low, waiting.high, low, high):
+                    waiting.stale = True
+            self.stats['invalidated'] += len(stale)
+
+    def hit_rate(self):
+        requests = self.stats['hits'] + self.stats['coalesced'] + self.stats['misses']
+        return (self.stats['hits'] + self.stats['coalesced']) / requests if requests else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, 'entries': len(self.entries), 'hit_rate': round(self.hit_rate(), 3)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
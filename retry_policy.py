@@ -0,0 +1,191 @@
+import logging
+import random
+import threading
+import time
+from socket import error as socket_error
+
+from clickhouse_driver import errors as ch_errors
+from clickhouse_driver.errors import ErrorCodes
+
+# "CPU is overloaded" (min_os_cpu_wait_time_ratio_to_throw), в clickhouse_driver.errors его нет
+SERVER_OVERLOADED = 745
+
+# Перегрузка сервера: повторяем с паузой и учитываем в circuit breaker
+OVERLOAD_CODES = {
+    SERVER_OVERLOADED,
+    ErrorCodes.TOO_MANY_SIMULTANEOUS_QUERIES,
+    ErrorCodes.MEMORY_LIMIT_EXCEEDED,
+    ErrorCodes.TOO_MANY_PARTS,
+    ErrorCodes.TIMEOUT_EXCEEDED,
+}
+# Временные сбои: повторяем, но о здоровье сервера они говорят меньше
+TRANSIENT_CODES = {
+    ErrorCodes.SOCKET_TIMEOUT,
+    ErrorCodes.NETWORK_ERROR,
+    ErrorCodes.NO_FREE_CONNECTION,
+    ErrorCodes.ALL_CONNECTION_TRIES_FAILED,
+    ErrorCodes.TABLE_IS_READ_ONLY,
+    ErrorCodes.KEEPER_EXCEPTION,
+}
+
+# Ошибки самого соединения: такое соединение больше не используется
+CONNECTION_ERRORS = (ch_errors.NetworkError, ch_errors.SocketTimeoutError, socket_error, EOFError)
+
+OVERLOAD = 'overload'
+TRANSIENT = 'transient'
+FATAL = 'fatal'
+
+
+def classify(error):
+    # Класс ошибки по коду ClickHouse, а не по тексту сообщения
+    if isinstance(error, ch_errors.ServerException):
+        if error.code in OVERLOAD_CODES:
+            return OVERLOAD
+        if error.code in TRANSIENT_CODES:
+            return TRANSIENT
+        return FATAL
+    if isinstance(error, CONNECTION_ERRORS):
+        return TRANSIENT
+    return FATAL
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# Общий для всего пула соединений предохранитель: после failure_threshold ошибок подряд
+# запросы не отправляются reset_timeout_sec, затем пропускается один пробный запрос
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout_sec=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_sec = reset_timeout_sec
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.trips = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout_sec:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def remaining(self):
+        # Сколько еще секунд предохранитель будет открыт
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout_sec - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def release_probe(self):
+        # Пробный запрос не дошел до сервера: предохранитель остается полуоткрытым,
+        # следующий запрос снова будет пробным
+        with self.lock:
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probe_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    logging.warning(f"Circuit breaker opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+                self.trips += 1
+
+
+# Повторы с экспоненциальной паузой и полным джиттером: потоки не просыпаются одновременно
+class RetryPolicy:
+    def __init__(self, max_retries=3, base_delay_sec=0.5, max_delay_sec=10.0, breaker=None,
+                 sleep=time.sleep, rng=None):
+        self.max_retries = max_retries
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self.breaker = breaker
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.counters = {'calls': 0, 'retries': 0, 'failures': 0, 'shed': 0, OVERLOAD: 0, TRANSIENT: 0, FATAL: 0}
+
+    def delay(self, attempt):
+        return self.rng.uniform(0, min(self.max_delay_sec, self.base_delay_sec * 2 ** attempt))
+
+    def cooldown(self):
+        # Пауза потока после неудачной отправки: до закрытия предохранителя или джиттер
+        if self.breaker and self.breaker.state == 'open':
+            return self.breaker.remaining() + self.delay(0)
+        return self.delay(0)
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+        if self.breaker:
+            counters['trips'] = self.breaker.trips
+            counters['state'] = self.breaker.state
+        return counters
+
+    def execute(self, conn, query, params=None, **execute_kwargs):
+        self.count('calls')
+        for attempt in range(self.max_retries):
+            if self.breaker and not self.breaker.allow():
+                self.count('shed')
+                raise CircuitOpenError(f"Circuit is open, retry in {self.breaker.remaining():.1f}s")
+            try:
+                if params:
+                    result = conn.execute(query, params, **execute_kwargs)
+                else:
+                    result = conn.execute(query, **execute_kwargs)
+            except Exception as e:
+                kind = classify(e)
+                self.count(kind)
+                if self.breaker:
+                    # Ошибка запроса от сервера - сервер ответил. Ошибка на клиенте (например,
+                    # при сборке блока) о сервере ничего не говорит, но пробный запрос освобождается
+                    if kind == FATAL and isinstance(e, ch_errors.ServerException):
+                        self.breaker.record_success()
+                    elif kind == FATAL:
+                        self.breaker.release_probe()
+                    else:
+                        self.breaker.record_failure()
+                if kind == FATAL or attempt == self.max_retries - 1:
+                    self.count('failures')
+                    raise
+                retry_delay = self.delay(attempt)
+                self.count('retries')
+                logging.warning(f"Retryable {kind} error: {e}, retrying in {retry_delay:.2f} seconds "
+                                f"(attempt {attempt + 1}/{self.max_retries})")
+                self.sleep(retry_delay)
+                continue
+            if self.breaker:
+                self.breaker.record_success()
+            return result
+        return None
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+def execute_with_retry(conn, query, params=None, policy=None, **execute_kwargs):
+    return (policy or DEFAULT_POLICY).execute(conn, query, params, **execute_kwargs)
@@ -0,0 +1,175 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from retry_policy import execute_with_retry
+
+# Агрегатные сводки логов: число событий по login/event/subsystem за минуту или час.
+# Состояния count хранятся в AggregatingMergeTree, строки из разных вставок одного
+# интервала схлопываются при слияниях, при чтении - countMerge
+DIMENSIONS = ('login', 'event', 'subsystem')
+INTERVALS = {
+    'minute': ('toStartOfMinute', timedelta(minutes=1)),
+    'hour': ('toStartOfHour', timedelta(hours=1)),
+}
+ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        bucket DateTime,
+        login LowCardinality(String),
+        event LowCardinality(String),
+        subsystem LowCardinality(String),
+        events AggregateFunction(count)
+    ) ENGINE = AggregatingMergeTree()
+    ORDER BY (bucket, login, event, subsystem)
+"""
+ROLLUP_SELECT = """
+    SELECT {function}(timestamp) AS bucket, login, event, subsystem, countState() AS events
+    FROM {source}
+    {where}
+    GROUP BY bucket, login, event, subsystem
+"""
+
+# Условие на timestamp: сравнение или BETWEEN со строковым литералом
+TIMESTAMP_PREDICATE = re.compile(
+    r"\btimestamp\s+(?:NOT\s+)?(?:BETWEEN\s+'([^']*)'\s+AND\s+'([^']*)'|(?:<=|>=|!=|=|<|>)\s*'([^']*)')",
+    re.IGNORECASE)
+KEYWORDS = {'AND', 'OR', 'NOT', 'LIKE', 'ILIKE', 'BETWEEN'}
+STRING_LITERAL = re.compile(r"('(?:[^'\\]|\\.)*')")
+
+
+def rollup_table(source, interval):
+    return f"{source}_rollup_{interval}"
+
+
+def rollup_select(source, interval, where=''):
+    function = INTERVALS[interval][0]
+    return ROLLUP_SELECT.format(function=function, source=source, where=f"WHERE {where}" if where else '')
+
+
+def create_rollup(conn, source, interval):
+    # Таблица сводки и представление, которое дописывает в нее каждую вставку в source.
+    # Строки, которые уже есть в source, переносятся отдельно - backfill()
+    table = rollup_table(source, interval)
+    execute_with_retry(conn, ROLLUP_DDL.format(table=table))
+    execute_with_retry(conn, f"CREATE MATERIALIZED VIEW IF NOT EXISTS {table}_mv TO {table} AS "
+                             f"{rollup_select(source, interval)}")
+    return table
+
+
+def drop_rollup(conn, source, interval):
+    table = rollup_table(source, interval)
+    execute_with_retry(conn, f"DROP VIEW IF EXISTS {table}_mv")
+    execute_with_retry(conn, f"DROP VIEW IF EXISTS {table}_populate")
+    execute_with_retry(conn, f"DROP TABLE IF EXISTS {table}")
+
+
+def bucket_start(value, interval):
+    if interval == 'minute':
+        return value.replace(second=0, microsecond=0)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def chunk_ranges(conn, source, interval, chunks, until=None):
+    # Диапазоны [начало, конец) примерно с равным числом строк по квантилям timestamp,
+    # границы выровнены по интервалу сводки
+    levels = ', '.join(f"{i / chunks:.4f}" for i in range(1, chunks))
+    where = "WHERE timestamp < %(until)s" if until else ''
+    rows, low, high, quantiles = execute_with_retry(conn, f"""
+        SELECT count(), min(timestamp), max(timestamp), quantiles({levels})(timestamp)
+        FROM {source} {where}
+    """, {'until': until})[0]
+    if not rows:
+        return []
+    step = INTERVALS[interval][1]
+    bounds = {bucket_start(value, interval) for value in [low, *quantiles]}
+    bounds = sorted(bounds | {bucket_start(high, interval) + step})
+    if until:
+        bounds[-1] = min(bounds[-1], until)
+    return list(zip(bounds, bounds[1:]))
+
+
+def backfill(pool, source, interval, chunks=16, workers=4, until=None):
+    # Перенос существующих строк source в сводку параллельными INSERT ... SELECT по
+    # диапазонам времени вместо одного POPULATE. Представление должно уже существовать:
+    # строки, вставленные после его создания, сводка получает от него, поэтому вставки
+    # в source на время переноса останавливаются или их timestamp не ниже until
+    table = rollup_table(source, interval)
+    conn = pool.get_connection()
+    try:
+        ranges = chunk_ranges(conn, source, interval, chunks, until)
+    finally:
+        pool.return_connection(conn)
+
+    def load(bounds):
+        start, end = bounds
+        where = f"timestamp >= '{format_time(start)}' AND timestamp < '{format_time(end)}'"
+        conn = pool.get_connection()
+        began = time.perf_counter()
+        try:
+            execute_with_retry(conn, f"INSERT INTO {table} {rollup_select(source, interval, where)}")
+        finally:
+            pool.return_connection(conn)
+        return time.perf_counter() - began
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(zip(ranges, executor.map(load, ranges)))
+
+
+def populate(conn, source, interval):
+    # Базовый вариант как в skripts/test_view.sql: представление с внутренней таблицей и POPULATE
+    table = f"{rollup_table(source, interval)}_populate"
+    execute_with_retry(conn, f"DROP VIEW IF EXISTS {table}")
+    start = time.perf_counter()
+    execute_with_retry(conn, f"CREATE MATERIALIZED VIEW {table} ENGINE = AggregatingMergeTree() "
+                             f"ORDER BY (bucket, login, event, subsystem) POPULATE AS "
+                             f"{rollup_select(source, interval)}")
+    elapsed = time.perf_counter() - start
+    execute_with_retry(conn, f"DROP VIEW IF EXISTS {table}")
+    return elapsed
+
+
+def rollup_count_queries(source, interval, condition):
+    # SELECT count(*) FROM source WHERE condition через сводку или None, если в условии
+    # есть колонки не из сводки. Вне интервалов, в которые попадают литералы timestamp,
+    # сравнение timestamp дает одно значение для всех строк интервала, и его можно
+    # заменить сравнением bucket. Строки пограничных интервалов считаются по source
+    literals = STRING_LITERAL.sub("''", condition)
+    for word in re.findall(r"[A-Za-z_]\w*", literals):
+        if word.upper() not in KEYWORDS and word not in DIMENSIONS and word != 'timestamp':
+            return None
+    matches = TIMESTAMP_PREDICATE.findall(condition)
+    if len(matches) != len(re.findall(r"\btimestamp\b", literals)):
+        return None
+    try:
+        values = [datetime.fromisoformat(value) for match in matches for value in match if value]
+    except ValueError:
+        return None
+
+    step = INTERVALS[interval][1]
+    edges = sorted({bucket_start(value, interval) for value in values})
+    # timestamp заменяется на bucket только вне строковых литералов
+    parts = STRING_LITERAL.split(condition)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\btimestamp\b", 'bucket', parts[i])
+    rollup_where = '(' + ''.join(parts) + ')'
+    queries = []
+    if edges:
+        buckets = ', '.join(f"'{format_time(edge)}'" for edge in edges)
+        rollup_where += f" AND bucket NOT IN ({buckets})"
+        ranges = ' OR '.join(f"(timestamp >= '{format_time(edge)}' AND timestamp < '{format_time(edge + step)}')"
+                             for edge in edges)
+        queries.append(f"SELECT count() FROM {source} WHERE ({condition}) AND ({ranges})")
+    queries.insert(0, f"SELECT countMerge(events) FROM {rollup_table(source, interval)} WHERE {rollup_where}")
+    return queries
+
+
+def rollup_count(conn, source, interval, condition):
+    queries = rollup_count_queries(source, interval, condition)
+    if queries is None:
+        return None
+    return sum(execute_with_retry(conn, query)[0][0] or 0 for query in queries)
@@ -0,0 +1,252 @@
+import csv
+import logging
+import re
+import sys
+import uuid
+from glob import glob
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from columnar_batch import ColumnarBatch, LOG_COLUMNS
+from log_reader import read_log_blocks
+from query_log_collector import RESULT_TABLE, QueryLogCollector
+from retry_policy import execute_with_retry
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+
+# Матрица: варианты схемы (таблицы из skripts/*.sql) x размеры данных x нагрузки
+MATRIX = {
+    'ddl_files': 'skripts/*.sql',
+    'variants': ['logs_full_scan', 'logs_ordered', 'logs_with_indexes', 'logs_with_indexes_v2',
+                 'logs_with_projections', 'logs_partitioned'],
+    'dataset_sizes': [100_000, 1_000_000],
+    'workloads': ['insert', 'select', 'mv', 'update'],
+    'log_file': 'data/logs_data_3_000.csv',
+    'insert_block_size': 10_000,
+    'select_files': 'queries_select/*.txt',
+    'select_repetitions': 3,
+    'table_prefix': 'matrix_',  # Копии вариантов создаются под этим префиксом, исходные таблицы не трогаются
+    'keep_tables': False,
+    'results_file': 'results/schema_matrix.csv',
+}
+
+# Изменения из test_update.sql; выполняются с mutations_sync = 2, длительность включает мутацию
+UPDATES = [
+    "ALTER TABLE {table} UPDATE comment = 'two tee to two two' WHERE timestamp = '2000-07-05 08:27:55'",
+    "ALTER TABLE {table} UPDATE description = 'hello world' WHERE subsystem = 'bd'",
+]
+# Материализованное представление из test_view.sql
+MV_QUERIES = [
+    """CREATE MATERIALIZED VIEW {table}_failed_mv
+       ENGINE = MergeTree() ORDER BY (timestamp, login) POPULATE
+       AS SELECT timestamp, login, event, subsystem, comment FROM {table} WHERE event LIKE '%_failed'""",
+    # Стоимость вставки с подключенным представлением
+    "INSERT INTO {table} SELECT timestamp - toIntervalSecond(1), login, event, subsystem, comment, description "
+    "FROM {table} LIMIT 10000",
+    "SELECT count() FROM {table}_failed_mv",
+    "SELECT login, count() FROM {table}_failed_mv GROUP BY login ORDER BY count() DESC LIMIT 10",
+]
+
+# DDL, которые относятся к схеме варианта; остальное (DELETE, UPDATE, INSERT, DROP) пропускается
+SCHEMA_STATEMENT = re.compile(r"^(CREATE TABLE|ALTER TABLE\s+\S+\s+(ADD|MATERIALIZE)\s+(INDEX|PROJECTION))",
+                              re.IGNORECASE)
+TABLE_NAME = re.compile(r"^(?:CREATE TABLE|ALTER TABLE)\s+(?:IF NOT EXISTS\s+)?(?:\w+\.)?(\w+)", re.IGNORECASE)
+
+
+def split_statements(sql):
+    lines = [line.split('--', 1)[0] for line in sql.splitlines()]
+    return [' '.join(statement.split()) for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def load_variants(pattern):
+    # Таблица -> DDL из скриптов. Берутся только таблицы со схемой логов
+    variants = {}
+    for file_path in sorted(glob(pattern)):
+        with open(file_path, 'r') as f:
+            for statement in split_statements(f.read()):
+                if not SCHEMA_STATEMENT.match(statement):
+                    continue
+                table = TABLE_NAME.match(statement).group(1)
+                if statement.upper().startswith('CREATE'):
+                    columns = re.findall(r"[(,]\s*(\w+)\s+(?:LowCardinality|DateTime|String)", statement)
+                    if tuple(columns) != LOG_COLUMNS:
+                        continue
+                    variants[table] = [statement]
+                elif table in variants:
+                    variants[table].append(statement)
+    return variants
+
+
+def rename(statement, table, name):
+    return re.sub(rf"\b(?:\w+\.)?{table}\b", name, statement)
+
+
+def double_table(execute, table, rows, size, columns=LOG_COLUMNS):
+    # Таблица удваивается на сервере (INSERT ... SELECT), пока не наберется size строк.
+    # Копия сдвигается по времени на 1, 2, 4, ... секунд; строки, чей сдвинутый timestamp
+    # уже есть в таблице, не копируются, поэтому timestamp не повторяются и ReplacingMergeTree
+    # с timestamp в ключе ничего не схлопывает. ORDER BY перед LIMIT - неполная копия
+    # одна и та же при каждом прогоне
+    shift = 1
+    while rows < size:
+        execute(f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT timestamp + toIntervalSecond({shift}), {', '.join(columns[1:])}
+            FROM {table}
+            WHERE timestamp + toIntervalSecond({shift}) NOT IN (SELECT timestamp FROM {table})
+            ORDER BY timestamp
+            LIMIT {size - rows}
+        """)
+        rows = execute(f"SELECT count() FROM {table}")[0][0]
+        shift *= 2
+    loaded, distinct = execute(f"SELECT count(), uniqExact(timestamp) FROM {table}")[0]
+    if loaded != size:
+        raise RuntimeError(f"{table}: loaded {loaded} rows instead of {size}")
+    if distinct < loaded:
+        logging.warning(f"{table}: {loaded - distinct} rows share timestamp with others and may be "
+                        f"collapsed by ReplacingMergeTree")
+    return loaded
+
+
+class SchemaMatrix:
+    def __init__(self, settings=MATRIX, config=CH_CONFIG):
+        self.settings = settings
+        self.config = config
+        self.client = Client(**config)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.variants = load_variants(settings['ddl_files'])
+        self.select_conditions = []
+        for file_path in sorted(glob(settings['select_files'])):
+            with open(file_path, 'r') as f:
+                self.select_conditions.extend(line.strip() for line in f if line.strip())
+        self.sequence = 0
+
+    def execute(self, cell, workload, query, params=None, **kwargs):
+        # Каждый запрос помечается query_id '<run_id>.<вариант>.<размер>.<нагрузка>.<n>'
+        self.sequence += 1
+        query_id = f"{self.run_id}.{cell}.{workload}.{self.sequence}"
+        return execute_with_retry(self.client, query, params, query_id=query_id, **kwargs)
+
+    def provision(self, variant, name):
+        self.client.execute(f"DROP TABLE IF EXISTS {name}_failed_mv")
+        self.client.execute(f"DROP TABLE IF EXISTS {name}")
+        for statement in self.variants[variant]:
+            self.client.execute(rename(statement, variant, name))
+
+    def load(self, cell, name, size):
+        # Нагрузка insert: пакетная вставка файла блоками; дальше таблица удваивается
+        # на сервере (double_table), пока не наберется size строк
+        rows = 0
+        workload = 'insert' if 'insert' in self.settings['workloads'] else 'load'
+        for block in read_log_blocks(self.settings['log_file'], self.settings['insert_block_size']):
+            if rows + len(block) > size:
+                block = ColumnarBatch.from_columns([column[:size - rows] for column in block.data()])
+            self.execute(cell, workload, block.insert_query(name), block.data(), columnar=True)
+            rows += len(block)
+            if rows >= size:
+                break
+        return double_table(lambda query: self.execute(cell, 'load', query), name, rows, size)
+
+    def run_select(self, cell, name):
+        for _ in range(self.settings['select_repetitions']):
+            for condition in self.select_conditions:
+                self.execute(cell, 'select', f"SELECT count(*) FROM {name} WHERE {condition}")
+
+    def run_mv(self, cell, name):
+        for query in MV_QUERIES:
+            self.execute(cell, 'mv', query.format(table=name))
+
+    def run_update(self, cell, name):
+        for query in UPDATES:
+            self.execute(cell, 'update', query.format(table=name), settings={'mutations_sync': 2})
+
+    def run_cell(self, variant, size):
+        name = f"{self.settings['table_prefix']}{variant}"
+        cell = f"{variant}.{size}"
+        print(f"Running {variant} with {size} rows...")
+        self.provision(variant, name)
+        self.load(cell, name, size)
+        workloads = {'select': self.run_select, 'mv': self.run_mv, 'update': self.run_update}
+        for workload in self.settings['workloads']:
+            if workload in workloads:
+                try:
+                    workloads[workload](cell, name)
+                except Exception as e:
+                    print(f"Error in {workload} on {variant}: {e}")
+        if not self.settings['keep_tables']:
+            self.client.execute(f"DROP TABLE IF EXISTS {name}_failed_mv")
+            self.client.execute(f"DROP TABLE IF EXISTS {name}")
+
+    def results(self):
+        # Сводка по ячейкам матрицы из строк журнала запросов прогона
+        return execute_with_retry(self.client, f"""
+            SELECT
+                splitByChar('.', variant)[1] AS table,
+                toUInt64(splitByChar('.', variant)[2]) AS rows,
+                splitByChar('.', variant)[3] AS workload,
+                count() AS queries,
+                round(sum(query_duration_ms) / 1000, 3) AS total_sec,
+                quantile(0.5)(query_duration_ms) AS median_ms,
+                quantile(0.95)(query_duration_ms) AS p95_ms,
+                sum(read_rows) AS read_rows,
+                sum(read_bytes) AS read_bytes,
+                sum(written_rows) AS written_rows,
+                max(memory_usage) AS max_memory,
+                round(sum(user_cpu_us) / 1e6, 3) AS cpu_sec
+            FROM {RESULT_TABLE}
+            WHERE benchmark = 'schema_matrix' AND run_id = %(run_id)s
+            GROUP BY table, rows, workload
+            ORDER BY workload, rows, median_ms
+        """, {'run_id': self.run_id}) or []
+
+    def run(self):
+        missing = [variant for variant in self.settings['variants'] if variant not in self.variants]
+        if missing:
+            print(f"No DDL for {missing} in {self.settings['ddl_files']}")
+        variants = [variant for variant in self.settings['variants'] if variant in self.variants]
+
+        collector = QueryLogCollector('schema_matrix', run_id=self.run_id, query_id_prefix=f"{self.run_id}.",
+                                      variant=lambda row: row['query_id'].split('.', 1)[1].rsplit('.', 1)[0],
+                                      config=self.config).start()
+        try:
+            for size in self.settings['dataset_sizes']:
+                for variant in variants:
+                    self.run_cell(variant, size)
+        finally:
+            collector.stop()
+
+        results = self.results()
+        headers = ['Table', 'Rows', 'Workload', 'Queries', 'Total (sec)', 'Median (ms)', 'p95 (ms)',
+                   'Read rows', 'Read bytes', 'Written rows', 'Max memory', 'CPU (sec)']
+        print(tabulate(results, headers=headers, tablefmt='grid'))
+        with open(self.settings['results_file'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['run_id'] + headers)
+            writer.writerows([self.run_id, *row] for row in results)
+        print(f"\nResults saved to {self.settings['results_file']}")
+
+
+def main():
+    # python schema_matrix.py [таблица ...] - только указанные варианты;
+    # --list - варианты, найденные в skripts/*.sql, и их DDL
+    logging.getLogger().setLevel(logging.WARNING)
+    if '--list' in sys.argv:
+        for table, statements in load_variants(MATRIX['ddl_files']).items():
+            print(f"{table}:")
+            for statement in statements:
+                print(f"    {statement}")
+        return
+    settings = dict(MATRIX)
+    if len(sys.argv) > 1:
+        settings['variants'] = sys.argv[1:]
+    SchemaMatrix(settings).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,159 @@
 from clickhouse_driver import Client
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from glob import glob
 from tabulate import tabulate
 from time import sleep
-import re
-
-client = Client(
-    host='localhost',
-    user='default',
-    password='',
-    database='course_db'
-)
+import statistics
+import sys
+import time
+import uuid
+
+from columnar_server import ColumnarServer
+from load_controller import percentile
+from log_reader import read_log_blocks
+from query_log_collector import QueryLogCollector
+from retry_policy import execute_with_retry
+
+CH_CONFIG = {
+    'host': 'localhost',
+    'user': 'default',
+    'password': '',
+    'database': 'course_db'
+}
+# Фабрика соединений: clickhouse_driver.Client или клиент локального сервера (--fake)
+client_factory = Client
+client = Client(**CH_CONFIG)
+server = None
 #log_tables = ['logs_full_scan', 'logs_ordered', 'logs_with_indexes', 'logs_with_projections']
 log_tables = ['logs_with_indexes_v2']
 with open('queries_select/queries_rand.txt', 'r') as f:
     queries = [(line.strip(), f"query_{idx}") for idx, line in enumerate(f.readlines(), 1)]
 
+# Параметры прогона
+BENCHMARK = {
+    'warmup': 1,            # Прогревочные запуски (не учитываются)
+    'repetitions': 5,       # Замеряемые запуски каждого запроса
+    'passes': ['warm'],     # 'cold' - со сбросом кешей перед каждым запуском, 'warm' - без
+    'flush_timeout_sec': 30 # Сколько ждать появления запросов в system.query_log
+}
 
-def execute_with_retry(query, params=None, max_retries=3, initial_retry_delay=5):
-    retry_delay = initial_retry_delay
-    for attempt in range(max_retries):
-        try:
-            return client.execute(query, params) if params else client.execute(query)
-        except Exception as e:
-            if "CPU is overloaded" in str(e) and attempt < max_retries - 1:
-                print(f"CPU overload detected, retrying in {retry_delay} seconds (attempt {attempt + 1}/{max_retries})")
-                sleep(retry_delay)
-                retry_delay *= 2
-                continue
-            raise e
-    return None
+# Нагрузочный режим: K клиентов одновременно выполняют запросы из queries_select/*.txt
+LOAD_TEST = {
+    'clients': 8,
+    'duration_sec': 30,
+    'executor': 'thread',   # 'thread' или 'process'
+    'workload_files': 'queries_select/*.txt'
+}
+
+# Локальный columnar_server.ColumnarServer вместо ClickHouse: таблицы log_tables со схемой
+# logs_ordered заполняются строками csv_file. Статистика запросов собирается на клиенте
+FAKE_SERVER = {
+    'csv_file': 'data/logs_data_3_000.csv',
+    'base_latency': 0.001,
+    'per_granule_latency': 0.00002,
+    'index_granularity': 256,
+}
+FAKE_TABLE_DDL = """
+    CREATE TABLE {table} (
+        timestamp DateTime,
+        login LowCardinality(String),
+        event LowCardinality(String),
+        subsystem LowCardinality(String),
+        comment String,
+        description String
+    ) ENGINE = MergeTree()
+    ORDER BY (timestamp, login, event, subsystem)
+    SETTINGS index_granularity = {granularity}
+"""
+# query_id -> строка как из system.query_log (для локального сервера)
+local_stats = {}
+
+COLD_CACHE_QUERIES = [
+    "SYSTEM DROP MARK CACHE",
+    "SYSTEM DROP UNCOMPRESSED CACHE",
+]
+
+
+def use_fake_server():
+    global client_factory, client, server
+    server = ColumnarServer(base_latency=FAKE_SERVER['base_latency'],
+                            per_granule_latency=FAKE_SERVER['per_granule_latency'])
+    for table in log_tables:
+        server.create(FAKE_TABLE_DDL.format(table=table, granularity=FAKE_SERVER['index_granularity']))
+        for block in read_log_blocks(FAKE_SERVER['csv_file']):
+            server.execute(block.insert_query(table), block.data(), columnar=True)
+    client_factory = server.client
+    client = server.client(**CH_CONFIG)
+
+
+def fetch_query_stats(query_ids, timeout):
+    # Статистика по query_id сразу после сброса журналов, без фиксированных пауз
+    if server:
+        return [local_stats[query_id] for query_id in query_ids if query_id in local_stats]
+    log_query = """
+        SELECT
+            query_id,
+            tables,
+            query,
+            event_time,
+            query_duration_ms,
+            read_rows,
+            read_bytes,
+            memory_usage,
+            projections,
+            views
+        FROM system.query_log
+        WHERE type = 'QueryFinish'
+          AND query_id IN %(query_ids)s
+    """
+    deadline = time.time() + timeout
+    while True:
+        execute_with_retry(client, "SYSTEM FLUSH LOGS")
+        stats = execute_with_retry(client, log_query, {'query_ids': list(query_ids)}) or []
+        if len(stats) >= len(query_ids) or time.time() > deadline:
+            return stats
+        sleep(0.2)
+
+
+def run_query(query, query_id, cold):
+    if cold:
+        for cache_query in COLD_CACHE_QUERIES:
+            execute_with_retry(client, cache_query)
+    start = time.perf_counter()
+    result = execute_with_retry(client, query, query_id=query_id)
+    if server and query_id:
+        # У локального сервера нет system.query_log: время на клиенте, прочитанное - из progress
+        progress = client.last_query.progress
+        local_stats[query_id] = (query_id, [], query, None, (time.perf_counter() - start) * 1000,
+                                 progress.rows, progress.bytes, 0, [], [])
+    return result
+
+
+def summarize(table, pass_name, stats):
+    durations = [stat[4] for stat in stats]
+    read_rows = [stat[5] for stat in stats]
+    memory = [stat[7] for stat in stats]
+    return [
+        table, pass_name, len(stats),
+        statistics.median(durations),
+        percentile(durations, 95),
+        statistics.stdev(durations) if len(durations) > 1 else 0.0,
+        statistics.median(read_rows),
+        statistics.median(memory),
+    ]
 
 
 def run_benchmark():
+    run_id = uuid.uuid4().hex[:8]
+    # Строки журнала запросов прогона сохраняет фоновый сборщик (query_log_collector.py)
+    collector = nullcontext() if server else QueryLogCollector('select', run_id=run_id, query_id_prefix=run_id,
+                                                                    config=CH_CONFIG)
+    with collector:
+        run_conditions(run_id)
+
+
+def run_conditions(run_id):
     for condition, query_name in queries:
         print(f"\n{'=' * 50}")
         print(f"Running benchmark for query type: {query_name}")
@@ -38,91 +161,153 @@ def run_benchmark():
         print(f"{'=' * 50}\n")
 
         results = []
-        test_queries = []
+        query_ids = {}
 
         for table in log_tables:
             query = f"SELECT count(*) FROM {table} WHERE {condition}"
-            test_queries.append(query)
             print(f"Executing query on {table}:")
             print(query)
 
-            try:
-                count = execute_with_retry(query)
-                if count:
-                    print(f"Result count: {count[0][0]}\n")
-                sleep(5)
-            except Exception as e:
-                print(f"Error executing query: {str(e)}\n")
-                continue
-
-        sleep(10)
-
-        # Создаем точное условие для поиска выполненных запросов
-        query_pattern = "|".join([re.escape(q) for q in test_queries])
-        log_query = """
-            SELECT 
-                tables,
-                query,
-                event_time,
-                query_duration_ms,
-                read_rows,
-                read_bytes,
-                memory_usage,
-                projections,
-                views
-            FROM system.query_log
-            WHERE type = 'QueryFinish'
-              AND query_duration_ms > 0
-              AND match(query, %(query_pattern)s)
-            ORDER BY event_time DESC
-            LIMIT %(limit)s
-        """
+            for pass_name in BENCHMARK['passes']:
+                cold = pass_name == 'cold'
+                try:
+                    for _ in range(BENCHMARK['warmup']):
+                        run_query(query, None, cold)
 
-        try:
-            stats = execute_with_retry(log_query, {
-                'query_pattern': query_pattern,
-                'limit': len(log_tables)
-            })
-
-            if stats:
-                for stat in stats:
-                    tables_array = stat[0] if isinstance(stat[0], list) else [stat[0]]
-
-                    insert_params = {
-                        'tables': tables_array,
-                        'query': stat[1],
-                        'event_time': stat[2],
-                        'query_duration_ms': stat[3],
-                        'read_rows': stat[4],
-                        'read_bytes': stat[5],
-                        'memory_usage': stat[6],
-                        'projections': stat[7],
-                        'views': stat[8]
-                    }
-
-                    execute_with_retry("""
-                        INSERT INTO test_query_log VALUES
-                        (%(tables)s, %(query)s, %(event_time)s, %(query_duration_ms)s,
-                        %(read_rows)s, %(read_bytes)s, %(memory_usage)s,
-                        %(projections)s, %(views)s)
-                        """, insert_params)
-
-                    print("Successfully inserted query log data into test_select_query table\n")
-                    results.append(list(stat))
+                    for repetition in range(BENCHMARK['repetitions']):
+                        query_id = f"{run_id}-{query_name}-{table}-{pass_name}-{repetition}"
+                        count = run_query(query, query_id, cold)
+                        query_ids[query_id] = (table, pass_name)
+                    if count:
+                        print(f"Result count ({pass_name}): {count[0][0]}\n")
+                except Exception as e:
+                    print(f"Error executing query: {str(e)}\n")
+                    continue
 
+        if not query_ids:
+            continue
+
+        try:
+            stats = fetch_query_stats(query_ids, BENCHMARK['flush_timeout_sec'])
         except Exception as e:
             print(f"Error getting query log: {str(e)}\n")
             continue
 
+        for table in log_tables:
+            for pass_name in BENCHMARK['passes']:
+                cell = [stat for stat in stats if query_ids.get(stat[0]) == (table, pass_name)]
+                if cell:
+                    results.append(summarize(table, pass_name, cell))
+
         if results:
             headers = [
-                'Table', 'Query Text', 'Execution Time',
-                'Duration (ms)', 'Rows Read', 'Bytes Read',
-                'Memory Usage', 'Projections', 'Views'
+                'Table', 'Pass', 'Runs', 'Median (ms)', 'p95 (ms)', 'Stddev (ms)',
+                'Median Rows Read', 'Median Memory'
             ]
             print(tabulate(results, headers=headers, tablefmt='grid', floatfmt=".2f"))
         else:
             print("No query log data found for this query type\n")
 
+
+def load_workload(pattern):
+    conditions = []
+    for file_path in sorted(glob(pattern)):
+        with open(file_path, 'r') as f:
+            conditions.extend(line.strip() for line in f if line.strip())
+    return conditions
+
+
+# Один клиент нагрузочного режима: свое соединение, запросы по кругу до конца прогона.
+# Возвращает пары (время окончания запроса, задержка) и число ошибок
+def load_client(args):
+    table, conditions, duration, query_prefix, client_index = args
+    conn = client_factory(**CH_CONFIG)
+    samples = []
+    errors = 0
+    deadline = time.time() + duration
+    n = client_index
+    try:
+        while time.time() < deadline:
+            condition = conditions[n % len(conditions)]
+            start = time.perf_counter()
+            try:
+                conn.execute(f"SELECT count(*) FROM {table} WHERE {condition}",
+                             query_id=f"{query_prefix}-{client_index}-{n}")
+                samples.append((time.time(), time.perf_counter() - start))
+            except Exception:
+                errors += 1
+            n += 1
+    finally:
+        conn.disconnect()
+    return samples, errors
+
+
+def server_read_bytes(query_prefix):
+    if server:
+        # Счетчики локального сервера обнуляются после каждого замера
+        with server.lock:
+            stats = (server.stats['read_bytes'], server.stats['read_rows'])
+            server.stats['read_bytes'] = server.stats['read_rows'] = 0
+        return stats
+    execute_with_retry(client, "SYSTEM FLUSH LOGS")
+    stats = execute_with_retry(client, """
+        SELECT sum(read_bytes), sum(read_rows)
+        FROM system.query_log
+        WHERE type = 'QueryFinish'
+          AND event_date >= yesterday()
+          AND startsWith(query_id, %(prefix)s)
+    """, {'prefix': query_prefix})
+    return stats[0] if stats else (0, 0)
+
+
+def run_load_test():
+    conditions = load_workload(LOAD_TEST['workload_files'])
+    # Локальный сервер живет в этом процессе - клиенты только потоками
+    process = LOAD_TEST['executor'] == 'process' and not server
+    executor_class = ProcessPoolExecutor if process else ThreadPoolExecutor
+    clients = LOAD_TEST['clients']
+    duration = LOAD_TEST['duration_sec']
+    run_id = uuid.uuid4().hex[:8]
+    results = []
+    collector = None if server else QueryLogCollector('select_load', run_id=run_id, query_id_prefix=run_id,
+                                                      config=CH_CONFIG).start()
+
+    for table in log_tables:
+        print(f"Running {clients} concurrent clients against {table} for {duration} sec...")
+        query_prefix = f"{run_id}-load-{table}"
+        tasks = [(table, conditions, duration, query_prefix, i) for i in range(clients)]
+
+        start = time.time()
+        with executor_class(max_workers=clients) as executor:
+            client_results = list(executor.map(load_client, tasks))
+        elapsed = time.time() - start
+
+        latencies = [latency for samples, _ in client_results for _, latency in samples]
+        errors = sum(client_errors for _, client_errors in client_results)
+        read_bytes, read_rows = server_read_bytes(query_prefix)
+        results.append([
+            table, clients, len(latencies), errors,
+            len(latencies) / elapsed,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000,
+            (read_bytes or 0) / elapsed / 1024 / 1024,
+            (read_rows or 0) / elapsed,
+        ])
+
+    if collector:
+        collector.stop()
+    headers = ['Table', 'Clients', 'Queries', 'Errors', 'QPS', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+               'Read MB/s', 'Read rows/s']
+    print(tabulate(results, headers=headers, tablefmt='grid', floatfmt=".2f"))
+
+
 if __name__ == "__main__":
-    run_benchmark()
+    # python select_queries.py [load] [--fake] - load: нагрузочный режим с конкурентными клиентами,
+    # --fake: локальный ColumnarServer вместо ClickHouse
+    if '--fake' in sys.argv:
+        use_fake_server()
+    if 'load' in sys.argv[1:]:
+        run_load_test()
+    else:
+        run_benchmark()
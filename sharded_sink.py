@@ -0,0 +1,124 @@
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from clickhouse_driver import Client
+from tabulate import tabulate
+
+from columnar_batch import ColumnarBatch
+from connection_pool import ConnectionPool
+from load_controller import percentile
+from retry_policy import CONNECTION_ERRORS, CircuitBreaker, RetryPolicy
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def login_shard(values, num_shards):
+    # Стабильный хеш (в отличие от hash() не зависит от PYTHONHASHSEED), кешируется в пределах пакета
+    shards = {}
+    result = []
+    for value in values:
+        shard = shards.get(value)
+        if shard is None:
+            shard = shards[value] = zlib.crc32(value.encode('utf-8')) % num_shards
+        result.append(shard)
+    return result
+
+
+def timestamp_bucket_shard(values, num_shards, bucket_sec):
+    return [int((value - EPOCH).total_seconds()) // bucket_sec % num_shards for value in values]
+
+
+# Шард: свой пул соединений, своя политика повторов и статистика
+class Shard:
+    def __init__(self, index, config, table, pool_settings, retry_settings, breaker_settings, client_factory):
+        self.index = index
+        self.host = ','.join(config.get('hosts') or [config.get('host', 'localhost')])
+        self.table = table
+        self.pool = ConnectionPool(config, client_factory=client_factory, **pool_settings)
+        self.retry_policy = RetryPolicy(**retry_settings, breaker=CircuitBreaker(**breaker_settings))
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.latencies = []
+
+
+# Маршрутизация на стороне клиента: строки пакета раскладываются по шардам по ключу
+# (login или интервал времени) и вставляются сразу в локальные таблицы шардов,
+# без Distributed-таблицы и ее временных файлов
+class ShardedSink:
+    def __init__(self, ch_config, settings, pool_settings, retry_settings, breaker_settings, client_factory=Client):
+        self.key = settings['key']
+        self.bucket_sec = settings['timestamp_bucket_sec']
+        self.shards = [
+            Shard(index, {**ch_config, **shard_config}, shard_config.get('table', settings['local_table']),
+                  pool_settings, retry_settings, breaker_settings, client_factory)
+            for index, shard_config in enumerate(settings['shards'])
+        ]
+        self.start_time = time.time()
+
+    def shard_indexes(self, batch):
+        if self.key == 'login':
+            return login_shard(batch.column('login'), len(self.shards))
+        if self.key == 'timestamp_bucket':
+            return timestamp_bucket_shard(batch.column('timestamp'), len(self.shards), self.bucket_sec)
+        raise ValueError(f"Unknown sharding key: {self.key}")
+
+    def split(self, batch):
+        rows = [[] for _ in self.shards]
+        for row, shard in enumerate(self.shard_indexes(batch)):
+            rows[shard].append(row)
+        columns = batch.data()
+        parts = []
+        for shard_rows in rows:
+            part = ColumnarBatch.from_columns([[column[i] for i in shard_rows] for column in columns],
+                                              batch.column_names)
+            part.enqueued_at = batch.enqueued_at
+            part.spool_seq = batch.spool_seq
+            parts.append(part)
+        return parts
+
+    def send(self, batch, insert_func):
+        # insert_func(conn, part, table, retry_policy); при повторной отправке пакета уже
+        # вставленные части отбрасываются сервером по токену дедупликации
+        for shard, part in zip(self.shards, self.split(batch)):
+            if not len(part):
+                continue
+            conn = shard.pool.get_connection()
+            broken = False
+            start = time.time()
+            try:
+                insert_func(conn, part, shard.table, shard.retry_policy)
+            except CONNECTION_ERRORS:
+                broken = True
+                raise
+            finally:
+                shard.pool.return_connection(conn, broken=broken)
+            with shard.lock:
+                shard.rows += len(part)
+                shard.latencies.append(time.time() - start)
+
+    def cooldown(self, batch):
+        # Пауза после неудачной отправки - по политикам шардов, в которые попадают строки
+        # пакета: открытый предохранитель одного шарда не должен зависеть от остальных
+        shards = set(self.shard_indexes(batch)) if len(batch) else range(len(self.shards))
+        return max(self.shards[index].retry_policy.cooldown() for index in shards)
+
+    def report(self):
+        duration = time.time() - self.start_time
+        total = sum(shard.rows for shard in self.shards)
+        mean = total / len(self.shards)
+        rows = [[
+            shard.index, shard.host, shard.table, shard.rows,
+            f"{shard.rows / total * 100 if total else 0:.1f}",
+            f"{shard.rows / duration:.0f}",
+            f"{percentile(shard.latencies, 99) * 1000:.1f}",
+        ] for shard in self.shards]
+        skew = max(shard.rows for shard in self.shards) / mean if mean else 0
+        table = tabulate(rows, headers=['Shard', 'Host', 'Table', 'Rows', 'Share %', 'Rows/sec', 'Insert p99 (ms)'],
+                         tablefmt='grid')
+        return f"Sharded insert by {self.key}, skew (max/mean rows) {skew:.2f}\n{table}"
+
+    def close(self):
+        for shard in self.shards:
+            shard.pool.close_all()
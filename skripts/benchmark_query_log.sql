@@ -0,0 +1,31 @@
+use course_db;
+
+-- Таблица заполняется сборщиком query_log_collector.py (CREATE TABLE IF NOT EXISTS при запуске)
+
+-- Сводка по вариантам последнего прогона бенчмарка
+SELECT
+    variant,
+    count() AS queries,
+    quantile(0.5)(query_duration_ms) AS median_ms,
+    quantile(0.95)(query_duration_ms) AS p95_ms,
+    sum(read_rows) AS total_read_rows,
+    sum(written_rows) AS total_written_rows,
+    max(memory_usage) AS max_memory,
+    sum(user_cpu_us) / 1e6 AS cpu_sec
+FROM benchmark_query_log
+WHERE benchmark = 'select'
+  AND run_id = (SELECT argMax(run_id, event_time) FROM benchmark_query_log WHERE benchmark = 'select')
+GROUP BY variant
+ORDER BY median_ms;
+
+
+-- Сравнение прогонов одного бенчмарка
+SELECT
+    run_id,
+    min(event_time) AS started,
+    count() AS queries,
+    quantile(0.5)(query_duration_ms) AS median_ms
+FROM benchmark_query_log
+WHERE benchmark = 'select'
+GROUP BY run_id
+ORDER BY started DESC;
@@ -2,6 +2,7 @@ use course_db;
 
 DROP TABLE IF EXISTS logs_buffer;
 DROP TABLE IF EXISTS logs_insert_test;
+DROP TABLE IF EXISTS logs_insert_dict;
 
 CREATE TABLE logs_insert_test (
     timestamp DateTime,
@@ -11,7 +12,22 @@ CREATE TABLE logs_insert_test (
     comment String,
     description String
 ) ENGINE = MergeTree()
-ORDER BY (timestamp, login, event, subsystem);
+ORDER BY (timestamp, login, event, subsystem)
+-- Окно дедупликации по insert_deduplication_token для повторных вставок из спула (spool.py)
+SETTINGS non_replicated_deduplication_window = 1000;
+
+-- Вариант со словарным кодированием (LowCardinality, transport_settings.py, bench_compression.py):
+-- description тоже передается и хранится как LowCardinality
+CREATE TABLE logs_insert_dict (
+    timestamp DateTime,
+    login LowCardinality(String),
+    event LowCardinality(String),
+    subsystem LowCardinality(String),
+    comment String,
+    description LowCardinality(String)
+) ENGINE = MergeTree()
+ORDER BY (timestamp, login, event, subsystem)
+SETTINGS non_replicated_deduplication_window = 1000;
 
 -- Буферная таблица
 CREATE TABLE logs_buffer AS logs_insert_test
@@ -0,0 +1,20 @@
+-- Локальная таблица для вставки по шардам (sharded_sink.py), создается на каждом шарде
+use course_db;
+
+DROP TABLE IF EXISTS logs_local;
+
+CREATE TABLE logs_local (
+    timestamp DateTime,
+    login LowCardinality(String),
+    event LowCardinality(String),
+    subsystem LowCardinality(String),
+    comment String,
+    description String
+) ENGINE = MergeTree()
+ORDER BY (timestamp, login, event, subsystem);
+
+-- Распределение строк по шардам после прогона
+SELECT hostName() AS shard, count() AS rows
+FROM clusterAllReplicas('{cluster}', course_db.logs_local)
+GROUP BY shard
+ORDER BY shard;
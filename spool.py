@@ -0,0 +1,253 @@
+import array
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from columnar_batch import ColumnarBatch
+
+EPOCH = datetime(1970, 1, 1)
+
+# Заголовок записи: номер, длина данных, CRC32 данных
+RECORD_HEADER = struct.Struct('<QII')
+# Заголовок колонки: тип, длина данных
+COLUMN_HEADER = struct.Struct('<BI')
+COLUMN_DATETIME = 1
+COLUMN_STRINGS = 3
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.spool'
+CHECKPOINT_FILE = 'checkpoint'
+
+
+def encode_batch(batch):
+    # Компактный колоночный формат: DateTime - int64 секунд, String - uint32 длины
+    # строк в байтах, затем сами строки подряд
+    parts = [struct.pack('<IH', len(batch), len(batch.column_names))]
+    for name, column in zip(batch.column_names, batch.data()):
+        if column and isinstance(column[0], datetime):
+            kind = COLUMN_DATETIME
+            data = array.array('q', [int((value - EPOCH).total_seconds()) for value in column]).tobytes()
+        else:
+            kind = COLUMN_STRINGS
+            encoded = [value.encode('utf-8') for value in column]
+            data = array.array('I', map(len, encoded)).tobytes() + b''.join(encoded)
+        encoded_name = name.encode('utf-8')
+        parts.append(struct.pack('<B', len(encoded_name)) + encoded_name)
+        parts.append(COLUMN_HEADER.pack(kind, len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+def decode_batch(payload):
+    num_rows, num_columns = struct.unpack_from('<IH', payload)
+    offset = struct.calcsize('<IH')
+    names, columns = [], []
+    for _ in range(num_columns):
+        name_length = payload[offset]
+        names.append(payload[offset + 1:offset + 1 + name_length].decode('utf-8'))
+        offset += 1 + name_length
+        kind, length = COLUMN_HEADER.unpack_from(payload, offset)
+        offset += COLUMN_HEADER.size
+        data = payload[offset:offset + length]
+        offset += length
+        if kind == COLUMN_DATETIME:
+            columns.append([EPOCH + timedelta(seconds=value) for value in array.array('q', data)])
+        else:
+            lengths = array.array('I', data[:4 * num_rows])
+            position = 4 * num_rows
+            column = []
+            for length in lengths:
+                column.append(data[position:position + length].decode('utf-8'))
+                position += length
+            columns.append(column)
+    return ColumnarBatch.from_columns(columns, names)
+
+
+def deduplication_window(conn, table):
+    # Окно дедупликации вставок нереплицируемой MergeTree-таблицы: из SETTINGS таблицы
+    # или из настроек сервера. None - у таблицы другой движок или она не найдена
+    rows = conn.execute("""
+        SELECT engine, engine_full
+        FROM system.tables
+        WHERE database = currentDatabase() AND name = %(table)s
+    """, {'table': table})
+    if not rows:
+        return None
+    engine, engine_full = rows[0]
+    if engine.startswith('Replicated') or not engine.endswith('MergeTree'):
+        return None
+    match = re.search(r"non_replicated_deduplication_window\s*=\s*(\d+)", engine_full)
+    if match:
+        return int(match.group(1))
+    rows = conn.execute("""
+        SELECT value
+        FROM system.merge_tree_settings
+        WHERE name = 'non_replicated_deduplication_window'
+    """)
+    return int(rows[0][0]) if rows else None
+
+
+# Журнал упреждающей записи для пакетов: пакет остается на диске, пока вставка
+# не подтверждена. Файлы-сегменты только дописываются, fsync выполняется пачками
+class BatchSpool:
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync_every=10, fsync_interval_sec=0.5):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval_sec = fsync_interval_sec
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        # Токены дедупликации уникальны в пределах каталога спула
+        self.spool_id = self._load_spool_id()
+        # Подтвержденные номера: непрерывный префикс и отдельные номера выше него
+        self.checkpoint, self.acked = self._read_checkpoint()
+        # Диапазоны номеров в сегментах
+        self.segment_ranges = {path: self._seq_range(path) for path in self.segments()}
+        self.next_seq = max([last for _, last in self.segment_ranges.values()], default=0)
+        self.next_seq = max(self.next_seq, self.checkpoint) + 1
+        self.file = None
+        self.file_path = None
+        self.unsynced = 0
+        self.last_sync = time.time()
+        self.appended = 0
+        self.syncs = 0
+
+    def _load_spool_id(self):
+        path = os.path.join(self.directory, 'spool_id')
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read().strip()
+        spool_id = uuid.uuid4().hex
+        with open(path, 'w') as f:
+            f.write(spool_id)
+        return spool_id
+
+    def insert_token(self, seq):
+        return f"{self.spool_id}-{seq}"
+
+    def segments(self):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _read_checkpoint(self):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return 0, set()
+        with open(path) as f:
+            values = [int(value) for value in f.read().split()]
+        return (values[0], set(values[1:])) if values else (0, set())
+
+    def _write_checkpoint(self):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(' '.join(map(str, [self.checkpoint, *sorted(self.acked)])))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _seq_range(self, path):
+        seqs = [seq for seq, _ in self.read_segment(path)]
+        return (seqs[0], seqs[-1]) if seqs else (0, 0)
+
+    def read_segment(self, path):
+        # Последовательное чтение; недописанная при сбое запись в конце отбрасывается
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                seq, length, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    logging.warning(f"Spool segment {path} is truncated at record {seq}")
+                    break
+                yield seq, payload
+
+    def _open_segment(self, seq):
+        self.file_path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:020d}{SEGMENT_SUFFIX}")
+        self.file = open(self.file_path, 'ab')
+        self.segment_ranges[self.file_path] = (seq, seq)
+
+    def append(self, batch):
+        payload = encode_batch(batch)
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            if self.file is None or self.file.tell() >= self.segment_bytes:
+                self._rotate(seq)
+            self.file.write(RECORD_HEADER.pack(seq, len(payload), zlib.crc32(payload)))
+            self.file.write(payload)
+            self.segment_ranges[self.file_path] = (self.segment_ranges[self.file_path][0], seq)
+            self.appended += 1
+            self.unsynced += 1
+            if (self.unsynced >= self.fsync_every or
+                    time.time() - self.last_sync >= self.fsync_interval_sec):
+                self._sync()
+        return seq
+
+    def _rotate(self, seq):
+        if self.file:
+            self._sync()
+            self.file.close()
+        self._open_segment(seq)
+
+    def _sync(self):
+        if self.file and self.unsynced:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.syncs += 1
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def ack(self, seq):
+        with self.lock:
+            self.acked.add(seq)
+            # Сдвигаем контрольную точку по непрерывной последовательности подтверждений
+            advanced = False
+            while self.checkpoint + 1 in self.acked:
+                self.checkpoint += 1
+                self.acked.discard(self.checkpoint)
+                advanced = True
+            if advanced:
+                self._remove_acked_segments()
+
+    def _remove_acked_segments(self):
+        removed = False
+        for path, (_, last) in list(self.segment_ranges.items()):
+            if path != self.file_path and last <= self.checkpoint:
+                os.remove(path)
+                del self.segment_ranges[path]
+                removed = True
+        if removed:
+            self._write_checkpoint()
+
+    def pending(self):
+        # Неподтвержденные пакеты для повторной отправки после перезапуска
+        with self.lock:
+            self._sync()
+            checkpoint = self.checkpoint
+            acked = set(self.acked)
+        for path in self.segments():
+            for seq, payload in self.read_segment(path):
+                if seq > checkpoint and seq not in acked:
+                    yield seq, decode_batch(payload)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self._sync()
+                self.file.close()
+                self.file = None
+            self._write_checkpoint()
@@ -0,0 +1,158 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tabulate import tabulate
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+# Гистограмма задержек в стиле HdrHistogram: на каждую степень двойки 2^precision_bits
+# линейных корзин, относительная ошибка не больше 2^-precision_bits. Запись - сдвиг
+# и инкремент счетчика, память не растет с числом замеров (в отличие от списка задержек)
+class LatencyHistogram:
+    def __init__(self, precision_bits=7, max_value_sec=3600.0):
+        self.precision_bits = precision_bits
+        self.max_value = int(max_value_sec * 1e6)
+        self.counts = [0] * (self.index(self.max_value) + 1)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, value):
+        shift = max(0, value.bit_length() - self.precision_bits - 1)
+        return (shift << self.precision_bits) + (value >> shift)
+
+    def bucket_high(self, index):
+        # Верхняя граница корзины (мкс)
+        shift = max(0, (index >> self.precision_bits) - 1)
+        low = (index - (shift << self.precision_bits)) << shift
+        return low + (1 << shift) - 1
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        index = self.index(value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        # Значение в секундах, не меньше доли q замеров
+        with self.lock:
+            counts, count, maximum = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        rank = max(1, int(q * count + 0.5))
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bucket_high(index), maximum) / 1e6
+        return maximum / 1e6
+
+    def mean(self):
+        return self.total / self.count / 1e6 if self.count else 0.0
+
+
+# Метрики симулятора: гистограммы по стадиям и gauge-функции, которые вычисляются
+# при каждом запросе /metrics
+class Metrics:
+    def __init__(self, stages, prefix='simulator'):
+        self.prefix = prefix
+        self.histograms = {stage: LatencyHistogram() for stage in stages}
+        self.gauges = {}
+
+    def observe(self, stage, seconds):
+        self.histograms[stage].record(seconds)
+
+    def gauge(self, name, func, description=''):
+        self.gauges[name] = (func, description)
+
+    def render(self):
+        # Текстовый формат Prometheus: стадии - summary с квантилями, остальное - gauge
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Latency of simulator stages", f"# TYPE {name} summary"]
+        for stage, histogram in self.histograms.items():
+            for q in QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {histogram.quantile(q):.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total / 1e6:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        for gauge, (func, description) in self.gauges.items():
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f"# HELP {self.prefix}_{gauge} {description}")
+            lines.append(f"# TYPE {self.prefix}_{gauge} gauge")
+            lines.append(f"{self.prefix}_{gauge} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        rows = [[stage, histogram.count, f"{histogram.mean() * 1000:.2f}",
+                 *(f"{histogram.quantile(q) * 1000:.2f}" for q in QUANTILES), f"{histogram.max / 1000:.2f}"]
+                for stage, histogram in self.histograms.items() if histogram.count]
+        return tabulate(rows, headers=['Stage', 'Count', 'Mean (ms)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)',
+                                       'p99.9 (ms)', 'Max (ms)'], tablefmt='grid')
+
+
+# Локальный HTTP endpoint /metrics в отдельном потоке
+class MetricsServer:
+    def __init__(self, metrics, host='127.0.0.1', port=9464):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True)
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_queue_logging(*handlers, level=logging.INFO, fmt='%(asctime)s - %(levelname)s - %(message)s'):
+    # Логгер только кладет запись в очередь, форматирование и запись в файл/консоль -
+    # в потоке QueueListener, вне потоков вставки. Как и basicConfig, ничего не делает,
+    # если у корневого логгера уже есть обработчики
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    formatter = logging.Formatter(fmt)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    # Оставшиеся в очереди записи дописываются при выходе
+    atexit.register(listener.stop)
+    return listener
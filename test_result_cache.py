@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from result_cache import timestamp_range
+
+
+def test_range_from_where_clause():
+    query = "select count() from logs where timestamp >= '2020-01-01' and timestamp < '2021-01-01 00:00:00'"
+    assert timestamp_range(query) == (datetime(2020, 1, 1), datetime(2021, 1, 1))
+
+
+def test_subquery_bounds_are_not_applied_to_outer_query():
+    query = ("SELECT count() FROM logs WHERE timestamp > '2020-01-01' AND login IN "
+             "(SELECT login FROM u WHERE timestamp < '1990-01-01')")
+    assert timestamp_range(query) == (None, None)
+
+
+def test_where_inside_literal_is_ignored():
+    query = "SELECT count() FROM logs WHERE comment = 'select where' AND timestamp = '2020-05-05 00:00:00'"
+    assert timestamp_range(query) == (datetime(2020, 5, 5), datetime(2020, 5, 5))
+
+
+def test_unparsable_literal_is_unbounded():
+    assert timestamp_range("SELECT count() FROM logs WHERE timestamp >= '20200101'") == (None, None)
@@ -0,0 +1,58 @@
+import pytest
+from clickhouse_driver.errors import ErrorCodes, ServerException
+
+from retry_policy import SERVER_OVERLOADED, CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+class Conn:
+    def __init__(self, *results):
+        self.results = list(results)
+
+    def execute(self, query, *args, **kwargs):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_fatal_probe_releases_half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_sec=0.0)
+    policy = RetryPolicy(max_retries=1, breaker=breaker, sleep=lambda delay: None)
+    conn = Conn(ServerException('overloaded', SERVER_OVERLOADED),
+                ServerException('unknown table', ErrorCodes.UNKNOWN_TABLE),
+                [(1,)])
+    with pytest.raises(ServerException):
+        policy.execute(conn, 'SELECT 1')
+    assert breaker.state == 'half_open'
+
+    # Пробный запрос с ошибкой запроса (не сервера) не оставляет предохранитель занятым
+    with pytest.raises(ServerException):
+        policy.execute(conn, 'SELECT 1 FROM missing')
+    assert not breaker.probe_in_flight
+    assert policy.execute(conn, 'SELECT 1') == [(1,)]
+    assert breaker.state == 'closed'
+
+
+def test_open_breaker_sheds_calls():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_sec=60.0)
+    policy = RetryPolicy(max_retries=1, breaker=breaker, sleep=lambda delay: None)
+    with pytest.raises(ServerException):
+        policy.execute(Conn(ServerException('overloaded', SERVER_OVERLOADED)), 'SELECT 1')
+    with pytest.raises(CircuitOpenError):
+        policy.execute(Conn([(1,)]), 'SELECT 1')
+
+
+def test_client_error_releases_probe_without_closing_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_sec=0.0)
+    policy = RetryPolicy(max_retries=1, breaker=breaker, sleep=lambda delay: None)
+    conn = Conn(ServerException('overloaded', SERVER_OVERLOADED), TypeError('bad column'), [(1,)])
+    with pytest.raises(ServerException):
+        policy.execute(conn, 'SELECT 1')
+
+    # Ошибка на клиенте не закрывает предохранитель, но следующий запрос снова пробный
+    with pytest.raises(TypeError):
+        policy.execute(conn, 'INSERT INTO logs VALUES')
+    assert breaker.state == 'half_open'
+    assert not breaker.probe_in_flight
+    assert policy.execute(conn, 'SELECT 1') == [(1,)]
+    assert breaker.state == 'closed'
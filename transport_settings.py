@@ -0,0 +1,89 @@
+import time
+
+from clickhouse_driver.block import ColumnOrientedBlock
+from clickhouse_driver.bufferedwriter import BufferedSocketWriter
+from clickhouse_driver.compression import get_compressor_cls
+from clickhouse_driver.connection import ServerInfo
+from clickhouse_driver.context import Context
+from clickhouse_driver.defines import BUFFER_SIZE, DEFAULT_COMPRESS_BLOCK_SIZE, CLIENT_REVISION
+from clickhouse_driver.streams.native import BlockOutputStream
+
+# Типы колонок logs_insert_test (skripts/test_insert.sql)
+LOG_COLUMN_TYPES = {
+    'timestamp': 'DateTime',
+    'login': 'LowCardinality(String)',
+    'event': 'LowCardinality(String)',
+    'subsystem': 'LowCardinality(String)',
+    'comment': 'String',
+    'description': 'String',
+}
+# Колонки logs_insert_test типа String с небольшим числом значений: в logs_insert_dict
+# они LowCardinality, и драйвер передает их словарем и индексами в нем
+LOW_CARDINALITY_COLUMNS = ('description',)
+# Сжатие на стороне клиента (параметр compression у clickhouse_driver.Client)
+COMPRESSION_METHODS = [None, 'lz4', 'zstd']
+
+
+# Сокет-заглушка: считает байты, которые драйвер отправил бы серверу
+class ByteCounter:
+    def __init__(self):
+        self.bytes = 0
+
+    def sendall(self, data):
+        self.bytes += len(data)
+
+
+def create_context():
+    context = Context()
+    context.settings = {}
+    context.client_settings = {
+        'strings_as_bytes': False,
+        'strings_encoding': 'utf-8',
+        'use_numpy': False,
+        'input_format_null_as_default': False,
+    }
+    context.server_info = ServerInfo('ClickHouse', 23, 8, 0, CLIENT_REVISION, 'UTC', 'local', CLIENT_REVISION)
+    return context
+
+
+def wire_bytes(batch, column_types=LOG_COLUMN_TYPES, compression=None, context=None):
+    # Размер блока данных INSERT в Native-протоколе: пакет сериализуется
+    # самим драйвером, как при client.execute(..., columnar=True)
+    counter = ByteCounter()
+    fout = BufferedSocketWriter(counter, BUFFER_SIZE)
+    context = context or create_context()
+    if compression:
+        # Модуль требует clickhouse-cityhash, поэтому импортируется только при сжатии
+        from clickhouse_driver.streams.compressed import CompressedBlockOutputStream
+        stream = CompressedBlockOutputStream(get_compressor_cls(compression), DEFAULT_COMPRESS_BLOCK_SIZE,
+                                             fout, context)
+    else:
+        stream = BlockOutputStream(fout, context)
+    types = [(name, column_types[name]) for name in batch.column_names]
+    stream.write(ColumnOrientedBlock(types, batch.data()))
+    return counter.bytes
+
+
+# Параметры передачи пакетов: сжатие на стороне клиента и типы колонок. Отдельной
+# обработки пакетов на клиенте нет: словарное кодирование делает сам драйвер при
+# сериализации колонок LowCardinality, оно определяется схемой целевой таблицы
+class TransportSettings:
+    def __init__(self, low_cardinality_columns=(), compression=None):
+        self.low_cardinality_columns = tuple(low_cardinality_columns)
+        self.compression = compression
+
+    def client_settings(self):
+        # Дополнительные параметры clickhouse_driver.Client
+        return {'compression': self.compression} if self.compression else {}
+
+    def column_types(self, column_types=LOG_COLUMN_TYPES):
+        return {name: f"LowCardinality({column_type})"
+                if name in self.low_cardinality_columns and not column_type.startswith('LowCardinality')
+                else column_type
+                for name, column_type in column_types.items()}
+
+    def measure(self, batch, column_types=LOG_COLUMN_TYPES):
+        # Байты на проводе и процессорное время потока (сериализация + сжатие)
+        start = time.thread_time()
+        size = wire_bytes(batch, self.column_types(column_types), self.compression)
+        return size, time.thread_time() - start
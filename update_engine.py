@@ -0,0 +1,195 @@
+import itertools
+import re
+import threading
+import time
+
+from clickhouse_driver.errors import ServerException
+
+from columnar_batch import LOG_COLUMNS
+from retry_policy import execute_with_retry
+
+# Версионированная таблица для обновлений вставкой: строка определяется ключом сортировки,
+# из строк с одним ключом после слияния (или при чтении с FINAL) остается строка с
+# наибольшей version; is_deleted = 1 - строка удалена
+KEY_COLUMNS = ('timestamp', 'login', 'event', 'subsystem')
+VERSIONED_COLUMNS = LOG_COLUMNS + ('version', 'is_deleted')
+VERSIONED_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        timestamp DateTime,
+        login LowCardinality(String),
+        event LowCardinality(String),
+        subsystem LowCardinality(String),
+        comment String,
+        description String,
+        version UInt64,
+        is_deleted UInt8
+    ) ENGINE = ReplacingMergeTree(version, is_deleted)
+    ORDER BY (timestamp, login, event, subsystem)
+    SETTINGS {settings}
+"""
+# Для легковесного UPDATE (ClickHouse 25.7+) нужны номера блоков и строк в частях
+LIGHTWEIGHT_SETTINGS = 'enable_block_number_column = 1, enable_block_offset_column = 1'
+
+# Коды ошибок "не поддерживается этой версией сервера"
+UNSUPPORTED_CODES = {
+    48,   # NOT_IMPLEMENTED
+    62,   # SYNTAX_ERROR
+    115,  # UNKNOWN_SETTING
+    344,  # SUPPORT_IS_DISABLED
+}
+
+
+class UnsupportedStrategyError(Exception):
+    pass
+
+
+def create_versioned_table(conn, table, lightweight=False):
+    settings = LIGHTWEIGHT_SETTINGS if lightweight else 'index_granularity = 8192'
+    execute_with_retry(conn, VERSIONED_DDL.format(table=table, settings=settings))
+
+
+def set_clause(values):
+    # {'comment': 'x'} -> "comment = %(set_comment)s" и параметры запроса
+    for column in values:
+        if column in KEY_COLUMNS or column not in LOG_COLUMNS:
+            raise ValueError(f"Column {column} can not be updated")
+    clause = ', '.join(f"{column} = %(set_{column})s" for column in values)
+    return clause, {f"set_{column}": value for column, value in values.items()}
+
+
+# Обновление мутацией: ALTER TABLE ... UPDATE переписывает затронутые части целиком
+class MutationStrategy:
+    name = 'mutation'
+    read_final = False
+
+    def __init__(self, conn, table, sync=True):
+        self.conn = conn
+        self.table = table
+        self.settings = {'mutations_sync': 2} if sync else {}
+
+    def update(self, where, values):
+        clause, params = set_clause(values)
+        execute_with_retry(self.conn, f"ALTER TABLE {self.table} UPDATE {clause} WHERE {where}", params,
+                           settings=self.settings)
+
+    def delete(self, where):
+        execute_with_retry(self.conn, f"ALTER TABLE {self.table} DELETE WHERE {where}", settings=self.settings)
+
+    def flush(self):
+        return 0
+
+
+# Легковесные DELETE FROM и UPDATE ... SET: строки помечаются маской / патч-частями,
+# без перезаписи частей. Если сервер их не поддерживает - UnsupportedStrategyError
+class LightweightStrategy(MutationStrategy):
+    name = 'lightweight'
+
+    def __init__(self, conn, table):
+        super().__init__(conn, table)
+
+    def execute(self, query, params=None, settings=None):
+        try:
+            execute_with_retry(self.conn, query, params, settings=settings)
+        except ServerException as e:
+            if e.code in UNSUPPORTED_CODES:
+                raise UnsupportedStrategyError(f"Server does not support: {query.split(' WHERE')[0]} ({e.code})")
+            raise
+
+    def update(self, where, values):
+        clause, params = set_clause(values)
+        self.execute(f"UPDATE {self.table} SET {clause} WHERE {where}", params,
+                     settings={'allow_experimental_lightweight_update': 1})
+
+    def delete(self, where):
+        self.execute(f"DELETE FROM {self.table} WHERE {where}", settings={'lightweight_deletes_sync': 2})
+
+
+# Обновление вставкой: текущие строки под условием читаются с FINAL, получают новые
+# значения и следующую версию и вставляются пакетом. Запросы копятся до batch_requests
+# и отправляются одной вставкой; при чтении нужен FINAL, пока части не слились
+class ReinsertStrategy:
+    name = 'reinsert'
+    read_final = True
+
+    def __init__(self, conn, table, batch_requests=100):
+        self.conn = conn
+        self.table = table
+        self.batch_requests = batch_requests
+        self.lock = threading.Lock()
+        self.pending = []
+        # Версия - наносекунды с эпохи, в пределах процесса строго возрастает
+        self.versions = itertools.count(time.time_ns())
+        self.rows_written = 0
+
+    def update(self, where, values):
+        set_clause(values)
+        self.add(where, values, deleted=False)
+
+    def delete(self, where):
+        self.add(where, {}, deleted=True)
+
+    def add(self, where, values, deleted):
+        # Строки запроса выбираются по таблице, а не по ожидающим изменениям пакета: если
+        # условие использует колонку, которую меняет ожидающий запрос (comment = 'x' после
+        # SET comment = 'x'), пакет сначала отправляется, чтобы условие видело новые значения
+        with self.lock:
+            changed = {column for _, pending_values, _ in self.pending for column in pending_values}
+        if any(re.search(rf"\b{column}\b", where) for column in changed):
+            self.flush()
+        with self.lock:
+            self.pending.append((where, values, deleted))
+            full = len(self.pending) >= self.batch_requests
+        if full:
+            self.flush()
+
+    def current_rows(self, where):
+        columns = execute_with_retry(self.conn, f"""
+            SELECT {', '.join(LOG_COLUMNS)}
+            FROM {self.table} FINAL
+            WHERE ({where}) AND NOT is_deleted
+        """, columnar=True)
+        return list(zip(*columns)) if columns else []
+
+    def flush(self):
+        # Строки с одним ключом в пакете объединяются: более поздний запрос применяется
+        # поверх изменений более раннего, а не поверх старых значений из таблицы
+        with self.lock:
+            requests, self.pending = self.pending, []
+        if not requests:
+            return 0
+        key_size = len(KEY_COLUMNS)
+        rows = {}
+        for where, values, deleted in requests:
+            version = next(self.versions)
+            for row in self.current_rows(where):
+                key = row[:key_size]
+                current = rows.get(key)
+                if current and current[-1]:
+                    continue
+                updated = dict(zip(LOG_COLUMNS, current[:len(LOG_COLUMNS)] if current else row))
+                updated.update(values)
+                rows[key] = [*(updated[column] for column in LOG_COLUMNS), version, int(deleted)]
+        if rows:
+            columns = [list(column) for column in zip(*rows.values())]
+            execute_with_retry(self.conn, f"INSERT INTO {self.table} ({', '.join(VERSIONED_COLUMNS)}) VALUES",
+                               columns, columnar=True)
+            self.rows_written += len(rows)
+        return len(rows)
+
+
+STRATEGIES = {
+    'mutation': MutationStrategy,
+    'reinsert': ReinsertStrategy,
+    'lightweight': LightweightStrategy,
+}
+
+
+def create_strategy(name, conn, table, **options):
+    return STRATEGIES[name](conn, table, **options)
+
+
+def select_query(strategy, query):
+    # Чтение с учетом стратегии: для версионированных вставок - FINAL после имени таблицы
+    if not strategy.read_final:
+        return query
+    return query.replace(f"FROM {strategy.table}", f"FROM {strategy.table} FINAL", 1)